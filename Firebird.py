@@ -6,20 +6,189 @@
 
 
 from pathlib import WindowsPath
+import os
+import sys
+import time
 import click
 import parseParams
 import parseLayers
-import extractGeometry
-import heatFlow
-import generateOutputFiles
+import profiling
 import subprocess
+# dolfinx, PETSc, MPI and GMSH are only imported once a simulation starts, so that invalid inputs and
+# --validate are reported without loading the FEM stack
 
 
-def initialise_logic(gds_file, xml_file, params_file):
+class SimulationError(Exception):
+    """A problem with the inputs or the simulation, with the message to report to the user."""
+
+
+def load_inputs(gds_file, xml_file, params_file, comm=None):
+    """
+    Reads and checks the parameter file, the layer definitions and the layout, without the FEM stack.
+
+    Args:
+        comm (MPI.Comm): Communicator over which the layout, parsed on rank 0, is shared. None to parse
+                         it without MPI, as --validate does.
+
+    Returns:
+        dict: The parsed inputs: parameters, options, layout, resistor data, layer properties, stack
+              layers, power profiles and probe points.
+
+    Raises:
+        SimulationError: If an input cannot be used.
+    """
+    if params_file is None:
+        raise SimulationError("Error in simulaiton setup: No parameter file specified.")
+
+    try:
+        with profiling.phase("parse_params"):
+            substrate_layer, resist_layer, iterations, delta, ambient_temp, s_sense = parseParams.parse_file(params_file)
+            options = parseParams.parse_options(params_file)
+            probe_points = parseParams.parse_points(options['probe_points'])
+    except ValueError:
+        raise SimulationError("An error occured during setup: Values could not be read from paramter file.")
+
+    print("""\033[92m
+    +---------------------------------+
+    | Extracted simulation parameters |
+    +---------------------------------+
+    \033[0m""")
+    print(f"\nSubstrate layer: {substrate_layer}\nResistor layer: {resist_layer}\nIterations: {iterations}\nDelta: {delta}\nAmbient temperature: {ambient_temp} K")
+
+
+    # ----------------- Find layout dimensions and resistor data ----------------- #
+    # Parsed on rank 0 only and shared with the other ranks
+    import extractGeometry
+    with profiling.phase("geometry"):
+        try:
+            if comm is None:
+                layoutLength, layoutWidth, resistor_data = extractGeometry.read_layout(gds_file, substrate_layer, resist_layer, options)
+            else:
+                layoutLength, layoutWidth, resistor_data = extractGeometry.read_layout_shared(gds_file, substrate_layer, resist_layer, options, comm)
+        except Exception as e:
+            raise SimulationError(f"An error occured during setup: {e}")
+    profiling.annotate(resistors=len(resistor_data))
+
+     # ----------------------- Extract substrate properties ----------------------- #
+    substrate_layer_properties = parseLayers.get_layer_properties(xml_file, substrate_layer)
+    if not type(substrate_layer_properties) == dict:
+        raise SimulationError(substrate_layer_properties)
+
+    # ------------- Every layer of the XML file for the stacked model ------------- #
+    stack_layers = None
+    if options['layers'] == "stack":
+        stack_layers = parseLayers.get_all_layers(xml_file)
+        if not type(stack_layers) == list:
+            raise SimulationError(stack_layers)
+
+    # ---------- Prepare to run simulation if all parameters are correct --------- #
+    if int(layoutLength) == 0 or int(layoutWidth) == 0:
+        raise SimulationError("Dimensions are not workable, please enter a layer with non-zero dimensions.")
+
+    # ------------------ Time-varying resistor powers, if any ------------------ #
+    import powerProfiles
+    try:
+        power_profiles = powerProfiles.load_profiles(params_file, options, resistor_data)
+    except (OSError, ValueError) as e:
+        raise SimulationError(f"An error occured during setup: Power profiles could not be read: {e}")
+
+    return {'substrate_layer': substrate_layer, 'resist_layer': resist_layer, 'iterations': iterations, 'delta': delta,
+            'ambient_temp': ambient_temp, 's_sense': s_sense, 'options': options, 'layout_length': layoutLength,
+            'layout_width': layoutWidth, 'resistor_data': resistor_data, 'substrate_layer_properties': substrate_layer_properties,
+            'stack_layers': stack_layers, 'power_profiles': power_profiles, 'probe_points': probe_points}
+
+
+def validate_inputs(gds_file, xml_file, params_file):
+    """Checks the inputs of a simulation without importing the FEM stack. Returns True if they are usable."""
+    start = time.perf_counter()
+    try:
+        inputs = load_inputs(gds_file, xml_file, params_file)
+    except SimulationError as e:
+        print(f"\n\033[91m{e}\033[0m\n")
+        return False
+
+    print(f"\n\033[92mInputs are valid:\033[0m {len(inputs['resistor_data'])} resistors on a {inputs['layout_length']} x {inputs['layout_width']} μm substrate "
+          f"(checked in {(time.perf_counter() - start) * 1000:.0f} ms)\n")
+    return True
+
+
+def run_simulation(gds_file, xml_file, params_file):
+    """
+    Runs a complete simulation without any prompts: parameter parsing, geometry extraction, meshing and
+    the heat flow solution. Output files are written to the working directory.
+
+    Raises:
+        SimulationError: If the inputs cannot be used or the simulation fails.
+    """
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    inputs = load_inputs(gds_file, xml_file, params_file, comm)
+    options = inputs['options']
+    resistor_data = inputs['resistor_data']
+    layoutLength, layoutWidth = inputs['layout_length'], inputs['layout_width']
+    substrate_layer_properties = inputs['substrate_layer_properties']
+
+    rho_param = substrate_layer_properties['Density']
+    cp_param = substrate_layer_properties['SpecificHeatCapacity']
+    k_param = substrate_layer_properties['ThermalConductivity']
+
+    print("""\033[92m
+    +-----------------------+
+    | Substrate information |
+    +-----------------------+
+    \033[0m""")
+    print(f"Substrate length is {layoutLength} μm and width is {layoutWidth} μm\n")
+
+    # ------------------------ Load the FEM stack only now ------------------------ #
+    import heatFlow
+    import generateOutputFiles
+    import meshCache
+    import adaptiveMesh
+    import jitCache
+    jitCache.configure(options['jit_cache'])
+
+    # ------------------------------ Mesh the layout ----------------------------- #
+    if options['mesher'] == "geo":
+        # Write the geo file, which creates the mesh file upon opening it in GMSH
+        mesh_input = "layoutMesh.msh"
+        geo_file = "layoutMesh.geo"
+        if comm.rank == 0:
+            generateOutputFiles.generate_geo_file(geo_file, layoutLength, layoutWidth, resistor_data, inputs['s_sense'])
+            windows_path = geo_file.replace('/','\\')
+            subprocess.run(['explorer.exe', windows_path])
+        comm.barrier()
+    else:
+        # Mesh headlessly with the GMSH API and keep the mesh in memory
+        with profiling.phase("mesh", mesher=options['mesher']):
+            mesh_input = meshCache.mesh_layout(options, layoutLength, layoutWidth, resistor_data, inputs['s_sense'])
+        if options['mesher'] == "adaptive":
+            # Refine the GMSH mesh until the resistor peak temperatures converge to amr_tol
+            with profiling.phase("adaptive_refinement"):
+                mesh_input, _ = adaptiveMesh.refine_adaptively(mesh_input, resistor_data, float(k_param), options['h_cooling'], inputs['ambient_temp'], options, "amr_report.csv")
+
+    # --------------------- Function call to start simulation -------------------- #
+    try:
+        with profiling.phase("simulate", mode=options['mode'], solver=options['solver']):
+            heatFlow.findHeatSolution(mesh_input, layoutLength, layoutWidth, float(rho_param), float(cp_param), float(k_param), resistor_data, inputs['iterations'], inputs['delta'], options['h_cooling'], inputs['ambient_temp'], source_mode=options['source'], output_every=options['output_every'], output_format=options['output'], output_queue=options['output_queue'], mode=options['mode'], stop_tol=options['stop_tol'], adaptive=bool(options['adaptive']), error_tol=options['error_tol'], dt_max=options['dt_max'], output_dt=options['output_dt'], solver_type=options['solver'], solver_rtol=options['solver_rtol'], layers=inputs['stack_layers'], resistor_layer=inputs['resist_layer'], substrate_layer=inputs['substrate_layer'], k_table=substrate_layer_properties['ThermalConductivityTable'], cp_table=substrate_layer_properties['SpecificHeatCapacityTable'], prop_tol=options['prop_tol'], picard_max=options['picard_max'], power_profiles=inputs['power_profiles'], probe_output=options['probe_output'], probe_every=options['probe_every'], probe_points=inputs['probe_points'])
+    except Exception as e:
+        raise SimulationError(f"Error: There was an error when attempting to simulate: {e}") from e
+
+
+def initialise_logic(gds_file, xml_file, params_file, interactive=True):
     # ---------------------------------------------------------------------------- #
     #         Restart function in case of unsuccessful simulation or setup         #
     # ---------------------------------------------------------------------------- #
     def restart_program():
+        from mpi4py import MPI
+        if MPI.COMM_WORLD.size > 1:
+            # Prompting is not possible under mpirun, and other ranks may be waiting in a collective call
+            print(f"\n\u001b[41;1m=== Exiting program ===\u001b[0m\n")
+            sys.stdout.flush()
+            MPI.COMM_WORLD.Abort(1)
+        if not interactive:
+            # Batch runs report the failure through the exit status instead of prompting
+            print(f"\n\u001b[41;1m=== Exiting program ===\u001b[0m\n")
+            sys.exit(1)
         response = click.prompt("Do you want to restart the program? [y for yes]", type=str)
         if response.lower() == "y":
             command = f"python Firebird.py {gds_file} {xml_file} {params_file}"
@@ -29,64 +198,10 @@ def initialise_logic(gds_file, xml_file, params_file):
         subprocess.run(command, shell=True, capture_output=False, text=True)
 
     # --------------------------- Function entry point --------------------------- #
-    if params_file is not None:
-        try:
-            substrate_layer, resist_layer, iterations, delta, ambient_temp, s_sense = parseParams.parse_file(params_file)
-        except ValueError: 
-            print("\033[91mAn error occured during setup: Values could not be read from paramter file.\033[0m\n")
-            restart_program()
-        else:
-            print("""\033[92m
-            +---------------------------------+
-            | Extracted simulation parameters |
-            +---------------------------------+
-            \033[0m""")
-            print(f"\nSubstrate layer: {substrate_layer}\nResistor layer: {resist_layer}\nIterations: {iterations}\nDelta: {delta}\nAmbient temperature: {ambient_temp} K")
-
-
-            # ----------------- Find layout dimensions and resistor data ----------------- #
-            layoutLength, layoutWidth, resistor_data = extractGeometry.read_gdsii(gds_file, substrate_layer, resist_layer)
-
-             # ----------------------- Extract substrate properties ----------------------- #
-            substrate_layer_properties = parseLayers.get_layer_properties(xml_file, substrate_layer)
-            if not type(substrate_layer_properties) == dict:
-                print(substrate_layer_properties)
-
-            rho_param = substrate_layer_properties['Density']
-            cp_param = substrate_layer_properties['SpecificHeatCapacity']
-            k_param = substrate_layer_properties['ThermalConductivity']
-
-            # ---------- Prepare to run simulation if all parameters are correct --------- #
-            if int(layoutLength) == 0 or int(layoutWidth) == 0:
-                print(f"\n\033[103mDimensions are not workable, please enter a layer with non-zero dimensions.\033[0m\n")
-                restart_program()
-            else:
-                print("""\033[92m
-                +-----------------------+
-                | Substrate information |
-                +-----------------------+
-                \033[0m""")
-                print(f"Substrate length is {layoutLength} μm and width is {layoutWidth} μm\n")
-
-                # -------------------------------- File names -------------------------------- #
-                mesh_file = "layoutMesh.msh"
-                geo_file = "layoutMesh.geo"
-
-                # ------ Create geo file, which also creates the mesh file upon opening ------ #
-                generateOutputFiles.generate_geo_file(geo_file, layoutLength, layoutWidth, resistor_data, s_sense)
-                windows_path = geo_file.replace('/','\\')
-                subprocess.run(['explorer.exe', windows_path])
-
-                # --------------------- Function call to start simulation -------------------- #
-                try:
-                    heatFlow.findHeatSolution(mesh_file, layoutLength, layoutWidth, int(rho_param), int(cp_param), int(k_param), resistor_data, iterations, delta, 1000, ambient_temp)
-                except Exception as e:
-                    print(f"\033[91mError: There was an error when attempting to simulate: {e}\033[0m")
-                    restart_program()
-
-    else:
-        # -------------------- If parameter file is NOT specified -------------------- #
-        print("\n\033[91mError in simulaiton setup: No parameter file specified.\033[0m\n")
+    try:
+        run_simulation(gds_file, xml_file, params_file)
+    except SimulationError as e:
+        print(f"\n\033[91m{e}\033[0m\n")
         restart_program()
 
         
@@ -98,9 +213,23 @@ def initialise_logic(gds_file, xml_file, params_file):
 @click.argument('gds_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
 @click.argument('xml_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
 @click.argument('params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
-def initialise(gds_file, xml_file, params):
+@click.option('--profile', is_flag=True, help="Record the wall/CPU time, peak memory and sizes of every phase as a Chrome trace.")
+@click.option('--profile-output', default="firebird_trace.json", show_default=True, help="Trace file written with --profile.")
+@click.option('--cprofile', 'use_cprofile', is_flag=True, help="With --profile, also write cProfile statistics of the slowest phase.")
+@click.option('--validate', is_flag=True, help="Only check the GDS, XML and parameter files, without loading the FEM stack.")
+@click.option('--non-interactive', is_flag=True, help="Exit with status 1 on errors instead of offering a restart.")
+def initialise(gds_file, xml_file, params, profile, profile_output, use_cprofile, validate, non_interactive):
     """Initialise the tool with a required GDSII file, XML LDF file and parameter file."""
 
+    # --------------- Input check without dolfinx, PETSc or MPI --------------- #
+    if validate:
+        sys.exit(0 if validate_inputs(gds_file, xml_file, params) else 1)
+
+    # ------------- Under mpirun only rank 0 reports to the terminal ------------- #
+    from mpi4py import MPI
+    if MPI.COMM_WORLD.rank != 0:
+        sys.stdout = open(os.devnull, 'w')
+
     # --------------------------- Print welcome message -------------------------- #
     print(
         """\033[96m 
@@ -111,7 +240,13 @@ def initialise(gds_file, xml_file, params):
     ================================================================================================ 
         \033[0m"""
     ) 
-    initialise_logic(gds_file, xml_file, params)
+    if profile:
+        profiling.enable(profile_output, use_cprofile)
+    try:
+        # Without a terminal to answer the restart prompt, errors end the run like --non-interactive
+        initialise_logic(gds_file, xml_file, params, interactive=not non_interactive and sys.stdin.isatty())
+    finally:
+        profiling.finish()
 
 
 if __name__ == '__main__':
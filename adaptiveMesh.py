@@ -0,0 +1,238 @@
+# ==============================================================================================
+# Adaptive mesh refinement: solve, estimate, mark, refine
+# ==============================================================================================
+#
+# Example:
+#   python adaptiveMesh.py skripsieTest.gds defLayers.xml defParams.txt --report amr_report.csv
+#
+# or mesher=adaptive in the parameter file to simulate on the adapted mesh with Firebird.
+#
+# Starting from the GMSH mesh of the layout, every iteration solves the steady-state problem, the
+# long-time limit in which resistor peak temperatures are largest, and computes a residual-based
+# error indicator per cell:
+#
+#   eta_K^2 = h_K^2 ||Q||_K^2 + sum_{interior F of K} h_F / 2 ||[k grad T . n]||_F^2
+#                             + sum_{boundary F of K} h_F ||h_cooling (T - T_ambient) + k grad T . n||_F^2
+#
+# (the element residual of P1 reduces to the source). The cells carrying a fraction theta of the total
+# estimate are marked (Dorfler marking), and refined with Plaza refinement, which keeps the cell and
+# facet tags through the parent maps. The loop stops once the resistor peak temperatures change by
+# less than amr_tol between iterations, or at amr_max_dofs / amr_max_iterations.
+
+import os
+import sys
+import csv
+import time
+import click
+import numpy as np
+from mpi4py import MPI
+from resistorTable import ResistorTable
+
+
+def solve_steady(mesh_data: tuple, resistor_data: ResistorTable, k: float, h_cooling: float, T_ambient: float, options: dict):
+    """
+    Solves the single-layer steady-state problem on a mesh.
+
+    Returns:
+        T (Function): Steady-state temperature.
+        Q (Function): Heat source of the resistors.
+    """
+    import ufl
+    from petsc4py import PETSc
+    from dolfinx import fem
+    from dolfinx.fem import Function, Constant
+    import heatFlow
+
+    domain, cell_tags, facet_tags = mesh_data
+    V = fem.FunctionSpace(domain, ("CG", 1))
+    T = Function(V)
+    u = ufl.TrialFunction(V)
+    v = ufl.TestFunction(V)
+
+    Q = heatFlow.apply_heat_flux_to_resistor_regions(V, domain, cell_tags, resistor_data, options['source'])
+    scalar = lambda value: Constant(domain, PETSc.ScalarType(value))
+    a, L = heatFlow.build_single_layer_forms(u, v, T, Q, None, scalar(k), scalar(h_cooling), scalar(T_ambient), steady=True)
+
+    solver = heatFlow.TransientHeatSolver(a, L, T, heatFlow.add_boundary_conditions(V, domain, facet_tags, T_ambient),
+                                          solver_type=options['solver'], rtol=options['solver_rtol'])
+    solver.step()
+    return T, Q
+
+
+def indicator_form(T, Q, k: float, h_cooling: float, T_ambient: float):
+    """Returns the linear form of the squared error indicators, tested with the DG0 basis of the cells."""
+    import ufl
+    from petsc4py import PETSc
+    from dolfinx import fem
+
+    domain = T.function_space.mesh
+    W = fem.FunctionSpace(domain, ("DG", 0))
+    w = ufl.TestFunction(W)
+    h = ufl.CellDiameter(domain)
+    n = ufl.FacetNormal(domain)
+    # Constants rather than literals, so the compiled form does not depend on the material values
+    k, h_cooling, T_ambient = (fem.Constant(domain, PETSc.ScalarType(value)) for value in (k, h_cooling, T_ambient))
+    flux = k * ufl.grad(T)
+
+    # Every interior facet contributes half of its jump to each neighbour: 2 avg(w) h_F/2 = avg(w) h_F
+    return (w * h ** 2 * Q ** 2 * ufl.dx
+            + ufl.avg(w) * ufl.avg(h) * ufl.jump(flux, n) ** 2 * ufl.dS
+            + w * h * (h_cooling * (T - T_ambient) + ufl.dot(flux, n)) ** 2 * ufl.ds)
+
+
+def error_indicators(T, Q, k: float, h_cooling: float, T_ambient: float):
+    """Returns the squared residual error indicator eta_K^2 of every owned cell."""
+    from petsc4py import PETSc
+    from dolfinx import fem
+    from dolfinx.fem.petsc import assemble_vector
+    import jitCache
+
+    eta = assemble_vector(fem.form(indicator_form(T, Q, k, h_cooling, T_ambient), jit_options=jitCache.JIT_OPTIONS))
+    # Interior facets on a partition boundary are assembled into ghost cells: sum them onto the owners
+    eta.ghostUpdate(addv=PETSc.InsertMode.ADD, mode=PETSc.ScatterMode.REVERSE)
+    values = eta.array.copy()
+    eta.destroy()
+    return values
+
+
+def dorfler_mark(eta2: np.ndarray, theta: float, comm=MPI.COMM_WORLD):
+    """
+    Returns the owned cells with the largest indicators that together carry at least theta of the
+    total estimate. The threshold is found by bisection over all ranks, so no indicators are gathered.
+    """
+    total = comm.allreduce(np.sum(eta2), op=MPI.SUM)
+    low, high = 0.0, comm.allreduce(np.max(eta2, initial=0.0), op=MPI.MAX)
+    for _ in range(60):
+        threshold = 0.5 * (low + high)
+        if comm.allreduce(np.sum(eta2[eta2 >= threshold]), op=MPI.SUM) >= theta * total:
+            low = threshold
+        else:
+            high = threshold
+    return np.flatnonzero(eta2 >= low).astype(np.int32)
+
+
+def refine(mesh_data: tuple, cells: np.ndarray):
+    """Refines the marked cells with Plaza refinement and transfers the cell and facet tags to the new mesh."""
+    from dolfinx import mesh
+
+    domain, cell_tags, facet_tags = mesh_data
+    tdim = domain.topology.dim
+    domain.topology.create_entities(1)
+    domain.topology.create_connectivity(tdim - 1, tdim)
+    edges = mesh.compute_incident_entities(domain.topology, cells, tdim, 1)
+
+    refined, parent_cell, parent_facet = mesh.refine_plaza(domain, edges, False, mesh.RefinementOption.parent_cell_and_facet)
+    refined.topology.create_connectivity(tdim - 1, tdim)
+    refined_cell_tags = mesh.transfer_meshtag(cell_tags, refined, parent_cell)
+    refined_facet_tags = mesh.transfer_meshtag(facet_tags, refined, parent_cell, parent_facet)
+    return refined, refined_cell_tags, refined_facet_tags
+
+
+def refine_adaptively(mesh_data: tuple, resistor_data: ResistorTable, k: float, h_cooling: float, T_ambient: float, options: dict, report_file: str = None):
+    """
+    Runs the solve-estimate-mark-refine loop until the resistor peak temperatures converge to amr_tol.
+
+    Args:
+        mesh_data (tuple): Initial (domain, cell_tags, facet_tags).
+        resistor_data (ResistorTable): The resistors, as returned by extractGeometry.read_gdsii.
+        k (float): Thermal conductivity of the substrate.
+        h_cooling (float): Heat transfer coefficient of the cooling boundary.
+        T_ambient (float): Ambient temperature.
+        options (dict): Optional settings from parseParams.parse_options (amr_tol, amr_theta, amr_max_iterations, amr_max_dofs).
+        report_file (str): CSV file for the dofs-versus-error report, None to only print it.
+
+    Returns:
+        mesh_data (tuple): The adapted (domain, cell_tags, facet_tags).
+        report (list): One dictionary per iteration with the dofs, estimate and peak change.
+    """
+    import probes
+
+    comm = mesh_data[0].comm
+    numbers = probes.resistor_numbers(resistor_data)
+    previous_peak = None
+    report = []
+
+    print(f"\n{'iter':>4} {'dofs':>10} {'cells':>10} {'estimate':>10} {'peak (K)':>10} {'change (K)':>11} {'time (s)':>9}")
+    for iteration in range(options['amr_max_iterations'] + 1):
+        start = time.perf_counter()
+        T, Q = solve_steady(mesh_data, resistor_data, k, h_cooling, T_ambient, options)
+        peak = probes.ResistorProbes(T.function_space, mesh_data[1], numbers).evaluate(T)[0]
+        eta2 = error_indicators(T, Q, k, h_cooling, T_ambient)
+        estimate = np.sqrt(comm.allreduce(np.sum(eta2), op=MPI.SUM))
+
+        # Change of the resistor peaks since the previous mesh, the convergence measure of the loop
+        change = np.nanmax(np.abs(peak - previous_peak)) if previous_peak is not None else np.nan
+        previous_peak = peak
+
+        num_dofs = T.function_space.dofmap.index_map.size_global
+        num_cells = mesh_data[0].topology.index_map(mesh_data[0].topology.dim).size_global
+        elapsed = time.perf_counter() - start
+        report.append({'iteration': iteration, 'dofs': num_dofs, 'cells': num_cells, 'estimate': float(estimate),
+                       'max_peak': float(np.nanmax(peak)), 'peak_change': float(change), 'time_s': elapsed})
+        print(f"{iteration:>4} {num_dofs:>10} {num_cells:>10} {estimate:>10.3e} {np.nanmax(peak):>10.4f} {change:>11.3e} {elapsed:>9.2f}")
+
+        if change <= options['amr_tol']:
+            print(f"\033[92mResistor peak temperatures converged to {options['amr_tol']:g} K with {num_dofs} dofs\033[0m")
+            break
+        if iteration == options['amr_max_iterations'] or num_dofs >= options['amr_max_dofs']:
+            print(f"\033[103mAdaptive refinement stopped at {num_dofs} dofs before reaching amr_tol = {options['amr_tol']:g} K\033[0m")
+            break
+
+        # ------------------------------- Mark and refine ------------------------------- #
+        num_owned_cells = mesh_data[0].topology.index_map(mesh_data[0].topology.dim).size_local
+        marked = dorfler_mark(eta2[:num_owned_cells], options['amr_theta'], comm)
+        mesh_data = refine(mesh_data, marked)
+
+    if report_file is not None and comm.rank == 0:
+        with open(report_file, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(report[0]))
+            writer.writeheader()
+            writer.writerows(report)
+        print(f"Refinement report written to \033[95m{report_file}\033[0m")
+
+    return mesh_data, report
+
+
+@click.command()
+@click.argument('gds_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('xml_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.option('--report', 'report_file', default="amr_report.csv", show_default=True, help="CSV file for the dofs-versus-error report.")
+def adapt(gds_file, xml_file, params, report_file):
+    """Adapt the mesh of GDS_FILE to the resistor peak temperatures and report dofs versus error."""
+    import parseParams
+    import parseLayers
+    import extractGeometry
+    import meshCache
+
+    comm = MPI.COMM_WORLD
+    if comm.rank != 0:
+        sys.stdout = open(os.devnull, 'w')
+
+    try:
+        substrate_layer, resist_layer, _, _, ambient_temp, s_sense = parseParams.parse_file(params)
+        options = parseParams.parse_options(params)
+    except ValueError:
+        print("\033[91mAn error occured during setup: Values could not be read from paramter file.\033[0m\n")
+        sys.exit(1)
+
+    substrate_layer_properties = parseLayers.get_layer_properties(xml_file, substrate_layer)
+    if not type(substrate_layer_properties) == dict:
+        print(substrate_layer_properties)
+        sys.exit(1)
+
+    try:
+        layout_length, layout_width, resistor_data = extractGeometry.read_layout_shared(gds_file, substrate_layer, resist_layer, options, comm)
+    except ValueError as e:
+        print(f"\033[91m{e}\033[0m\n")
+        sys.exit(1)
+    if int(layout_length) == 0 or int(layout_width) == 0:
+        print(f"\n\033[103mDimensions are not workable, please enter a layer with non-zero dimensions.\033[0m\n")
+        sys.exit(1)
+
+    mesh_data = meshCache.mesh_layout(options, layout_length, layout_width, resistor_data, s_sense, comm)
+    refine_adaptively(mesh_data, resistor_data, float(substrate_layer_properties['ThermalConductivity']), options['h_cooling'], ambient_temp, options, report_file)
+
+
+if __name__ == '__main__':
+    adapt()
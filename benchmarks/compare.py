@@ -0,0 +1,72 @@
+# ==============================================================================================
+# Compare two pipeline benchmark results and flag per-stage regressions
+# ==============================================================================================
+#
+# Example:
+#   python benchmarks/compare.py baseline.json pipeline.json --threshold 0.1
+#
+# Cases are matched by their number of resistors and stages by name. A stage regresses when its
+# minimum time grew by more than the threshold; the exit code is 1 if any stage regressed, so the
+# script can gate a CI job.
+
+import sys
+import json
+import click
+
+
+def load_results(file_name: str):
+    '''Returns the metadata and the cases of a pipeline.json file, keyed by their number of resistors.'''
+    with open(file_name, 'r') as f:
+        results = json.load(f)
+    return results['metadata'], {case['resistors']: case for case in results['cases']}
+
+
+def compare_results(baseline: dict, current: dict, threshold: float):
+    '''
+    Returns one row (resistors, stage, baseline s, current s, ratio, regressed) per stage present in both
+    results. Stages below 1 ms in both are never flagged, as their timings are dominated by noise.
+    '''
+    rows = []
+    for resistors in sorted(set(baseline) & set(current)):
+        baseline_stages = baseline[resistors]['stages']
+        current_stages = current[resistors]['stages']
+        for stage in baseline_stages:
+            if stage not in current_stages:
+                continue
+            old = baseline_stages[stage]['min_s']
+            new = current_stages[stage]['min_s']
+            ratio = new / old if old > 0 else float('inf')
+            regressed = ratio > 1 + threshold and max(old, new) >= 1e-3
+            rows.append((resistors, stage, old, new, ratio, regressed))
+    return rows
+
+
+@click.command()
+@click.argument('baseline_file', type=click.Path(exists=True, dir_okay=False))
+@click.argument('current_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=0.1, show_default=True, help="Relative slowdown of a stage that counts as a regression.")
+def compare(baseline_file, current_file, threshold):
+    """Compare the stage timings of CURRENT_FILE against BASELINE_FILE."""
+    baseline_meta, baseline = load_results(baseline_file)
+    current_meta, current = load_results(current_file)
+
+    print(f"Baseline: {baseline_meta['commit'][:10] or '?'} ({baseline_meta['timestamp']}, {baseline_meta['ranks']} rank(s))")
+    print(f"Current:  {current_meta['commit'][:10] or '?'} ({current_meta['timestamp']}, {current_meta['ranks']} rank(s))")
+    if baseline_meta['host'] != current_meta['host'] or baseline_meta['ranks'] != current_meta['ranks']:
+        print("\033[103mThe results come from different hosts or rank counts, timings may not be comparable\033[0m")
+
+    rows = compare_results(baseline, current, threshold)
+    print(f"\n{'resistors':>9} {'stage':<18} {'baseline (ms)':>14} {'current (ms)':>13} {'ratio':>7}")
+    for resistors, stage, old, new, ratio, regressed in rows:
+        line = f"{resistors:>9} {stage:<18} {old * 1000:>14.2f} {new * 1000:>13.2f} {ratio:>7.2f}"
+        print(f"\033[91m{line}  regression\033[0m" if regressed else line)
+
+    regressions = sum(row[-1] for row in rows)
+    if regressions:
+        print(f"\n\033[91m{regressions} stage(s) slower by more than {threshold:.0%}\033[0m")
+        sys.exit(1)
+    print(f"\n\033[92mNo stage slower by more than {threshold:.0%}\033[0m")
+
+
+if __name__ == '__main__':
+    compare()
@@ -0,0 +1,226 @@
+# ==============================================================================================
+# Pipeline benchmark: per-stage timings on synthetic layouts of increasing size
+# ==============================================================================================
+#
+# Example:
+#   python benchmarks/pipeline.py --resistors 10 100 1000 10000 --output pipeline.json
+#   mpirun -n 4 python benchmarks/pipeline.py --resistors 1000
+#   python benchmarks/compare.py baseline.json pipeline.json
+#
+# Every case writes a synthetic layout (synthetic_layout.py) and times the stages of a simulation
+# separately:
+#
+#   read_gdsii          GDSII parsing and label matching (rank 0)
+#   generate_geo_file   writing the .geo file (rank 0)
+#   mesh                in-memory GMSH meshing of the same geometry and conversion to a FEniCS mesh
+#   heat_flux           apply_heat_flux_to_resistor_regions
+#   form_compile        JIT compilation of the single-layer forms into an empty cache
+#   assembly            assembly of the system matrix
+#   factorisation       solver setup (LU factorisation or multigrid hierarchy)
+#   step                one time step: right-hand side assembly and solve (mean over --steps)
+#   write_legacy_vtk    one legacy VTK output file
+#
+# Each stage runs --repeats times and its minimum and median wall times, the largest over the ranks,
+# are stored in the JSON file along with the mesh size and the versions and commit that produced them.
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import platform
+import tempfile
+import subprocess
+import contextlib
+import click
+import numpy as np
+from mpi4py import MPI
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import synthetic_layout
+
+# Material and simulation parameters of the benchmark (silicon substrate of defLayers.xml, defParams.txt)
+RHO = 2330.0
+CP = 700.0
+K = 148.0
+DELTA = 0.1
+H_COOLING = 1000.0
+AMBIENT = 12.0
+
+
+class StageTimer:
+    '''Times stages over several repeats and keeps the minimum and median of the slowest rank.'''
+
+    def __init__(self, repeats: int, comm=MPI.COMM_WORLD):
+        self.repeats = repeats
+        self.comm = comm
+        self.stages = {}
+
+    def record(self, name: str, times: list):
+        times = np.array([self.comm.allreduce(t, op=MPI.MAX) for t in times])
+        self.stages[name] = {'min_s': float(np.min(times)), 'median_s': float(np.median(times)), 'repeats': len(times)}
+        print(f"  {name:<18} min {np.min(times) * 1000:10.2f} ms   median {np.median(times) * 1000:10.2f} ms")
+
+    def time(self, name: str, function, rank_only: int = None):
+        '''Runs function repeats times (on rank_only alone if given, broadcasting its result) and returns its last result.'''
+        times = []
+        for _ in range(self.repeats):
+            self.comm.barrier()
+            start = time.perf_counter()
+            result = None
+            if rank_only is None or self.comm.rank == rank_only:
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    result = function()
+            times.append(time.perf_counter() - start)
+        self.record(name, times)
+        return result if rank_only is None else self.comm.bcast(result, root=rank_only)
+
+
+def run_case(num_resistors: int, work_dir: str, s_sense: float, repeats: int, steps: int, solver_type: str, comm=MPI.COMM_WORLD):
+    '''Benchmarks every stage on a synthetic layout with num_resistors resistors and returns the case entry of the results.'''
+    import ufl
+    from petsc4py import PETSc
+    from dolfinx import fem
+    from dolfinx.fem import Function, Constant
+    from dolfinx.fem.petsc import assemble_matrix
+    import extractGeometry
+    import generateOutputFiles
+    import heatFlow
+
+    print(f"\n\033[96m{num_resistors} resistors\033[0m")
+    gds_file = os.path.join(work_dir, f"synthetic_{num_resistors}.gds")
+    if comm.rank == 0:
+        synthetic_layout.generate_layout(gds_file, num_resistors)
+    timer = StageTimer(repeats, comm)
+
+    # ---------------------------- Geometry and mesh ---------------------------- #
+    layout_length, layout_width, resistor_data = timer.time("read_gdsii", lambda: extractGeometry.read_gdsii(gds_file, synthetic_layout.SUBSTRATE_LAYER, synthetic_layout.RESIST_LAYER), rank_only=0)
+    geo_file = os.path.join(work_dir, f"synthetic_{num_resistors}.geo")
+    timer.time("generate_geo_file", lambda: generateOutputFiles.generate_geo_file(geo_file, layout_length, layout_width, resistor_data, s_sense), rank_only=0)
+    domain, cell_tags, facet_tags = timer.time("mesh", lambda: generateOutputFiles.generate_mesh(layout_length, layout_width, resistor_data, s_sense, comm=comm))
+
+    # ------------------------------ Source and forms ----------------------------- #
+    V = fem.FunctionSpace(domain, ("CG", 1))
+    Q = timer.time("heat_flux", lambda: heatFlow.apply_heat_flux_to_resistor_regions(V, domain, cell_tags, resistor_data))
+
+    T_n = Function(V)
+    T_n.x.array[:] = AMBIENT
+    u = ufl.TrialFunction(V)
+    v = ufl.TestFunction(V)
+    scalar = lambda value: Constant(domain, PETSc.ScalarType(value))
+    a, L = heatFlow.build_single_layer_forms(u, v, T_n, Q, scalar(RHO * CP / DELTA), scalar(K), scalar(H_COOLING), scalar(AMBIENT))
+    # Every repeat compiles into an empty cache directory of its own, the cache would otherwise make
+    # all but the first repeat load the compiled forms instead of compiling them
+    def compile_forms():
+        with tempfile.TemporaryDirectory(prefix="firebird_jit_") as cache_dir:
+            jit_options = {'cache_dir': cache_dir}
+            return fem.form(a, jit_options=jit_options), fem.form(L, jit_options=jit_options)
+
+    a_form, L_form = timer.time("form_compile", compile_forms)
+
+    # --------------------------- Assembly and solver setup --------------------------- #
+    # Only the result of the last repeat is kept, so the earlier matrices and solvers are freed
+    matrices = []
+    solvers = []
+
+    def assemble():
+        for matrix in matrices:
+            matrix.destroy()
+        matrices[:] = [assemble_matrix(a_form)]
+        matrices[0].assemble()
+        return matrices[0]
+
+    A = timer.time("assembly", assemble)
+
+    def factorise():
+        for old_solver in solvers:
+            old_solver.destroy()
+        solvers[:] = [heatFlow.create_solver(A, comm, solver_type)]
+        solvers[0].setUp()
+        return solvers[0]
+
+    solver = timer.time("factorisation", factorise)
+
+    # ------------------------------- Time stepping ------------------------------- #
+    b = fem.petsc.create_vector(L_form)
+    step_times = []
+    for _ in range(steps):
+        comm.barrier()
+        start = time.perf_counter()
+        with b.localForm() as b_local:
+            b_local.set(0.0)
+        fem.petsc.assemble_vector(b, L_form)
+        b.ghostUpdate(addv=PETSc.InsertMode.ADD, mode=PETSc.ScatterMode.REVERSE)
+        solver.solve(b, T_n.vector)
+        T_n.x.scatter_forward()
+        step_times.append(time.perf_counter() - start)
+    timer.record("step", step_times)
+
+    # ---------------------------------- Output ---------------------------------- #
+    vtk_file = os.path.join(work_dir, f"synthetic_{num_resistors}_p{comm.rank}.vtk")
+    timer.time("write_legacy_vtk", lambda: generateOutputFiles.write_legacy_vtk(vtk_file, V, T_n, steps, steps * DELTA))
+
+    solver.destroy()
+    A.destroy()
+    b.destroy()
+    return {
+        'resistors': num_resistors,
+        'cells': domain.topology.index_map(domain.topology.dim).size_global,
+        'dofs': V.dofmap.index_map.size_global,
+        'stages': timer.stages,
+    }
+
+
+def metadata(comm=MPI.COMM_WORLD, **settings):
+    '''Describes the machine, software versions and commit of a benchmark run.'''
+    import dolfinx
+    import gmsh
+    import gdspy
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'commit': commit,
+        'host': socket.gethostname(),
+        'platform': platform.platform(),
+        'ranks': comm.size,
+        'versions': {'python': platform.python_version(), 'numpy': np.__version__, 'dolfinx': dolfinx.__version__,
+                     'gmsh': gmsh.__version__, 'gdspy': gdspy.__version__},
+        'settings': settings,
+    }
+
+
+@click.command()
+@click.option('--resistors', type=int, multiple=True, default=(10, 100, 1000, 10000), show_default=True, help="Resistor counts of the synthetic layouts.")
+@click.option('--s-sense', 's_sense', default=20.0, show_default=True, help="Substrate mesh sensitivity (s_sense).")
+@click.option('--repeats', default=3, show_default=True, help="Repetitions of every stage.")
+@click.option('--steps', default=10, show_default=True, help="Time steps for the per-step timing.")
+@click.option('--solver', 'solver_type', type=click.Choice(("lu", "gamg", "hypre")), default="lu", show_default=True, help="Linear solver configuration.")
+@click.option('--output', default="pipeline.json", show_default=True, help="JSON file for the results.")
+def pipeline(resistors, s_sense, repeats, steps, solver_type, output):
+    """Time every pipeline stage on synthetic layouts with an increasing number of resistors."""
+    comm = MPI.COMM_WORLD
+    if comm.rank != 0:
+        sys.stdout = open(os.devnull, 'w')
+
+    work_dir = tempfile.mkdtemp(prefix="firebird_bench_") if comm.rank == 0 else None
+    work_dir = comm.bcast(work_dir, root=0)
+
+    cases = [run_case(num_resistors, work_dir, s_sense, repeats, steps, solver_type, comm) for num_resistors in resistors]
+
+    comm.barrier()
+    if comm.rank == 0:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        with open(output, 'w') as f:
+            json.dump({'metadata': metadata(comm, s_sense=s_sense, repeats=repeats, steps=steps, solver=solver_type), 'cases': cases}, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    pipeline()
@@ -0,0 +1,68 @@
+# ==============================================================================================
+# Strong-scaling benchmark: the same layout simulated with an increasing number of MPI ranks
+# ==============================================================================================
+#
+# Example:
+#   python benchmarks/strong_scaling.py --ranks 1 2 4 8
+#
+# Every run executes "mpirun -n N python Firebird.py GDS XML PARAMS" from the repository root, so the
+# output files of the runs overwrite each other. Full-field output can be switched off with
+# output_every=0 in the parameter file to measure the solver alone.
+
+import os
+import re
+import sys
+import json
+import time
+import subprocess
+import click
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ELAPSED_PATTERN = re.compile(r"Time elapsed since simulation start: ([0-9.]+) ms")
+
+
+def run_case(num_ranks: int, gds_file: str, xml_file: str, params_file: str, mpirun: str):
+    '''Runs Firebird on num_ranks ranks and returns the total wall time and the simulation time reported by heatFlow, in seconds.'''
+    command = [mpirun, "-n", str(num_ranks), sys.executable, "Firebird.py", gds_file, xml_file, params_file]
+    start = time.perf_counter()
+    result = subprocess.run(command, cwd=REPO_DIR, capture_output=True, text=True, stdin=subprocess.DEVNULL)
+    wall_time = time.perf_counter() - start
+
+    match = ELAPSED_PATTERN.search(result.stdout)
+    if result.returncode != 0 or match is None:
+        print(result.stdout[-2000:])
+        print(result.stderr[-2000:])
+        raise RuntimeError(f"Run on {num_ranks} rank(s) failed with exit code {result.returncode}")
+    return wall_time, float(match.group(1)) / 1000
+
+
+@click.command()
+@click.option('--ranks', type=int, multiple=True, default=(1, 2, 4, 8), show_default=True, help="Numbers of MPI ranks to run with.")
+@click.option('--gds', 'gds_file', default="skripsieTest-Large.gds", show_default=True, help="Layout to simulate.")
+@click.option('--xml', 'xml_file', default="largeLayers.xml", show_default=True, help="Layer definition file.")
+@click.option('--params', 'params_file', default="largeParams.txt", show_default=True, help="Parameter file.")
+@click.option('--mpirun', default="mpirun", show_default=True, help="MPI launcher.")
+@click.option('--output', default="strong_scaling.json", show_default=True, help="JSON file for the results.")
+def strong_scaling(ranks, gds_file, xml_file, params_file, mpirun, output):
+    """Measure the strong scaling of a full Firebird run on a fixed layout."""
+    results = []
+    for num_ranks in ranks:
+        wall_time, simulation_time = run_case(num_ranks, gds_file, xml_file, params_file, mpirun)
+        results.append({'ranks': num_ranks, 'wall_time_s': wall_time, 'simulation_time_s': simulation_time})
+        print(f"{num_ranks:4d} rank(s): wall {wall_time:8.2f} s, simulation {simulation_time:8.2f} s")
+
+    # -------------------- Speedup and parallel efficiency ------------------- #
+    base = results[0]
+    print(f"\n{'ranks':>6} {'speedup':>8} {'efficiency':>10}")
+    for result in results:
+        result['speedup'] = base['simulation_time_s'] / result['simulation_time_s']
+        result['efficiency'] = result['speedup'] * base['ranks'] / result['ranks']
+        print(f"{result['ranks']:>6} {result['speedup']:>8.2f} {result['efficiency']:>10.1%}")
+
+    with open(output, 'w') as f:
+        json.dump({'gds': gds_file, 'xml': xml_file, 'params': params_file, 'results': results}, f, indent=2)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    strong_scaling()
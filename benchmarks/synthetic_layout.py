@@ -0,0 +1,62 @@
+# ==============================================================================================
+# Synthetic GDSII layouts for benchmarking: a substrate with a grid of labelled resistors
+# ==============================================================================================
+#
+# Example:
+#   python benchmarks/synthetic_layout.py 1000 synthetic_1000.gds
+#
+# The resistors are placed on a square grid with "number#power" labels at their centres, on the
+# layers of defParams.txt (substrate 5, resistors 1), so any number of resistors from tens to tens of
+# thousands gives a valid Firebird input with the same parameter and layer files.
+
+import math
+import click
+import gdspy
+import numpy as np
+
+SUBSTRATE_LAYER = 5
+RESIST_LAYER = 1
+
+
+def generate_layout(file_name: str, num_resistors: int, pitch: float = 20.0, resistor_length: float = 8.0, resistor_width: float = 4.0,
+                    power_range: tuple = (1.0, 10.0), seed: int = 0, substrate_layer: int = SUBSTRATE_LAYER, resist_layer: int = RESIST_LAYER):
+    '''
+    Writes a layout with num_resistors resistors of resistor_length x resistor_width (μm) on a square
+    grid with the given pitch, surrounded by a margin of one pitch of substrate. The powers are drawn
+    uniformly from power_range with a fixed seed, so a layout is reproducible from its arguments.
+    Returns the substrate length and width.
+    '''
+    lib = gdspy.GdsLibrary()
+    cell = lib.new_cell("SYNTHETIC")
+    rng = np.random.default_rng(seed)
+
+    columns = math.ceil(math.sqrt(num_resistors))
+    rows = math.ceil(num_resistors / columns)
+    substrate_length = (columns + 1) * pitch
+    substrate_width = (rows + 1) * pitch
+    cell.add(gdspy.Rectangle((0, 0), (substrate_length, substrate_width), layer=substrate_layer))
+
+    powers = rng.uniform(*power_range, size=num_resistors)
+    for number in range(num_resistors):
+        x = (number % columns + 1) * pitch
+        y = (number // columns + 1) * pitch
+        cell.add(gdspy.Rectangle((x - resistor_length / 2, y - resistor_width / 2), (x + resistor_length / 2, y + resistor_width / 2), layer=resist_layer))
+        cell.add(gdspy.Label(f"{number}#{powers[number]:.3f}", (x, y), layer=resist_layer))
+
+    lib.write_gds(file_name)
+    return substrate_length, substrate_width
+
+
+@click.command()
+@click.argument('num_resistors', type=int)
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--pitch', default=20.0, show_default=True, help="Distance between resistor centres (μm).")
+@click.option('--seed', default=0, show_default=True, help="Seed of the resistor powers.")
+def synthetic_layout(num_resistors, output, pitch, seed):
+    """Write a synthetic layout with NUM_RESISTORS labelled resistors to OUTPUT."""
+    length, width = generate_layout(output, num_resistors, pitch=pitch, seed=seed)
+    print(f"{num_resistors} resistors on a {length:g} x {width:g} μm substrate written to {output}")
+
+
+if __name__ == '__main__':
+    synthetic_layout()
@@ -1,97 +1,351 @@
 from curses import reset_shell_mode
+import os
 import gdspy
 import numpy as np
+import profiling
+from resistorTable import ResistorTable, source_key
 
-def read_gdsii(file_path, main_layer, resistive_layer):
+def polygon_bounds(polygon_list):
+    '''
+    Computes the centers (mean of the vertices) and bounds of a list of polygons in one batch.
+    Returns an (n, 2) array of centers and an (n, 4) array of bounds ordered x_min, x_max, y_min, y_max.
+    '''
+    if len(polygon_list) == 0:
+        return np.zeros((0, 2)), np.zeros((0, 4))
+
+    counts = np.array([len(polygon) for polygon in polygon_list])
+    offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    points = np.concatenate(polygon_list)
+
+    centers = np.add.reduceat(points, offsets, axis=0) / counts[:, None]
+    mins = np.minimum.reduceat(points, offsets, axis=0)
+    maxs = np.maximum.reduceat(points, offsets, axis=0)
+    bounds = np.column_stack((mins[:, 0], maxs[:, 0], mins[:, 1], maxs[:, 1]))
+    return centers, bounds
+
+
+class LabelIndex:
+    '''
+    Spatial index over label positions. The labels are sorted by x, so the labels inside a batch of
+    bounding boxes are found with binary searches instead of comparing every label with every box.
+    '''
+    def __init__(self, positions, texts):
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.order = np.argsort(positions[:, 0], kind='stable')
+        self.x = positions[self.order, 0]
+        self.y = positions[self.order, 1]
+        self.texts = list(texts)
+
+    def query(self, bounds):
+        '''Yields, for every (x_min, x_max, y_min, y_max) row of bounds, the indices of the labels inside it in their original order.'''
+        lower = np.searchsorted(self.x, bounds[:, 0], side='left')
+        upper = np.searchsorted(self.x, bounds[:, 1], side='right')
+        for (_, _, y_min, y_max), lo, hi in zip(bounds, lower, upper):
+            inside = (self.y[lo:hi] >= y_min) & (self.y[lo:hi] <= y_max)
+            yield np.sort(self.order[lo:hi][inside])
+
+
+def match_labels(centers, bounds, label_index, split_item="#"):
+    '''
+    Matches a batch of polygons with the first valid "number#power" label that lies within each polygon's
+    bounds. Returns the matched polygons as (numbers, powers, centers, bounds) columns; polygons without a
+    valid label are returned separately as problems.
+    '''
+    matched = []
+    numbers = []
+    powers = []
+    problems = []
+
+    for index, (center, label_ids) in enumerate(zip(centers, label_index.query(bounds))):
+        bad_labels = []
+        for label_id in label_ids:
+            label_text = label_index.texts[label_id]
+            if split_item in label_text:
+                try:
+                    resistor_number, power_dissipation = label_text.split(split_item)
+                    resistor_number, power_dissipation = int(resistor_number), float(power_dissipation)
+                except ValueError:
+                    bad_labels.append(label_text)
+                    continue
+                matched.append(index)
+                numbers.append(resistor_number)
+                powers.append(power_dissipation)
+                break # avoid unnecessary iterations
+        else:
+            if bad_labels:
+                problems.append((center, f"invalid label(s) {', '.join(repr(text) for text in bad_labels)}"))
+            else:
+                problems.append((center, "no label"))
+
+    matched = np.array(matched, dtype=np.int64)
+    return (np.array(numbers, dtype=np.int64), np.array(powers, dtype=np.float64), centers[matched], bounds[matched]), problems
+
+
+def build_table(batches):
+    '''Combines the (numbers, powers, centers, bounds) batches of match_labels into one resistor table.'''
+    if not batches:
+        return ResistorTable.empty()
+    return ResistorTable.from_columns(*(np.concatenate(column) for column in zip(*batches)))
+
+
+def report_problems(problems):
+    '''Prints the resistive-layer polygons that were skipped because they had no valid label.'''
+    if not problems:
+        return
+    print(f"\n\033[103m{len(problems)} polygon(s) on the resistive layer were skipped:\033[0m")
+    for center, reason in problems:
+        print(f"  Polygon at ({center[0]:.3f}, {center[1]:.3f}): {reason}")
+    print()
+
+
+# ---------------------------------------------------------------------------- #
+#          Hierarchical extraction: walk references instead of flattening       #
+# ---------------------------------------------------------------------------- #
+def reference_placements(reference):
+    '''
+    Returns the linear part (2x2) of a cell reference's transform and a generator of the translations
+    of its instances (one for a CellReference, one per element for a CellArray). A point p of the
+    referenced cell is placed at linear @ p + translation, following gdspy's order of operations:
+    magnification, array spacing, x reflection, rotation and finally the origin.
+    '''
+    angle = np.deg2rad(reference.rotation or 0.0)
+    rotation = np.array([[np.cos(angle), -np.sin(angle)], [np.sin(angle), np.cos(angle)]])
+    reflection = np.diag([1.0, -1.0 if reference.x_reflection else 1.0])
+    orientation = rotation @ reflection
+    linear = orientation * (reference.magnification or 1.0)
+    origin = np.asarray(reference.origin, dtype=float)
+
+    if isinstance(reference, gdspy.CellArray):
+        spacing = np.asarray(reference.spacing, dtype=float)
+        translations = (orientation @ (spacing * (column, row)) + origin
+                        for column in range(reference.columns) for row in range(reference.rows))
+    else:
+        translations = iter((origin,))
+    return linear, translations
+
+
+def iter_instances(cell, linear=None, translation=None):
+    '''
+    Walks the reference tree of a cell depth first and lazily yields every placed instance as
+    (cell, linear, translation), starting with the cell itself. Arrays are expanded one element at a time.
+    '''
+    if linear is None:
+        linear, translation = np.eye(2), np.zeros(2)
+    yield cell, linear, translation
+
+    for reference in cell.references:
+        if not isinstance(reference.ref_cell, gdspy.Cell):
+            continue  # reference to a cell that is missing from the library
+        reference_linear, reference_translations = reference_placements(reference)
+        child_linear = linear @ reference_linear
+        for reference_translation in reference_translations:
+            yield from iter_instances(reference.ref_cell, child_linear, linear @ reference_translation + translation)
+
+
+class CellGeometry:
+    '''
+    Geometry owned by a single cell (excluding its references) on one layer, extracted once per unique
+    cell and placed for every instance by transforming it.
+    '''
+    def __init__(self, cell, layer):
+        polygons = [np.asarray(points, dtype=float) for polyset in cell.polygons
+                    for points, polygon_layer in zip(polyset.polygons, polyset.layers) if polygon_layer == layer]
+        for path in cell.paths:
+            for (path_layer, _), path_polygons in path.get_polygons(True).items():
+                if path_layer == layer:
+                    polygons.extend(path_polygons)
+
+        self.num_polygons = len(polygons)
+        self.centers, self.bounds = polygon_bounds(polygons)
+        if polygons:
+            counts = np.array([len(polygon) for polygon in polygons])
+            self.offsets = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            self.points = np.concatenate(polygons)
+
+    def place(self, linear, translation):
+        '''Returns the centers and bounds of the polygons of one instance, in layout coordinates.'''
+        centers = self.centers @ linear.T + translation
+        if np.count_nonzero(np.abs(linear) > 1e-12) == 2:
+            # Axis-aligned placement (multiple of 90 degrees): transforming two corners of each box is enough
+            corner_a = self.bounds[:, [0, 2]] @ linear.T + translation
+            corner_b = self.bounds[:, [1, 3]] @ linear.T + translation
+            mins, maxs = np.minimum(corner_a, corner_b), np.maximum(corner_a, corner_b)
+        else:
+            points = self.points @ linear.T + translation
+            mins = np.minimum.reduceat(points, self.offsets, axis=0)
+            maxs = np.maximum.reduceat(points, self.offsets, axis=0)
+        return centers, np.column_stack((mins[:, 0], maxs[:, 0], mins[:, 1], maxs[:, 1]))
+
+
+def iter_layer_geometry(cell, layer, cache=None):
+    '''
+    Streams the polygons on a layer of the whole hierarchy below cell as (centers, bounds) batches, one
+    batch per placed instance, without flattening the layout. The geometry of every unique cell is
+    extracted once and stored in cache.
+    '''
+    cache = {} if cache is None else cache
+    for instance, linear, translation in iter_instances(cell):
+        key = (instance.name, layer)
+        if key not in cache:
+            cache[key] = CellGeometry(instance, layer)
+        geometry = cache[key]
+        if geometry.num_polygons > 0:
+            yield geometry.place(linear, translation)
+
+
+def iter_labels(cell):
+    '''Streams the labels of the whole hierarchy below cell as (positions, texts) batches, one batch per placed instance.'''
+    local_labels = {}
+    for instance, linear, translation in iter_instances(cell):
+        if instance.name not in local_labels:
+            local_labels[instance.name] = (np.array([label.position for label in instance.labels], dtype=float).reshape(-1, 2),
+                                           [label.text for label in instance.labels])
+        positions, texts = local_labels[instance.name]
+        if texts:
+            yield positions @ linear.T + translation, texts
+
+
+def read_hierarchy(cell, main_layer, resistive_layer):
+    '''
+    Extracts the substrate dimensions and resistor batches (see match_labels) of a cell by walking its
+    reference tree, matching labels one placed instance at a time.
+    '''
+    positions, texts = [np.zeros((0, 2))], []
+    for label_positions, label_texts in iter_labels(cell):
+        positions.append(label_positions)
+        texts.extend(label_texts)
+    label_index = LabelIndex(np.concatenate(positions), texts)
+
+    cache = {}
+    batches = []
+    problems = []
+    for centers, bounds in iter_layer_geometry(cell, resistive_layer, cache):
+        instance_batch, instance_problems = match_labels(centers, bounds, label_index)
+        batches.append(instance_batch)
+        problems.extend(instance_problems)
+
+    substrate_length = 0
+    substrate_width = 0
+    for _, bounds in iter_layer_geometry(cell, main_layer, cache):
+        substrate_length = max(substrate_length, np.max(bounds[:, 1] - bounds[:, 0]))
+        substrate_width = max(substrate_width, np.max(bounds[:, 3] - bounds[:, 2]))
+
+    return substrate_length, substrate_width, batches, problems
+
+
+@profiling.profiled("read_gdsii")
+def read_gdsii(file_path, main_layer, resistive_layer, hierarchical=False, table_file=None):
     '''
     Reads the layout of a given GDSII file and returns the dimensions of the substrate layer
-    and the resistor polygons on the resistive layer. Resistor data includes power dissipation,
-    position, polygon dimensions, and bounds (specific to each resistor).
+    and the resistor polygons on the resistive layer as a ResistorTable (number, power dissipation,
+    center and bounds of every resistor, sorted by number).
+    Polygons on the resistive layer without a valid "number#power" label are reported and skipped.
+    With hierarchical=True the cell references are walked instead of flattening every top-level cell,
+    so the geometry of each unique cell is only extracted once.
+    With a table_file (.npz) the extraction is stored there and reused, without reading the layout,
+    for as long as the GDSII file, the layers and the extraction mode are unchanged.
     '''
-    split_item = "#"
-    gdsii_lib = gdspy.GdsLibrary(infile=file_path)
+    if table_file is not None:
+        key = source_key(file_path, main_layer, resistive_layer, hierarchical)
+        stored = load_table(table_file, key)
+        if stored is not None:
+            substrate_length, substrate_width, resistor_data = stored
+            print(f"Resistor table reused from \033[95m{table_file}\033[0m")
+            print_resistor_data(resistor_data)
+            return substrate_length, substrate_width, resistor_data
+
+    with profiling.phase("gds_load"):
+        gdsii_lib = gdspy.GdsLibrary(infile=file_path)
     top_level_cells = gdsii_lib.top_level()
 
-    # Create empty dictionary to store resistor data
-    resistor_data = {}
+    # Resistor batches (see match_labels), combined into one table at the end
+    batches = []
+    problems = []
 
     # Initialize substrate dimensions
     substrate_length = 0
     substrate_width = 0
 
     for cell in top_level_cells:
+        if hierarchical:
+            cell_length, cell_width, cell_batches, cell_problems = read_hierarchy(cell, main_layer, resistive_layer)
+            substrate_length = max(substrate_length, cell_length)
+            substrate_width = max(substrate_width, cell_width)
+            batches.extend(cell_batches)
+            problems.extend(cell_problems)
+            continue
+
         # Extract polygons and labels
         polygons = cell.get_polygons(by_spec=True)
         texts = cell.get_labels()
+        label_index = LabelIndex([text.position for text in texts], [text.text for text in texts])
 
         # Loop through polygons on the resistive layer and substrate layer
         for (layer, datatype), polygon_list in polygons.items():
-            # Process the resistive layer for resistor data
+            # Process the resistive layer for resistor data, matching labels through the index
             if layer == resistive_layer:
-                for polygon in polygon_list:
-                    # Calculate the center of the polygon
-                    polygon_center = np.mean(polygon, axis=0)
-
-                    # Calculate the dimensions (length, width)
-                    min_x, max_x = np.min(polygon[:, 0]), np.max(polygon[:, 0])
-                    min_y, max_y = np.min(polygon[:, 1]), np.max(polygon[:, 1])
-                    length = max_x - min_x
-                    width = max_y - min_y
-
-                    # Define bounds (corners) of the polygon
-                    bounds = {
-                        'x_min': min_x,
-                        'x_max': max_x,
-                        'y_min': min_y,
-                        'y_max': max_y
-                    }
-
-                    # Create an entry in the resistor_data dictionary for this resistor
-                    resistor_entry = {
-                        'position': polygon_center,
-                        'length': length,
-                        'width': width,
-                        'bounds': bounds
-                    }
-
-                    # Find the corresponding label for this resistor
-                    for text in texts:
-                        label_text = text.text
-                        label_position = text.position
-
-                        # Check if the label position falls within the bounds of this polygon
-                        if (bounds['x_min'] <= label_position[0] <= bounds['x_max'] and
-                                bounds['y_min'] <= label_position[1] <= bounds['y_max']):
-                            if split_item in label_text:
-                                try:
-                                    resistor_number, power_dissipation = label_text.split(split_item)
-                                    resistor_entry['resistor_number'] = int(resistor_number)
-                                    resistor_entry['power_dissipation'] = float(power_dissipation)
-                                    break # avoid unnecessary iterations
-                                except ValueError:
-                                    print(f"Error processing label: {label_text}")
-                        
-
-                    # Add the resistor entry to the dictionary
-                    resistor_data[tuple(polygon_center)] = resistor_entry
+                centers, bounds = polygon_bounds(polygon_list)
+                cell_batch, cell_problems = match_labels(centers, bounds, label_index)
+                batches.append(cell_batch)
+                problems.extend(cell_problems)
 
             # Process the main layer for substrate dimensions
             if layer == main_layer:
-                for polygon in polygon_list:
-                    # Calculate substrate dimensions based on the polygon bounds
-                    min_x, max_x = np.min(polygon[:, 0]), np.max(polygon[:, 0])
-                    min_y, max_y = np.min(polygon[:, 1]), np.max(polygon[:, 1])
+                _, bounds = polygon_bounds(polygon_list)
+                substrate_length = max(substrate_length, np.max(bounds[:, 1] - bounds[:, 0], initial=0))
+                substrate_width = max(substrate_width, np.max(bounds[:, 3] - bounds[:, 2], initial=0))
 
-                    # Update the substrate length and width
-                    substrate_length = max(substrate_length, max_x - min_x)
-                    substrate_width = max(substrate_width, max_y - min_y)
+    report_problems(problems)
 
-    # -------------- Order the data in terms of the resistor numbers ------------- #
-    sorted_resistor_data = dict(sorted(resistor_data.items(), key=lambda item: item[1]['resistor_number'], reverse=False))
+    # ----------- One table of all resistors, ordered by resistor number ----------- #
+    resistor_data = build_table(batches)
     # -------- Print the resulting resistor data and substrate dimensions -------- #
-    print_resistor_data(sorted_resistor_data)
+    print_resistor_data(resistor_data)
+
+    if table_file is not None:
+        resistor_data.save(table_file, {'source_key': key, 'gds': os.path.abspath(file_path),
+                                        'substrate_length': float(substrate_length), 'substrate_width': float(substrate_width)})
+        print(f"Resistor table written to \033[95m{table_file}\033[0m")
+
+    return substrate_length, substrate_width, resistor_data
+
+
+def read_layout(file_path, main_layer, resistive_layer, options):
+    '''read_gdsii with the extraction settings of the parameter file options (gds_hierarchy, resistor_table).'''
+    table_file = None if options['resistor_table'] == "none" else options['resistor_table']
+    return read_gdsii(file_path, main_layer, resistive_layer, hierarchical=bool(options['gds_hierarchy']), table_file=table_file)
+
+
+def read_layout_shared(file_path, main_layer, resistive_layer, options, comm):
+    '''
+    read_layout on rank 0 of comm, shared with the other ranks. The outcome is broadcast together with
+    any error, so that an unreadable layout raises a ValueError on every rank instead of leaving the
+    other ranks waiting in the broadcast.
+    '''
+    geometry, error = None, None
+    if comm.rank == 0:
+        try:
+            geometry = read_layout(file_path, main_layer, resistive_layer, options)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+    geometry, error = comm.bcast((geometry, error), root=0)
+    if error is not None:
+        raise ValueError(f"The layout {file_path} could not be read: {error}")
+    return geometry
+
 
-    return substrate_length, substrate_width, sorted_resistor_data
+def load_table(table_file, key):
+    '''Returns the substrate dimensions and resistor table stored in table_file for the extraction key, or None.'''
+    if not os.path.isfile(table_file):
+        return None
+    try:
+        resistor_data, meta = ResistorTable.load(table_file)
+    except (OSError, ValueError, KeyError) as e:
+        print(f"\033[103mResistor table {table_file} could not be read ({e}), extracting again\033[0m")
+        return None
+    if meta.get('source_key') != key:
+        return None
+    return meta['substrate_length'], meta['substrate_width'], resistor_data
 
 
 def print_resistor_data(resistor_data):
@@ -101,10 +355,10 @@ def print_resistor_data(resistor_data):
     | Resistor Data: Number, Power, Position, Flux |
     +----------------------------------------------+
     \033[0m""")
-    for key, resistor in resistor_data.items():
-        flux = resistor.get('power_dissipation','N/A') / (resistor['length'] * resistor['width'])
-        print(f"Resistor {resistor.get('resistor_number', 'N/A')}: "
-              f"Power = {resistor.get('power_dissipation', 'N/A')} μW, "
-              f"Position = {resistor['position']}, "
-              f"Length = {resistor['length']} μm, Width = {resistor['width']} μm, "
+    for number, power, center, length, width, flux in zip(resistor_data.numbers, resistor_data.power, resistor_data.centers,
+                                                        resistor_data.length, resistor_data.width, resistor_data.flux):
+        print(f"Resistor {number}: "
+              f"Power = {power} μW, "
+              f"Position = {center}, "
+              f"Length = {length} μm, Width = {width} μm, "
               f"Flux = {flux:.4f} W/m^2")
@@ -1,9 +1,50 @@
 from urllib import response
+import os
+import sys
+import time
+import queue
+import threading
+import numpy as np
+import gmsh
 from dolfinx.io import gmshio
 from mpi4py import MPI
+import profiling
+from resistorTable import ResistorTable
 
 
-def write_legacy_vtk(filename, msh, temperature_data, step, current_time):
+def vtk_piece(V):
+    """
+    Returns the points and cells of the local piece of a first order Lagrange space for VTK output: the
+    coordinates of the owned and ghost dofs, and the dof connectivity of the owned cells. As for
+    XDMFSeriesWriter, the local field array is then the point data without any reordering, and every
+    cell is written by exactly one rank.
+    """
+    index_map = V.dofmap.index_map
+    num_nodes = index_map.size_local + index_map.num_ghosts
+    num_owned_cells = V.mesh.topology.index_map(V.mesh.topology.dim).size_local
+    cells = V.dofmap.list[:num_owned_cells]
+    if cells.shape[1] != 3:
+        raise ValueError("VTK output only supports first order Lagrange spaces on triangles")
+    return V.tabulate_dof_coordinates()[:num_nodes], cells
+
+
+@profiling.profiled("write_legacy_vtk")
+def write_legacy_vtk(filename, V, temperature_data, step, current_time):
+    """
+    Writes the local piece of a temperature field (see vtk_piece) as a legacy ASCII .vtk file.
+
+    Args:
+        filename (str): Output file.
+        V (FunctionSpace): Scalar first order Lagrange space of the temperature.
+        temperature_data: The temperature as a Function or directly as its local array of values.
+        step (int): Output step, written to the file header.
+        current_time (float): Simulated time, written to the file header.
+    """
+    # The temperature can be given as a Function or directly as its array of values
+    temperature_values = temperature_data.x.array if hasattr(temperature_data, "x") else temperature_data
+    coordinates, cells = vtk_piece(V)
+    num_points, num_cells = len(coordinates), len(cells)
+
     with open(filename, "w") as f:
         # Header
         f.write("# vtk DataFile Version 3.0\n")
@@ -11,32 +52,297 @@ def write_legacy_vtk(filename, msh, temperature_data, step, current_time):
         f.write("ASCII\n")
         f.write("DATASET UNSTRUCTURED_GRID\n")
 
-        # Write points (mesh nodes)
-        num_points = msh.geometry.x.shape[0]
+        # Write points (dof coordinates, z = 0.0 for the 2D mesh)
         f.write(f"POINTS {num_points} float\n")
-        for point in msh.geometry.x:
-            f.write(f"{point[0]} {point[1]} 0.0\n")  # z = 0.0 for 2D mesh
+        np.savetxt(f, coordinates[:, :2], fmt="%.17g %.17g 0.0")
 
         # Write cells (triangles)
-        num_cells = msh.topology.index_map(msh.topology.dim).size_local
-        cell_connectivity = msh.topology.connectivity(2, 0).array
         f.write(f"CELLS {num_cells} {num_cells * 4}\n")  # "4" includes 3 vertices + count of vertices
-        for i in range(0, len(cell_connectivity), 3):
-            f.write(f"3 {cell_connectivity[i]} {cell_connectivity[i+1]} {cell_connectivity[i+2]}\n")
+        np.savetxt(f, cells, fmt="3 %d %d %d")
 
         f.write(f"CELL_TYPES {num_cells}\n")
-        for _ in range(num_cells):
-            f.write("5\n")  # "5" is the VTK type for triangle
+        f.write("5\n" * num_cells)  # "5" is the VTK type for triangle
 
         # Write temperature data as point data
         f.write(f"POINT_DATA {num_points}\n")
         f.write("SCALARS temperature float 1\n")
         f.write("LOOKUP_TABLE default\n")
-        for temp in temperature_data.x.array:
-            f.write(f"{temp}\n")
+        np.savetxt(f, temperature_values[:num_points], fmt="%.17g")
+
+
+def write_vtu_piece(filename, V, values):
+    """Writes the local piece of a temperature field (see vtk_piece) as an ASCII .vtu file, a piece of a .pvtu dataset."""
+    coordinates, cells = vtk_piece(V)
+
+    def data_array(array, name, data_type, fmt, components=1):
+        name_attribute = f' Name="{name}"' if name else ""
+        f.write(f'<DataArray type="{data_type}"{name_attribute} NumberOfComponents="{components}" format="ascii">\n')
+        np.savetxt(f, array, fmt=fmt)
+        f.write('</DataArray>\n')
+
+    with open(filename, "w") as f:
+        f.write('<?xml version="1.0"?>\n<VTKFile type="UnstructuredGrid" version="0.1" byte_order="LittleEndian">\n<UnstructuredGrid>\n')
+        f.write(f'<Piece NumberOfPoints="{len(coordinates)}" NumberOfCells="{len(cells)}">\n')
+        f.write('<PointData Scalars="temperature">\n')
+        data_array(values[:len(coordinates)], "temperature", "Float64", "%.17g")
+        f.write('</PointData>\n<Points>\n')
+        data_array(coordinates, None, "Float64", "%.17g", 3)
+        f.write('</Points>\n<Cells>\n')
+        data_array(cells, "connectivity", "Int64", "%d")
+        data_array(np.arange(1, len(cells) + 1) * 3, "offsets", "Int64", "%d")
+        data_array(np.full(len(cells), 5), "types", "UInt8", "%d")  # "5" is the VTK type for triangle
+        f.write('</Cells>\n</Piece>\n</UnstructuredGrid>\n</VTKFile>\n')
+
+
+class XDMFSeriesWriter:
+    """
+    Writes a time series of a nodal field as an XDMF index with raw binary heavy data.
+
+    Every rank writes its part of the mesh once, as the dof coordinates and the dof connectivity of its
+    owned cells, so the field values line up with the points without any reordering. Each output step
+    then only appends the rank's field values to its own binary file. Rank 0 keeps the .xdmf index up
+    to date by appending the grid of every new step before the closing tags, so the series can be
+    opened in ParaView while the simulation is still running.
+
+    Args:
+        basename (str): Output path without extension, e.g. "heat_solution".
+        V (FunctionSpace): The (possibly blocked) Lagrange function space of the written field.
+        field_names (list): Names of the field components, defaults to "temperature".
+    """
+
+    # XDMF topology names for first order simplices, by number of dofs per cell
+    CELL_TYPES = {2: {3: "Triangle"}, 3: {4: "Tetrahedron"}}
+    INDEX_HEADER = ('<?xml version="1.0"?>\n<Xdmf Version="3.0">\n<Domain>\n'
+                    '<Grid Name="TimeSeries" GridType="Collection" CollectionType="Temporal">\n')
+    INDEX_FOOTER = '</Grid>\n</Domain>\n</Xdmf>\n'
+
+    def __init__(self, basename: str, V, field_names=None):
+        self.comm = V.mesh.comm
+        self.basename = basename
+        self.block_size = V.dofmap.index_map_bs
+        if field_names is None:
+            field_names = ["temperature"] if self.block_size == 1 else [f"temperature_{i}" for i in range(self.block_size)]
+        self.field_names = field_names
+
+        # ------------- Local mesh: dof coordinates and owned cell connectivity ------------- #
+        index_map = V.dofmap.index_map
+        self.num_nodes = index_map.size_local + index_map.num_ghosts
+        tdim = V.mesh.topology.dim
+        num_owned_cells = V.mesh.topology.index_map(tdim).size_local
+        coordinates = np.ascontiguousarray(V.tabulate_dof_coordinates()[:self.num_nodes], dtype=np.float64)
+        connectivity = np.ascontiguousarray(V.dofmap.list[:num_owned_cells], dtype=np.int64)
+
+        self.cell_type = self.CELL_TYPES.get(tdim, {}).get(connectivity.shape[1])
+        if self.cell_type is None:
+            raise ValueError("XDMFSeriesWriter only supports first order Lagrange spaces on simplices")
+        self.nodes_per_cell = connectivity.shape[1]
+
+        mesh_filename = f"{basename}_mesh_p{self.comm.rank}.bin"
+        with open(mesh_filename, "wb") as f:
+            coordinates.tofile(f)
+            connectivity.tofile(f)
+
+        # Rank 0 needs the piece sizes of every rank to write the index
+        self.piece_sizes = self.comm.gather((self.num_nodes, num_owned_cells), root=0)
+
+        self.field_file = open(f"{basename}_p{self.comm.rank}.bin", "wb")
+        self.times = []
+
+        # The index stays open on rank 0: every step is written over the closing tags, which follow it again
+        self.index_file = None
+        if self.comm.rank == 0:
+            self.index_file = open(f"{basename}.xdmf", "w")
+            self.index_file.write(self.INDEX_HEADER)
+            self.index_end = self.index_file.tell()
+            self.index_file.write(self.INDEX_FOOTER)
+            self.index_file.flush()
+
+    @profiling.profiled("write_xdmf")
+    def write(self, values: np.ndarray, t: float, step: int = None):
+        """
+        Appends one output step. The values are the local (owned and ghost) entries of the field array.
+        No communication takes place, so every rank can call this independently.
+        """
+        components = values[:self.num_nodes * self.block_size].reshape(self.num_nodes, self.block_size)
+        np.ascontiguousarray(components.T, dtype=np.float64).tofile(self.field_file)
+        self.field_file.flush()
+
+        self.times.append(t)
+        if self.index_file is not None:
+            self._append_index(len(self.times) - 1, t)
+
+    def close(self):
+        self.field_file.close()
+        if self.index_file is not None:
+            self.index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _data_item(self, filename, dimensions, number_type, seek):
+        endian = "Little" if sys.byteorder == "little" else "Big"
+        return (f'<DataItem Format="Binary" Dimensions="{dimensions}" NumberType="{number_type}" Precision="8" '
+                f'Endian="{endian}" Seek="{seek}">{filename}</DataItem>')
+
+    def _append_index(self, step, t):
+        """Adds the grid of one output step to the .xdmf index, before its closing tags."""
+        prefix = os.path.basename(self.basename)
+        lines = [f'<Grid Name="step_{step}" GridType="Collection" CollectionType="Spatial">',
+                 f'<Time Value="{t}"/>']
+        for rank, (num_nodes, num_cells) in enumerate(self.piece_sizes):
+            mesh_filename = f"{prefix}_mesh_p{rank}.bin"
+            field_filename = f"{prefix}_p{rank}.bin"
+            lines.append(f'<Grid Name="piece_{rank}" GridType="Uniform">')
+            lines.append(f'<Topology TopologyType="{self.cell_type}" NumberOfElements="{num_cells}">')
+            lines.append(self._data_item(mesh_filename, f"{num_cells} {self.nodes_per_cell}", "Int", num_nodes * 3 * 8))
+            lines.append('</Topology>')
+            lines.append('<Geometry GeometryType="XYZ">')
+            lines.append(self._data_item(mesh_filename, f"{num_nodes} 3", "Float", 0))
+            lines.append('</Geometry>')
+            for component, name in enumerate(self.field_names):
+                seek = (step * self.block_size + component) * num_nodes * 8
+                lines.append(f'<Attribute Name="{name}" AttributeType="Scalar" Center="Node">')
+                lines.append(self._data_item(field_filename, f"{num_nodes}", "Float", seek))
+                lines.append('</Attribute>')
+            lines.append('</Grid>')
+        lines.append('</Grid>')
+
+        self.index_file.seek(self.index_end)
+        self.index_file.write("\n".join(lines) + "\n")
+        self.index_end = self.index_file.tell()
+        self.index_file.write(self.INDEX_FOOTER)
+        self.index_file.flush()
+
+
+class LegacyVTKWriter:
+    """
+    Writes one ASCII VTK dataset per output step, behind the same write/close interface as
+    XDMFSeriesWriter. A serial run writes one legacy .vtk file per step through write_legacy_vtk. In
+    parallel every rank writes its owned cells as a .vtu piece, and rank 0 writes a .pvtu file per step
+    combining the pieces and a .pvd collection of all steps, to open in ParaView.
+
+    Args:
+        basename (str): Output path prefix, files are named "<basename>_step_<step>.vtk" (or .pvtu in parallel).
+        V (FunctionSpace): Scalar first order Lagrange space of the temperature.
+    """
+
+    def __init__(self, basename: str, V):
+        self.basename = basename
+        self.V = V
+        self.comm = V.mesh.comm
+        self.steps = []
+
+    def write(self, values: np.ndarray, t: float, step: int = None):
+        if self.comm.size == 1:
+            write_legacy_vtk(f"{self.basename}_step_{step}.vtk", self.V, values, step, t)
+            return
+
+        write_vtu_piece(f"{self.basename}_step_{step}_p{self.comm.rank}.vtu", self.V, values)
+        self.steps.append((step, t))
+        if self.comm.rank == 0:
+            self._write_index(step)
 
+    def _write_index(self, step):
+        """Writes the .pvtu file of a step and rewrites the .pvd collection of all steps so far."""
+        prefix = os.path.basename(self.basename)
+        pieces = "".join(f'<Piece Source="{prefix}_step_{step}_p{rank}.vtu"/>\n' for rank in range(self.comm.size))
+        with open(f"{self.basename}_step_{step}.pvtu", "w") as f:
+            f.write('<?xml version="1.0"?>\n<VTKFile type="PUnstructuredGrid" version="0.1" byte_order="LittleEndian">\n'
+                    '<PUnstructuredGrid GhostLevel="0">\n'
+                    '<PPointData Scalars="temperature">\n<PDataArray type="Float64" Name="temperature"/>\n</PPointData>\n'
+                    '<PPoints>\n<PDataArray type="Float64" NumberOfComponents="3"/>\n</PPoints>\n'
+                    f'{pieces}</PUnstructuredGrid>\n</VTKFile>\n')
 
-def generate_geo_file(filename: str, substrate_length: float, substrate_width: float, resistor_data: dict, s_sense: float):
+        datasets = "".join(f'<DataSet timestep="{t}" part="0" file="{prefix}_step_{step}.pvtu"/>\n' for step, t in self.steps)
+        with open(f"{self.basename}.pvd", "w") as f:
+            f.write(f'<?xml version="1.0"?>\n<VTKFile type="Collection" version="0.1">\n<Collection>\n{datasets}</Collection>\n</VTKFile>\n')
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncOutputWriter:
+    """
+    Hands output steps to a background thread so that the time loop does not wait for the disk.
+
+    Every write takes a snapshot of the field values and puts it on a bounded queue. When the writer
+    falls behind and the queue is full, write() blocks until a slot is free, which keeps the memory
+    held by pending snapshots bounded. close() waits until every queued step is on disk, closes the
+    wrapped writer and re-raises any error that occurred on the writer thread.
+
+    Args:
+        writer: Output writer with write(values, t, step) and close() methods.
+        max_pending (int): Maximum number of snapshots waiting to be written.
+    """
+
+    _STOP = object()
+
+    def __init__(self, writer, max_pending: int = 4):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=max(1, max_pending))
+        self.error = None
+        self.blocked_time = 0.0  # time the solver spent waiting on a full queue
+        self.thread = threading.Thread(target=self._run, name="firebird-output", daemon=True)
+        self.thread.start()
+
+    def write(self, values: np.ndarray, t: float, step: int = None):
+        if self.error is not None:
+            raise RuntimeError(f"Output writer failed: {self.error}") from self.error
+
+        snapshot = np.array(values, copy=True)
+        wait_start = time.perf_counter()
+        self.queue.put((snapshot, t, step))  # blocks while the queue is full
+        self.blocked_time += time.perf_counter() - wait_start
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is self._STOP:
+                return
+            # After a failure the remaining snapshots are drained without writing them
+            if self.error is None:
+                try:
+                    self.writer.write(*item)
+                except Exception as e:
+                    self.error = e
+
+    def close(self):
+        self.queue.put(self._STOP)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise RuntimeError(f"Output writer failed: {self.error}") from self.error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def resistor_mesh_size(resistor_data: ResistorTable):
+    """Returns the characteristic mesh length (lcr) used on the edges of every resistor."""
+    return np.minimum(resistor_data.length, resistor_data.width)
+
+
+def resistor_corners(resistor_data: ResistorTable):
+    """Returns the x_min, x_max, y_min and y_max columns of the rectangles of the resistors, centered on their positions."""
+    x_pos, y_pos = resistor_data.centers[:, 0], resistor_data.centers[:, 1]
+    length, width = resistor_data.length, resistor_data.width
+    return x_pos - length / 2, x_pos + length / 2, y_pos - width / 2, y_pos + width / 2
+
+
+@profiling.profiled("generate_geo_file")
+def generate_geo_file(filename: str, substrate_length: float, substrate_width: float, resistor_data: ResistorTable, s_sense: float):
     """
     Generates a GMSH .geo file that represents the substrate with resistors.
     The substrate is created as a surface, and resistors are placed into cut-out holes within the substrate.
@@ -45,10 +351,7 @@ def generate_geo_file(filename: str, substrate_length: float, substrate_width: f
     filename (str): The name of the .geo file to be created.
     substrate_length (float): The length of the substrate layer.
     substrate_width (float): The width of the substrate layer.
-    resistor_data (dict): The resistor data, where each entry contains:
-                          - 'position': (x, y) center of the resistor
-                          - 'length': Length of the resistor
-                          - 'width': Width of the resistor
+    resistor_data (ResistorTable): The resistors, of which the number, center, length and width are used.
     s_sense (float): The sensitivity value of the mesh generation for the substrate layer.
     """
     geo_filename = filename
@@ -98,13 +401,8 @@ def generate_geo_file(filename: str, substrate_length: float, substrate_width: f
         resistor_surfaces = []
         hole_loop_id = 1 
 
-        for resistor in resistor_data.values():
-            x_pos, y_pos = resistor['position']
-            length = resistor['length']
-            width = resistor['width']
-
-            resistor_surface_id = resistor['resistor_number']
-
+        for resistor_surface_id, x_min, x_max, y_min, y_max, r_sense in zip(resistor_data.numbers, *resistor_corners(resistor_data),
+                                                                             resistor_mesh_size(resistor_data)):
             # ------------------- Test cases for finding optimal choice ------------------ #
             # r_sense = 200
             # r_sense = 100
@@ -116,15 +414,8 @@ def generate_geo_file(filename: str, substrate_length: float, substrate_width: f
             # r_sense = 8.5
             # r_sense = 6
             # r_sense = 3
-            r_sense = min(length, width)
             # r_sense = 50
 
-            # Calculate the corners of the resistor (centered at x_pos, y_pos)
-            x_min = x_pos - length / 2
-            x_max = x_pos + length / 2
-            y_min = y_pos - width / 2
-            y_max = y_pos + width / 2
-            
             # Define points for the resistor hole
             f.write("\n// RESISTOR POINTS:\n")
             f.write(f"lcr = {r_sense};\n")
@@ -180,6 +471,94 @@ def generate_geo_file(filename: str, substrate_length: float, substrate_width: f
 
         
 
+@profiling.profiled("generate_mesh")
+def generate_mesh(substrate_length: float, substrate_width: float, resistor_data: ResistorTable, s_sense: float, num_threads: int = 0, comm=MPI.COMM_WORLD, model_rank: int = 0):
+    """
+    Builds the substrate-with-holes geometry with the GMSH Python API, meshes it in memory and converts
+    it to a FEniCS mesh without writing a .geo or .msh file. The geometry, physical groups and size
+    fields are the same as those written by generate_geo_file.
+
+    Args:
+        substrate_length (float): The length of the substrate layer.
+        substrate_width (float): The width of the substrate layer.
+        resistor_data (ResistorTable): The resistors, as returned by extractGeometry.read_gdsii.
+        s_sense (float): The sensitivity value of the mesh generation for the substrate layer.
+        num_threads (int): Number of threads GMSH may use for meshing, 0 lets GMSH decide.
+        comm (MPI.Comm): Communicator the mesh is distributed over.
+        model_rank (int): Rank that builds and meshes the GMSH model.
+
+    Returns:
+        domain (dolfinx.mesh.Mesh): The FEniCS mesh object representing the domain.
+        cell_tags (dolfinx.mesh.MeshTags): The cell tags of the substrate and resistor surfaces.
+        facet_tags (dolfinx.mesh.MeshTags): The facet tags of the substrate boundary lines.
+    """
+    if comm.rank == model_rank:
+        gmsh.initialize()
+        gmsh.option.setNumber("General.Terminal", 0)
+        gmsh.option.setNumber("General.NumThreads", num_threads)
+        gmsh.option.setNumber("Mesh.MaxNumThreads2D", num_threads)
+        gmsh.model.add("layoutMesh")
+        geo = gmsh.model.geo
+
+        # ------------- Substrate rectangle (centered at the origin) ------------- #
+        x_min_sub, x_max_sub = -substrate_length / 2, substrate_length / 2
+        y_min_sub, y_max_sub = -substrate_width / 2, substrate_width / 2
+        substrate_points = [geo.addPoint(x, y, 0, s_sense) for x, y in
+                            ((x_min_sub, y_min_sub), (x_max_sub, y_min_sub), (x_max_sub, y_max_sub), (x_min_sub, y_max_sub))]
+        boundary_lines = [geo.addLine(substrate_points[i], substrate_points[(i + 1) % 4]) for i in range(4)]
+        substrate_loop = geo.addCurveLoop(boundary_lines)
+
+        # --------------- Resistors as holes with a surface inside each --------------- #
+        hole_loops = []
+        resistor_surfaces = []
+        resistor_lines = []
+        for resistor_number, x_min, x_max, y_min, y_max, r_sense in zip(resistor_data.numbers, *resistor_corners(resistor_data),
+                                                                       resistor_mesh_size(resistor_data)):
+            corners = ((x_min, y_min), (x_max, y_min), (x_max, y_max), (x_min, y_max))
+            points = [geo.addPoint(x, y, 0, r_sense) for x, y in corners]
+            lines = [geo.addLine(points[i], points[(i + 1) % 4]) for i in range(4)]
+            loop = geo.addCurveLoop(lines)
+
+            hole_loops.append(loop)
+            resistor_lines.extend(lines)
+            resistor_surfaces.append((resistor_number, geo.addPlaneSurface([loop])))
+
+        substrate_surface = geo.addPlaneSurface([substrate_loop] + hole_loops)
+        geo.synchronize()
+
+        # ------------------------------ Physical groups ------------------------------ #
+        for marker, line in enumerate(boundary_lines, start=1):
+            gmsh.model.addPhysicalGroup(1, [line], marker, name=f"Boundary_{marker}")
+        gmsh.model.addPhysicalGroup(2, [substrate_surface], 1, name="Substrate")
+        for resistor_number, surface in resistor_surfaces:
+            gmsh.model.addPhysicalGroup(2, [surface], resistor_number + 1, name=f"Resistor_{resistor_number}")
+
+        # ---------------------- Refine mesh around resistor edges --------------------- #
+        if resistor_lines:
+            distance = gmsh.model.mesh.field.add("Distance")
+            gmsh.model.mesh.field.setNumbers(distance, "CurvesList", resistor_lines)
+            gmsh.model.mesh.field.setNumber(distance, "NumPointsPerCurve", 100)
+            threshold = gmsh.model.mesh.field.add("Threshold")
+            gmsh.model.mesh.field.setNumber(threshold, "InField", distance)
+            gmsh.model.mesh.field.setNumber(threshold, "LcMin", r_sense)  # same as the .geo file: size of the last resistor
+            gmsh.model.mesh.field.setNumber(threshold, "LcMax", s_sense)
+            gmsh.model.mesh.field.setNumber(threshold, "DistMin", 0.1)
+            gmsh.model.mesh.field.setNumber(threshold, "DistMax", 1.0)
+            gmsh.model.mesh.field.setAsBackgroundMesh(threshold)
+
+        with profiling.phase("gmsh_generate"):
+            gmsh.model.mesh.generate(2)
+        print(f"\033[93mOutput: mesh generated in memory with\033[0m \033[95m{len(gmsh.model.mesh.getNodes()[0])}\033[0m \033[93mnodes\033[0m\n")
+
+    with profiling.phase("model_to_mesh"):
+        domain, cell_tags, facet_tags = gmshio.model_to_mesh(gmsh.model, comm, model_rank, gdim=2)
+
+    if comm.rank == model_rank:
+        gmsh.finalize()
+
+    return domain, cell_tags, facet_tags
+
+
 def get_mesh(msh_filename: str):
     """
     Loads the .msh file created by GMSH and returns the FEniCS mesh objects.
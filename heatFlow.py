@@ -1,5 +1,7 @@
 from threading import currentThread
 import time
+import math
+from collections import OrderedDict
 import ufl
 import dolfinx.io
 from petsc4py import PETSc
@@ -7,70 +9,214 @@ from mpi4py import MPI
 import numpy as np
 from dolfinx.fem.petsc import assemble_matrix, assemble_vector
 from dolfinx.fem import (Function, FunctionSpace, dirichletbc, locate_dofs_geometrical, Constant, form)
-from dolfinx import mesh, fem
+from dolfinx import mesh, fem, la
 from tqdm import tqdm
 import generateOutputFiles
+import layerStack
+import probes
+import profiling
+import jitCache
+from resistorTable import ResistorTable
 
 
-def apply_heat_flux_to_resistor_regions(V, domain, cell_tags, resistor_data):
+# Accepted representations of the resistor heat source
+SOURCE_MODES = ("nodal", "dg0")
+
+
+def _resistor_cells(domain, cell_tags, resistor_data: ResistorTable):
     """
-    Function to apply heat flux to resistors by averaging element-wise data to nodes.
+    Finds the locally owned resistor cells and the heat flux applied to each of them.
+
+    Args:
+        domain (Mesh): The finite element mesh.
+        cell_tags (MeshTags): MeshTags object containing the tagged cells.
+        resistor_data (ResistorTable): The resistors of the layout.
+
+    Returns:
+        cells (np.ndarray): Indices of the owned cells that belong to a resistor.
+        cell_flux (np.ndarray): Heat flux of the resistor each of those cells belongs to.
+        cell_numbers (np.ndarray): Resistor number each of those cells belongs to.
+    """
+    resistor_tags = resistor_data.numbers + 1
+    # Heat flux of every resistor in units of uW/um2 = W/m2
+    resistor_flux = (resistor_data.flux * 230).astype(PETSc.ScalarType)
+
+    # Lookup tables from a cell tag value to its resistor flux
+    max_tag = max(np.max(cell_tags.values, initial=0), np.max(resistor_tags, initial=0))
+    flux_by_tag = np.zeros(max_tag + 1, dtype=PETSc.ScalarType)
+    is_resistor_tag = np.zeros(max_tag + 1, dtype=bool)
+    flux_by_tag[resistor_tags] = resistor_flux
+    is_resistor_tag[resistor_tags] = True
+
+    # Ghost cells are skipped so that every cell contributes on exactly one rank
+    num_owned_cells = domain.topology.index_map(domain.topology.dim).size_local
+    selected = (cell_tags.indices < num_owned_cells) & is_resistor_tag[cell_tags.values]
+    cells = cell_tags.indices[selected]
+    cell_flux = flux_by_tag[cell_tags.values[selected]]
+    cell_numbers = cell_tags.values[selected] - 1
+
+    return cells, cell_flux, cell_numbers
+
+
+@profiling.profiled("heat_flux")
+def apply_heat_flux_to_resistor_regions(V, domain, cell_tags, resistor_data: ResistorTable, source_mode="nodal"):
+    """
+    Function to apply heat flux to resistors, either by averaging element-wise data to the dofs of V
+    or as a cellwise constant (DG0) function.
     Each resistor is treated as a region identified in the mesh, and heat flux is applied uniformly.
 
     Args:
         V (FunctionSpace): The function space for temperature.
         domain (Mesh): The finite element mesh.
         cell_tags (MeshTags): MeshTags object containing the tagged cells.
-        resistor_data (dict): Dictionary containing information about the resistors.
+        resistor_data (ResistorTable): The resistors of the layout.
+        source_mode (str): "nodal" to average the cell fluxes to the dofs of V, "dg0" for a cellwise constant source.
 
     Returns:
-        Q (Function): A Function containing the nodal heat flux values.
+        Q (Function): A Function containing the heat flux values.
     """
-    # Number of nodes (DOFs)
-    num_dofs = V.dofmap.index_map.size_local
-    # print(f"\033[103mDOFS: {num_dofs}\033[0m")
+    if source_mode not in SOURCE_MODES:
+        raise ValueError(f"Unknown heat source mode '{source_mode}', expected one of {SOURCE_MODES}")
 
-    # Initialize arrays to accumulate heat flux contributions and counts at nodes
-    heat_flux_accum = np.zeros(num_dofs, dtype=PETSc.ScalarType)
-    node_count = np.zeros(num_dofs, dtype=int)
+    cells, cell_flux, _ = _resistor_cells(domain, cell_tags, resistor_data)
+
+    # ---------------- Cellwise constant source: one value per cell ---------------- #
+    if source_mode == "dg0":
+        V_dg0 = fem.FunctionSpace(domain, ("DG", 0))
+        Q = fem.Function(V_dg0)
+        Q.x.array[V_dg0.dofmap.list[cells, 0]] = cell_flux
+        Q.x.scatter_forward()
+        return Q
+
+    # ------- Nodal average: accumulate the cell fluxes onto the dofs of each cell ------ #
+    cell_dofs = V.dofmap.list[cells]
+    dofs_per_cell = cell_dofs.shape[1]
+    num_dofs = V.dofmap.index_map.size_local + V.dofmap.index_map.num_ghosts  # owned and ghost dofs
 
-    # Loop through resistors to calculate element-wise heat flux
-    for resistor in resistor_data.values():
-        resistor_id = resistor['resistor_number']
-        power = resistor['power_dissipation']
-        
-        # Get cells that belong to the current resistor
-        resistor_cells = cell_tags.find(resistor_id + 1)
-        # print(f"\033[103mCells in resistor: {resistor_cells.size}\033[0m")
-        # print(resistor_cells.size) DEBUG
-        
-        # Calculate the heat flux for each resistor
-        area = resistor['length'] * resistor['width']
-        flux = power / area * 230 # units of uW/um2 = W/m2
-        
-        # Loop through cells in the resistor
-        for cell_index in resistor_cells:
-            # Get the nodes (DOFs) of the current cell
-            cell = domain.topology.connectivity(domain.topology.dim, 0).links(cell_index)
-            
-            # Accumulate flux contribution to the nodes of the cell
-            for node in cell:
-                heat_flux_accum[node] += flux
-                node_count[node] += 1
-
-    # Calculate average heat flux at each node
-    avg_heat_flux = np.zeros(num_dofs, dtype=PETSc.ScalarType)
-    non_zero_nodes = node_count > 0
-    avg_heat_flux[non_zero_nodes] = heat_flux_accum[non_zero_nodes] / node_count[non_zero_nodes]
-
-    # Create a Function to store the nodal heat flux values
     Q = fem.Function(V)
-    Q.vector.array[:] = avg_heat_flux
+    node_count = fem.Function(V)
+    Q.x.array[:] = np.bincount(cell_dofs.ravel(), weights=np.repeat(cell_flux, dofs_per_cell), minlength=num_dofs)
+    node_count.x.array[:] = np.bincount(cell_dofs.ravel(), minlength=num_dofs)
+
+    # Sum the contributions that were accumulated on ghost dofs into their owning ranks
+    Q.x.scatter_reverse(la.InsertMode.add)
+    node_count.x.scatter_reverse(la.InsertMode.add)
+
+    # Calculate average heat flux at each dof and share it with the ghosts
+    non_zero_nodes = node_count.x.array > 0
+    Q.x.array[non_zero_nodes] /= node_count.x.array[non_zero_nodes]
+    Q.x.array[~non_zero_nodes] = 0.0
+    Q.x.scatter_forward()
 
     return Q
 
 
 
+def resistor_source_matrix(V, domain, cell_tags, resistor_data: ResistorTable, source_mode="nodal"):
+    """
+    Builds the sparse matrix B that maps resistor powers to the heat source, so that Q = B p gives the
+    same source as apply_heat_flux_to_resistor_regions for the powers in p. The source is linear in the
+    powers: every entry is the unit-power flux of a resistor, averaged to the dofs in the nodal mode.
+
+    Args:
+        V (FunctionSpace): The function space for temperature.
+        domain (Mesh): The finite element mesh.
+        cell_tags (MeshTags): MeshTags object containing the tagged cells.
+        resistor_data (ResistorTable): The resistors of the layout.
+        source_mode (str): "nodal" to average the cell fluxes to the dofs of V, "dg0" for a cellwise constant source.
+
+    Returns:
+        B (PETSc.Mat): Source matrix, one column per resistor in ascending resistor number.
+        Q (Function): Zero heat source in the space B maps to, to be filled with B.mult(p, Q.vector).
+        numbers (np.ndarray): Resistor number of every column of B.
+    """
+    if source_mode not in SOURCE_MODES:
+        raise ValueError(f"Unknown heat source mode '{source_mode}', expected one of {SOURCE_MODES}")
+
+    numbers = np.array(resistor_data.numbers)
+    cells, cell_flux, cell_numbers = _resistor_cells(domain, cell_tags, resistor_data.with_power(1.0))
+    cell_columns = np.searchsorted(numbers, cell_numbers)
+
+    if source_mode == "dg0":
+        Q = fem.Function(fem.FunctionSpace(domain, ("DG", 0)))
+        rows = Q.function_space.dofmap.list[cells, 0]
+        columns = cell_columns
+        values = cell_flux
+    else:
+        Q = fem.Function(V)
+        cell_dofs = V.dofmap.list[cells]
+        dofs_per_cell = cell_dofs.shape[1]
+        rows = cell_dofs.ravel()
+        columns = np.repeat(cell_columns, dofs_per_cell)
+        values = np.repeat(cell_flux, dofs_per_cell)
+
+    # ------- Sum the contributions of every (dof, resistor) pair before inserting them ------ #
+    index_map = Q.function_space.dofmap.index_map
+    pairs, inverse = np.unique(np.stack([rows, columns], axis=1), axis=0, return_inverse=True)
+    pair_values = np.bincount(inverse.ravel(), weights=values, minlength=len(pairs))
+    global_rows = index_map.local_to_global(pairs[:, 0].astype(np.int32))
+
+    B = PETSc.Mat().create(comm=domain.comm)
+    B.setSizes(((index_map.size_local, index_map.size_global), (PETSc.DECIDE, len(numbers))))
+    B.setType(PETSc.Mat.Type.AIJ)
+    # The coordinate format preallocates exactly these entries and adds the ones on ghost dofs to their owning rank
+    B.setPreallocationCOO(global_rows.astype(PETSc.IntType), pairs[:, 1].astype(PETSc.IntType))
+    B.setValuesCOO(pair_values.astype(PETSc.ScalarType), addv=PETSc.InsertMode.ADD_VALUES)
+    B.assemble()
+
+    # ------------ Nodal average: divide every row by its number of resistor cells ----------- #
+    if source_mode == "nodal":
+        node_count = fem.Function(V)
+        node_count.x.array[:] = np.bincount(rows, minlength=len(node_count.x.array))
+        node_count.x.scatter_reverse(la.InsertMode.add)
+        count = node_count.x.array[:index_map.size_local]
+        scale = B.createVecLeft()
+        scale.array[:] = np.divide(1.0, count, out=np.zeros_like(count), where=count > 0)
+        B.diagonalScale(L=scale)
+        scale.destroy()
+
+    return B, Q, numbers
+
+
+class ResistorSource:
+    """
+    Heat source of time-varying resistor powers, Q(t) = B p(t). B is built once, and every update is
+    a sparse matrix-vector product into Q, skipped when the powers have not changed since the last one.
+    Updates are collective: every rank must call update with the same time.
+
+    Args:
+        V (FunctionSpace): The function space for temperature.
+        domain (Mesh): The finite element mesh.
+        cell_tags (MeshTags): MeshTags object containing the tagged cells.
+        resistor_data (ResistorTable): The resistors of the layout.
+        profiles (PowerProfiles): Power of every resistor over time, see powerProfiles.
+        source_mode (str): "nodal" or "dg0", see apply_heat_flux_to_resistor_regions.
+    """
+
+    def __init__(self, V, domain, cell_tags, resistor_data, profiles, source_mode="nodal"):
+        self.B, self.Q, numbers = resistor_source_matrix(V, domain, cell_tags, resistor_data, source_mode)
+        if not np.array_equal(numbers, profiles.numbers):
+            raise ValueError("The power profiles do not match the resistors of the layout")
+        self.profiles = profiles
+        self.power = self.B.createVecRight()
+        self.first_owned, self.end_owned = self.power.getOwnershipRange()
+        self.current = None
+        self.num_updates = 0
+
+    def update(self, t: float):
+        """Sets Q to the source at time t and returns whether it changed."""
+        power = self.profiles.power(t)
+        if self.current is not None and np.array_equal(power, self.current):
+            return False
+
+        self.power.array[:] = power[self.first_owned:self.end_owned]
+        self.B.mult(self.power, self.Q.vector)
+        self.Q.x.scatter_forward()
+        self.current = power
+        self.num_updates += 1
+        return True
+
+
 def add_boundary_conditions(V, domain, facet_tags, T_ambient):
     """
     Adds boundary conditions using the facet tags.
@@ -97,13 +243,598 @@ def add_boundary_conditions(V, domain, facet_tags, T_ambient):
     return boundary_conditions
 
 
-def findHeatSolution(msh_filename, layout_length:float, layout_width:float, rho_param:float, c_p_param:float, k_param:float, resistor_data:dict, iteration_num: int, delta: float, h_cooling: float, T_ambient: float):
+def create_output_writer(V, domain, output_format: str, output_queue: int, field_names=None):
+    """
+    Creates the full-field output writer for the temperature solution.
+
+    Args:
+        V (FunctionSpace): The function space for temperature.
+        domain (Mesh): The finite element mesh.
+        output_format (str): "xdmf" for the binary XDMF time series, "vtk" for legacy ASCII files.
+        output_queue (int): Maximum number of pending output steps of the background writer thread, 0 writes synchronously.
+        field_names (list): Names of the components of a blocked temperature space.
+
+    Returns:
+        writer: An object with write(values, t, step) and close() methods.
+    """
+    if output_format == "xdmf":
+        writer = generateOutputFiles.XDMFSeriesWriter("heat_solution", V, field_names)
+    elif V.dofmap.index_map_bs > 1:
+        raise ValueError("Legacy VTK output only supports a single temperature field, use output=xdmf")
+    else:
+        writer = generateOutputFiles.LegacyVTKWriter("heat_solution", V)
+
+    if output_queue > 0:
+        writer = generateOutputFiles.AsyncOutputWriter(writer, output_queue)
+    return writer
+
+
+# Linear solver configurations, selectable with solver= in the parameter file
+SOLVER_TYPES = ("lu", "gamg", "hypre", "fieldsplit")
+# Prefix of the PETSc options that override the solver settings, e.g. PETSC_OPTIONS="-firebird_ksp_rtol 1e-10"
+SOLVER_OPTIONS_PREFIX = "firebird_"
+
+
+def create_solver(A, comm, solver_type: str = "lu", rtol: float = 1e-8):
+    """
+    Creates the linear solver for the heat equation system.
+
+    Args:
+        A (PETSc.Mat): The assembled system matrix.
+        comm (MPI.Comm): Communicator of the mesh.
+        solver_type (str): "lu" for a direct MUMPS factorisation, suited to small problems, or "gamg" / "hypre"
+                           for conjugate gradients with PETSc or BoomerAMG algebraic multigrid, whose memory grows
+                           linearly with the problem size. "fieldsplit" preconditions a blocked (multi-layer) system
+                           with one GAMG-solved block per component, combined symmetrically.
+        rtol (float): Relative residual tolerance of the iterative solvers.
+
+    Returns:
+        solver (PETSc.KSP): The configured solver. PETSc options with the "firebird_" prefix are applied last.
+    """
+    if solver_type not in SOLVER_TYPES:
+        raise ValueError(f"Unknown solver type '{solver_type}', expected one of {SOLVER_TYPES}")
+
+    solver = PETSc.KSP().create(comm)
+    solver.setOptionsPrefix(SOLVER_OPTIONS_PREFIX)
+    solver.setOperators(A)  # Use the PETSc matrix
+    pc = solver.getPC()
+
+    if solver_type == "lu":
+        solver.setType(PETSc.KSP.Type.PREONLY)
+        pc.setType(PETSc.PC.Type.LU)
+        pc.setFactorSolverType(PETSc.Mat.SolverType.MUMPS)
+    else:
+        solver.setType(PETSc.KSP.Type.CG)
+        solver.setTolerances(rtol=rtol)
+        solver.setInitialGuessNonzero(True)  # start from the temperature of the previous step
+        if solver_type == "gamg":
+            pc.setType(PETSc.PC.Type.GAMG)
+        elif solver_type == "fieldsplit":
+            # One split per component of the blocked matrix, each approximated by an AMG cycle
+            pc.setType(PETSc.PC.Type.FIELDSPLIT)
+            pc.setFieldSplitType(PETSc.PC.CompositeType.SYMMETRIC_MULTIPLICATIVE)
+            options = PETSc.Options()
+            for component in range(A.getBlockSize()):
+                for name, value in (("ksp_type", "preonly"), ("pc_type", "gamg")):
+                    option = f"{SOLVER_OPTIONS_PREFIX}fieldsplit_{component}_{name}"
+                    if not options.hasName(option):
+                        options[option] = value
+        else:
+            pc.setType(PETSc.PC.Type.HYPRE)
+            pc.setHYPREType("boomeramg")
+
+    solver.setFromOptions()  # This is necessary to finalize the setup of the solver
+    return solver
+
+
+def build_single_layer_forms(u, v, T_n, Q, mass_coefficient, conductivity, cooling, ambient, steady=False):
+    """
+    Builds the forms of the single-layer model. All material and cooling coefficients are passed as
+    form constants, so the compiled forms can be reused for any of their values.
+
+    Args:
+        u, v: Trial and test functions.
+        T_n (Function): Temperature at the previous time step.
+        Q (Function): Heat source of the resistors.
+        mass_coefficient (Constant): rho*cp/dt.
+        conductivity (Constant): Thermal conductivity k.
+        cooling (Constant): Heat transfer coefficient of the cooling boundary.
+        ambient (Constant): Ambient temperature.
+        steady (bool): Build the stationary problem instead of the backward Euler step.
+
+    Returns:
+        a (ufl.Form): Bilinear form.
+        L (ufl.Form): Linear form.
+    """
+    if steady:
+        # ---- Stationary conduction with cooling: no mass term, cooling taken implicitly ---- #
+        a = conductivity * ufl.dot(ufl.grad(u), ufl.grad(v)) * ufl.dx + cooling * u * v * ufl.ds
+        L = Q * v * ufl.dx + cooling * ambient * v * ufl.ds
+        return a, L
+
+    # -------- Define the bilinear form (should contain unknowns u and v) -------- #
+    a = mass_coefficient * u * v * ufl.dx + conductivity * ufl.dot(ufl.grad(u), ufl.grad(v)) * ufl.dx
+
+    # --- Define the linear form (including contributions from known T_n and Q) -- #
+    L = mass_coefficient * T_n * v * ufl.dx + Q * v * ufl.dx
+    # Add Neumann boundary condition for cooling (heat flux in negative z-direction)
+    L += -cooling * (T_n - ambient) * v * ufl.ds
+    return a, L
+
+
+def build_nonlinear_forms(u, v, T_n, Q, properties, inverse_dt, cooling, ambient, steady=False):
+    """
+    Builds the forms of the single-layer model with temperature-dependent k(T) and rho*cp(T), lagged
+    as the nodal coefficient functions of a TemperatureDependentProperties.
+
+    Args:
+        u, v: Trial and test functions.
+        T_n (Function): Temperature at the previous time step.
+        Q (Function): Heat source of the resistors.
+        properties (TemperatureDependentProperties): The conductivity and heat capacity functions.
+        inverse_dt (Constant): 1/dt.
+        cooling (Constant): Heat transfer coefficient of the cooling boundary.
+        ambient (Constant): Ambient temperature.
+        steady (bool): Build the stationary problem instead of the backward Euler step.
+
+    Returns:
+        a (ufl.Form): Bilinear form.
+        L (ufl.Form): Linear form.
+    """
+    if steady:
+        a = properties.conductivity * ufl.dot(ufl.grad(u), ufl.grad(v)) * ufl.dx + cooling * u * v * ufl.ds
+        L = Q * v * ufl.dx + cooling * ambient * v * ufl.ds
+        return a, L
+
+    a = properties.heat_capacity * inverse_dt * u * v * ufl.dx + properties.conductivity * ufl.dot(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    L = properties.heat_capacity * inverse_dt * T_n * v * ufl.dx + Q * v * ufl.dx
+    L += -cooling * (T_n - ambient) * v * ufl.ds
+    return a, L
+
+
+class TransientHeatSolver:
     """
-    Solves the transient heat flow equation over the layout.
+    Persistent solver for the time-discretised heat equation A T_(n+1) = b(T_n).
+
+    The bilinear and linear forms are compiled once, the matrix A is assembled and factorised once,
+    and a single right-hand side vector is kept for the whole simulation. Every step zeroes and
+    reassembles that vector in place and solves straight into the previous-step temperature T_n.
+    A steady-state problem is solved the same way, as a single step whose forms do not depend on T_n.
+
+    Args:
+        a (ufl.Form): Bilinear form of the time-discretised heat equation.
+        L (ufl.Form): Linear form, containing the previous-step temperature T_n.
+        T_n (Function): Temperature at the previous time step, overwritten by every solve.
+        boundary_conditions (list): Dirichlet boundary conditions of the system.
+        track_change (bool): Record the largest step-to-step temperature change in last_change after every step.
+        operator_key: Cache key of the initial operator, see use_operator.
+        solver_type (str): Linear solver configuration, see create_solver.
+        rtol (float): Relative residual tolerance of the iterative solvers.
+    """
+
+    def __init__(self, a, L, T_n, boundary_conditions, track_change=False, operator_key=None, solver_type="lu", rtol=1e-8):
+        setup_start = time.perf_counter()
+
+        self.T_n = T_n
+        self.boundary_conditions = boundary_conditions
+        self.solver_type = solver_type
+        self.rtol = rtol
+
+        # Previous-step values, only kept when the step-to-step change is tracked
+        self.num_owned = T_n.function_space.dofmap.index_map.size_local * T_n.function_space.dofmap.index_map_bs
+        self.T_previous = np.empty(self.num_owned, dtype=PETSc.ScalarType) if track_change else None
+        self.last_change = np.inf
+
+        # ------------------------ Compile the forms only once ----------------------- #
+        with profiling.phase("form_compile"):
+            self.a_form = form(a, jit_options=jitCache.JIT_OPTIONS)
+            self.L_form = form(L, jit_options=jitCache.JIT_OPTIONS)
+
+        # ------------- Right-hand side vector reused throughout the solve ------------ #
+        self.b = fem.petsc.create_vector(self.L_form)
+
+        # ---------- Assemble and factorise A, cached by operator key (e.g. dt) ---------- #
+        self.operators = OrderedDict()
+        self.max_operators = 1
+        self.operator_key = None
+        self.num_factorisations = 0
+        self.use_operator(operator_key)
+
+        self.setup_time = time.perf_counter() - setup_start
+        self.assembly_times = []
+        self.solve_times = []
+        self.iterations = []
+        self.residuals = []
+
+    def _factorise(self):
+        """Assembles A from the current form constants and sets up a solver with its factorisation."""
+        with profiling.phase("assembly"):
+            A = assemble_matrix(self.a_form, bcs=self.boundary_conditions)
+            A.assemble()
+
+        # ------------------------------ Create a solver ----------------------------- #
+        with profiling.phase("factorisation", solver=self.solver_type):
+            solver = create_solver(A, self.T_n.function_space.mesh.comm, self.solver_type, self.rtol)
+            solver.setUp()  # Factorise A (or build the multigrid hierarchy) now rather than during the first step
+
+        self.num_factorisations += 1
+        return A, solver
+
+    def use_operator(self, key, max_operators=None):
+        """
+        Switches A and its factorisation to the ones belonging to key, such as a time step size. The form
+        constants that A depends on must already hold the values for key. The most recently used
+        max_operators factorisations are kept, so returning to a recent key does not refactorise.
+        """
+        if max_operators is not None:
+            self.max_operators = max(1, max_operators)
+        if key == self.operator_key and self.operators:
+            return
+
+        if key in self.operators:
+            self.operators.move_to_end(key)
+        else:
+            self.operators[key] = self._factorise()
+            while len(self.operators) > self.max_operators:
+                _, (A, solver) = self.operators.popitem(last=False)
+                solver.destroy()
+                A.destroy()
+
+        self.A, self.solver = self.operators[key]
+        self.operator_key = key
+
+    def refactorise(self):
+        """
+        Reassembles and refactorises A after coefficients of the bilinear form have changed. Cached
+        operators for other keys were assembled with the old coefficients and are discarded.
+        """
+        for A, solver in self.operators.values():
+            solver.destroy()
+            A.destroy()
+        self.operators.clear()
+        key, self.operator_key = self.operator_key, None
+        self.use_operator(key)
+
+    def assemble_rhs(self):
+        """Zeroes the right-hand side vector and reassembles it in place from the current T_n."""
+        with self.b.localForm() as b_local:
+            b_local.set(0.0)
+        assemble_vector(self.b, self.L_form)
+        fem.petsc.apply_lifting(self.b, [self.a_form], bcs=[self.boundary_conditions])
+        self.b.ghostUpdate(addv=PETSc.InsertMode.ADD, mode=PETSc.ScatterMode.REVERSE)
+        fem.petsc.set_bc(self.b, self.boundary_conditions)
+
+    def step(self):
+        """Advances T_n by one time step and records the assembly and solve timings."""
+        step_start = time.perf_counter()
+        with profiling.repeated_phase("rhs_assembly"):
+            self.assemble_rhs()
+        assembled = time.perf_counter()
+
+        if self.T_previous is not None:
+            np.copyto(self.T_previous, self.T_n.x.array[:self.num_owned])
+
+        # T_n holds the previous step, which warm-starts the iterative solvers
+        with profiling.repeated_phase("solve"):
+            self.solver.solve(self.b, self.T_n.vector)
+            self.T_n.x.scatter_forward()
+        solved = time.perf_counter()
+
+        self.iterations.append(self.solver.getIterationNumber())
+        self.residuals.append(self.solver.getResidualNorm())
+        if self.solver.getConvergedReason() < 0:
+            raise RuntimeError(f"Linear solver did not converge (reason {self.solver.getConvergedReason()}) after {self.iterations[-1]} iterations, residual {self.residuals[-1]:.3e}")
+
+        if self.T_previous is not None:
+            local_change = np.max(np.abs(self.T_n.x.array[:self.num_owned] - self.T_previous), initial=0.0)
+            self.last_change = self.T_n.function_space.mesh.comm.allreduce(local_change, op=MPI.MAX)
+
+        self.assembly_times.append(assembled - step_start)
+        self.solve_times.append(solved - assembled)
+
+    def print_timings(self):
+        """Prints the one-off setup time and the per-step assembly and solve timings."""
+        num_steps = len(self.solve_times)
+        print(f"Solver setup (form compilation, assembly and factorisation): {self.setup_time * 1000:.2f} ms")
+        if self.num_factorisations > 1:
+            print(f"Factorisations of A: {self.num_factorisations}")
+        if num_steps > 0:
+            print(f"Per-step RHS assembly: {np.mean(self.assembly_times) * 1000:.3f} ms (total {np.sum(self.assembly_times) * 1000:.2f} ms over {num_steps} steps)")
+            print(f"Per-step solve: {np.mean(self.solve_times) * 1000:.3f} ms (total {np.sum(self.solve_times) * 1000:.2f} ms over {num_steps} steps)")
+            if self.solver_type != "lu":
+                print(f"Solver iterations per step: min {np.min(self.iterations)}, mean {np.mean(self.iterations):.1f}, max {np.max(self.iterations)}; largest final residual {np.max(self.residuals):.3e}")
+
+
+class TemperatureDependentProperties:
+    """
+    Thermal conductivity k(T) and volumetric heat capacity rho*cp(T) held as P1 Functions, so they can
+    be used directly as coefficients of the forms. Tabulated curves are interpolated piecewise linearly
+    at every dof with np.interp and held constant beyond the ends of the table. Properties without a
+    table keep their constant value.
+
+    Args:
+        V (FunctionSpace): The function space for temperature.
+        rho (float): Density.
+        cp (float): Constant specific heat capacity, used when cp_table is None.
+        k (float): Constant thermal conductivity, used when k_table is None.
+        cp_table (tuple): Temperatures and specific heat capacities, or None.
+        k_table (tuple): Temperatures and thermal conductivities, or None.
+    """
+
+    def __init__(self, V, rho: float, cp: float, k: float, cp_table=None, k_table=None):
+        self.rho = rho
+        self.cp_table = tuple(np.asarray(column, dtype=float) for column in cp_table) if cp_table is not None else None
+        self.k_table = tuple(np.asarray(column, dtype=float) for column in k_table) if k_table is not None else None
+
+        self.heat_capacity = Function(V)
+        self.conductivity = Function(V)
+        self.heat_capacity.x.array[:] = rho * cp
+        self.conductivity.x.array[:] = k
+
+        self.num_owned = V.dofmap.index_map.size_local * V.dofmap.index_map_bs
+        self.comm = V.mesh.comm
+
+    def evaluate(self, temperature: np.ndarray):
+        """Returns rho*cp and k at the given temperatures (None for properties without a table)."""
+        heat_capacity = self.rho * np.interp(temperature, *self.cp_table) if self.cp_table is not None else None
+        conductivity = np.interp(temperature, *self.k_table) if self.k_table is not None else None
+        return heat_capacity, conductivity
+
+    def update(self, temperature: np.ndarray):
+        """Evaluates the properties at the given (owned and ghost) dof temperatures."""
+        heat_capacity, conductivity = self.evaluate(temperature)
+        if heat_capacity is not None:
+            self.heat_capacity.x.array[:] = heat_capacity
+        if conductivity is not None:
+            self.conductivity.x.array[:] = conductivity
+
+    def relative_change(self, temperature: np.ndarray):
+        """Largest relative difference, over all ranks, between the properties at temperature and the ones currently in use."""
+        change = 0.0
+        heat_capacity, conductivity = self.evaluate(temperature[:self.num_owned])
+        for new, current in ((heat_capacity, self.heat_capacity), (conductivity, self.conductivity)):
+            if new is not None:
+                in_use = current.x.array[:self.num_owned]
+                change = max(change, np.max(np.abs(new - in_use) / np.abs(in_use), initial=0.0))
+        return self.comm.allreduce(change, op=MPI.MAX)
+
+
+class NonlinearHeatStepper:
+    """
+    Time steps with temperature-dependent properties by a lagged Picard iteration.
+
+    The properties are frozen at the temperature they were last evaluated at, so a step normally costs
+    one back-solve with the existing factorisation, as in the linear case. After every solve the
+    properties are checked at the new temperature. Only when they differ from the frozen ones by more
+    than prop_tol (relative) are they re-evaluated, A reassembled and refactorised, and the step repeated
+    from its starting temperature, up to max_iterations times.
+
+    Args:
+        solver (TransientHeatSolver): Solver whose forms use the Functions of properties.
+        properties (TemperatureDependentProperties): The temperature-dependent properties.
+        prop_tol (float): Largest relative property change that is accepted without updating A.
+        max_iterations (int): Largest number of Picard iterations per step.
+    """
+
+    def __init__(self, solver, properties, prop_tol: float = 0.05, max_iterations: int = 20):
+        self.solver = solver
+        self.properties = properties
+        self.prop_tol = prop_tol
+        self.max_iterations = max_iterations
+        self.T_start = np.empty_like(solver.T_n.x.array)
+        self.num_updates = 0
+        self.picard_iterations = []
+
+    @property
+    def last_change(self):
+        return self.solver.last_change
+
+    def step(self):
+        T_n = self.solver.T_n
+        np.copyto(self.T_start, T_n.x.array)
+
+        for iteration in range(1, self.max_iterations + 1):
+            self.solver.step()
+            if self.properties.relative_change(T_n.x.array) <= self.prop_tol:
+                break
+            if iteration == self.max_iterations:
+                print(f"\n\033[103mPicard iteration did not reach prop_tol = {self.prop_tol:g} in {self.max_iterations} iterations\033[0m")
+                break
+
+            # ------- Properties moved too far: update them, refactorise and redo the step ------- #
+            self.properties.update(T_n.x.array)
+            self.solver.refactorise()
+            self.num_updates += 1
+            T_n.x.array[:] = self.T_start
+
+        self.picard_iterations.append(iteration)
+
+    def print_statistics(self):
+        print(f"Nonlinear properties: {self.num_updates} operator updates, {np.mean(self.picard_iterations):.2f} Picard iterations per step on average")
+
+
+class AdaptiveTimeStepper:
+    """
+    Backward Euler time stepping with error control by step doubling.
+
+    Every attempted step is taken once with dt and twice with dt/2. The largest difference between the
+    two results estimates the local error. A step is accepted when that estimate is within error_tol,
+    keeping the more accurate half-step result, and rejected and retried with half the step otherwise.
+    Because backward Euler's local error scales with dt^2, the step is doubled after a step whose
+    error was below a quarter of the tolerance.
+
+    Step sizes are restricted to dt_0 * 2^k, so only a handful of distinct operators occur. Their
+    factorisations are cached by the solver, and A is only refactorised for a step size that has not
+    been used recently. Time is counted in integer ticks of the smallest step dt_0 * 2^MIN_LEVEL, so
+    steps limited to end exactly at a given time (the end of the run, an output time) stay on the
+    same ladder of step sizes.
+
+    Args:
+        solver (TransientHeatSolver): Solver of the backward Euler system.
+        mass_coefficient (Constant): The rho*cp/dt constant of the forms.
+        rho_cp (float): Volumetric heat capacity rho*cp.
+        dt_0 (float): Initial time step.
+        error_tol (float): Allowed local error per step (K).
+        dt_max (float): Largest allowed time step, 0 for no limit.
+        max_operators (int): Number of factorisations kept in the cache.
+        source (ResistorSource): Time-varying heat source, updated to the end time of every (half) step, or None.
+    """
+
+    MIN_LEVEL = -30
+
+    def __init__(self, solver, mass_coefficient, rho_cp: float, dt_0: float, error_tol: float, dt_max: float = 0.0, max_operators: int = 4, source=None):
+        self.solver = solver
+        self.mass_coefficient = mass_coefficient
+        self.rho_cp = rho_cp
+        self.dt_0 = dt_0
+        self.error_tol = error_tol
+        self.max_level = int(math.floor(math.log2(dt_max / dt_0))) if dt_max > 0 else 30
+        self.max_operators = max_operators
+        self.level = min(0, self.max_level)
+
+        self.T_start = np.empty_like(solver.T_n.x.array)
+        self.T_full = np.empty_like(solver.T_n.x.array)
+        self.num_owned = solver.num_owned
+        self.comm = solver.T_n.function_space.mesh.comm
+        self.rejected = 0
+        self.source = source
+        self.ticks = 0
+
+    @property
+    def time(self):
+        return self.ticks * self.dt_0 * 2.0 ** self.MIN_LEVEL
+
+    def to_ticks(self, t: float):
+        """Returns the time t in ticks, rounded to the nearest tick."""
+        return round(t / self.dt_0 * 2 ** -self.MIN_LEVEL)
+
+    def _step(self, level, num_steps):
+        dt = self.dt_0 * 2.0 ** level
+        self.mass_coefficient.value = self.rho_cp / dt
+        self.solver.use_operator(level, self.max_operators)
+        for step in range(1, num_steps + 1):
+            if self.source is not None:
+                self.source.update(self.time + step * dt)
+            self.solver.step()
+
+    def advance(self, until: int = None):
+        """
+        Takes one accepted step of T_n and returns the step size and its error estimate. With until (in
+        ticks, after the current time) the step is the largest of the ladder that does not pass it.
+        """
+        T_n = self.solver.T_n
+        np.copyto(self.T_start, T_n.x.array)
+
+        while True:
+            level = self.level
+            if until is not None:
+                level = min(level, (until - self.ticks).bit_length() - 1 + self.MIN_LEVEL)
+
+            # -------------------- One full step with the current dt -------------------- #
+            self._step(level, 1)
+            np.copyto(self.T_full, T_n.x.array)
+
+            # ------------- Two half steps from the same starting temperature ------------- #
+            T_n.x.array[:] = self.T_start
+            self._step(level - 1, 2)
+
+            local_error = np.max(np.abs(T_n.x.array[:self.num_owned] - self.T_full[:self.num_owned]), initial=0.0)
+            error = self.comm.allreduce(local_error, op=MPI.MAX)
+
+            if error <= self.error_tol or level <= self.MIN_LEVEL:
+                self.ticks += 2 ** (level - self.MIN_LEVEL)
+                # A step shortened to reach until says nothing about the step size that is otherwise allowed
+                if level == self.level and error < self.error_tol / 4 and self.level < self.max_level:
+                    self.level += 1
+                return self.dt_0 * 2.0 ** level, error
+
+            # ---------------------- Rejected: retry with half the step ---------------------- #
+            T_n.x.array[:] = self.T_start
+            self.level = level - 1
+            self.rejected += 1
+
+
+def run_adaptive(solver, mass_coefficient, rho_cp: float, dt_0: float, t_end: float, error_tol: float, dt_max: float, output_writer, output_dt: float, source=None, probe_recorder=None, probe_every: int = 1, stop_tol: float = 0.0):
+    """
+    Runs adaptive time stepping from t = 0 until exactly t_end and writes the solution at every
+    multiple of output_dt of simulated time, where steps are shortened to end. Probes are recorded
+    every probe_every accepted steps. With stop_tol the run ends once the temperature change of a step,
+    scaled to a step of dt_0, is below stop_tol (K), the criterion of fixed time steps of dt_0.
+    """
+    stepper = AdaptiveTimeStepper(solver, mass_coefficient, rho_cp, dt_0, error_tol, dt_max, source=source)
+    T_n = solver.T_n
+    end = stepper.to_ticks(t_end)
+    step = 0
+    output_index = 1
+    dt = dt_0
+
+    def output_ticks():
+        return stepper.to_ticks(output_index * output_dt)
+
+    with tqdm(total=t_end, desc="Simulating Heat Flow", unit="s", disable=stepper.comm.rank != 0) as pbar:
+        while stepper.ticks < end:
+            until = end if output_writer is None else min(end, max(output_ticks(), stepper.ticks + 1))
+            dt, error = stepper.advance(until)
+            current_time = stepper.time
+            step += 1
+
+            # ------------------ Save the solution at fixed simulated times ------------------ #
+            written = output_writer is not None and stepper.ticks >= output_ticks()
+            if written:
+                output_writer.write(T_n.x.array, current_time, step)
+                while output_ticks() <= stepper.ticks:
+                    output_index += 1
+            recorded = probe_recorder is not None and step % probe_every == 0
+            if recorded:
+                probe_recorder.record(T_n, current_time, step)
+
+            pbar.set_postfix(dt=f"{dt:.3g}", error=f"{error:.2e}", iterations=solver.iterations[-1], residual=f"{solver.residuals[-1]:.2e}")
+            pbar.update(min(dt, t_end - pbar.n))
+
+            # ------------- Stop once the temperature no longer changes much ------------- #
+            if stop_tol > 0:
+                local_change = np.max(np.abs(T_n.x.array[:stepper.num_owned] - stepper.T_start[:stepper.num_owned]), initial=0.0)
+                change = stepper.comm.allreduce(local_change, op=MPI.MAX) * dt_0 / dt
+                if change < stop_tol:
+                    print(f"\n\033[92mConverged after {step} steps (t = {current_time:g} s): temperature change per {dt_0:g} s {change:.3e} K < {stop_tol:g} K\033[0m")
+                    if output_writer is not None and not written:
+                        output_writer.write(T_n.x.array, current_time, step)
+                    if probe_recorder is not None and not recorded:
+                        probe_recorder.record(T_n, current_time, step)
+                    break
+
+    print(f"Adaptive stepping: {step} accepted and {stepper.rejected} rejected steps up to t = {stepper.time:g} s, final dt = {dt_0 * 2.0 ** stepper.level:g} s")
+
+
+def findHeatSolution(mesh_input, layout_length:float, layout_width:float, rho_param:float, c_p_param:float, k_param:float, resistor_data:ResistorTable, iteration_num: int, delta: float, h_cooling: float, T_ambient: float, source_mode: str = "nodal", output_every: int = 10, output_format: str = "xdmf", output_queue: int = 4, mode: str = "transient", stop_tol: float = 0.0, adaptive: bool = False, error_tol: float = 0.01, dt_max: float = 0.0, output_dt: float = 0.0, solver_type: str = "lu", solver_rtol: float = 1e-8, layers: list = None, resistor_layer: int = None, substrate_layer: int = None, k_table=None, cp_table=None, prop_tol: float = 0.05, picard_max: int = 20, power_profiles=None, probe_output: str = "none", probe_every: int = 1, probe_points=None):
+    """
+    Solves the transient heat flow equation over the layout, or directly its steady state.
     Includes in-plane heat conduction (x, y) and cooling in the z-direction (Neumann boundary condition).
     
+    mesh_input: Path to a GMSH .msh file, or a (domain, cell_tags, facet_tags) tuple from generateOutputFiles.generate_mesh.
     h_cooling: Heat transfer coefficient (to model cooling in negative z-direction).
     T_ambient: Ambient temperature (to model cooling effect).
+    source_mode: Heat source representation, "nodal" (averaged to the nodes) or "dg0" (cellwise constant).
+    output_every: Number of time steps between full-field outputs, 0 disables full-field output.
+    output_format: "xdmf" for the binary XDMF time series, "vtk" for one legacy ASCII file per output step.
+    output_queue: Maximum number of output steps waiting for the background writer, 0 writes synchronously.
+    mode: "transient" for time stepping, "steady" for a single solve of the stationary problem.
+    stop_tol: Stop time stepping once the largest step-to-step temperature change falls below this value (K), 0 disables. Adaptive steps are scaled to a step of delta.
+    adaptive: Adapt the time step to error_tol, starting from delta and running until iteration_num * delta.
+    error_tol: Allowed local error per adaptive time step (K).
+    dt_max: Largest adaptive time step, 0 for no limit.
+    output_dt: Simulated time between adaptive outputs, 0 for output_every * delta.
+    solver_type: Linear solver, "lu" (direct, MUMPS), "gamg" or "hypre" (conjugate gradients with algebraic multigrid).
+    solver_rtol: Relative residual tolerance of the iterative solvers.
+    layers: Layer dictionaries from parseLayers.get_all_layers to solve the stacked multi-layer model, None for the single substrate layer.
+    resistor_layer, substrate_layer: Layer numbers of the resistive and substrate layers in the stacked model.
+    k_table, cp_table: Tabulated (temperatures, values) curves of k(T) and cp(T) from the layer XML, None for constant properties.
+    prop_tol: Relative property change above which A is rebuilt during the nonlinear solve.
+    picard_max: Largest number of Picard iterations per step of the nonlinear solve.
+    power_profiles: Time-varying resistor powers (powerProfiles.PowerProfiles), None for the constant powers of resistor_data.
+    probe_output: "csv" or "parquet" to stream per-resistor max/mean/integral temperatures and point probes, "none" to disable.
+    probe_every: Number of time steps between probe rows.
+    probe_points: Point probe coordinates (num_points, 2), None for resistor probes only.
     """
 
    
@@ -111,13 +842,15 @@ def findHeatSolution(msh_filename, layout_length:float, layout_width:float, rho_
     start_time = time.time()
 
     # ------------------ Load the mesh and associated facet tags ----------------- #
-    print("""\033[92m
+    if isinstance(mesh_input, str):
+        print("""\033[92m
     +-----------------------------+
     | Reading mesh data from file |
     +-----------------------------+
     \033[0m""")
-
-    domain, cell_tags, facet_tags = generateOutputFiles.get_mesh(msh_filename)
+        domain, cell_tags, facet_tags = generateOutputFiles.get_mesh(mesh_input)
+    else:
+        domain, cell_tags, facet_tags = mesh_input
     # domain: Core mesh object representing the entire computing domain
     # cell_tags: Stores information about the tags assigned to mesh elements (cells), which are the triangles in 2D: Used for subdomain identification
     # facet_tags: Stores information about the tags assigned to the boundaries (facets), which are edges in 2D: Used for boundary conditions
@@ -125,6 +858,7 @@ def findHeatSolution(msh_filename, layout_length:float, layout_width:float, rho_
 
     # ----------------------- Defining the function space V ---------------------- #
     V = fem.FunctionSpace(domain, ("CG", 1))
+    profiling.annotate(cells=domain.topology.index_map(domain.topology.dim).size_global, dofs=V.dofmap.index_map.size_global)
 
     # ----------------- Defining relevant functions ---------------- #
     T_n = Function(V)  # Temperature at previous time step
@@ -134,21 +868,51 @@ def findHeatSolution(msh_filename, layout_length:float, layout_width:float, rho_
     delta_t = delta    # Time step size = delta parameter
 
     # --------- Define the heat source as a Function in the FunctionSpace -------- #
-    Q = apply_heat_flux_to_resistor_regions(V, domain, cell_tags, resistor_data)
-    with dolfinx.io.VTKFile(MPI.COMM_WORLD,"heat_flux_output_test.vtk", "w") as vtk_file:
+    if power_profiles is not None:
+        # Q(t) = B p(t), updated in place before every step
+        source = ResistorSource(V, domain, cell_tags, resistor_data, power_profiles, source_mode)
+        source.update(0.0 if mode == "steady" else delta)
+        Q = source.Q
+        if mode == "steady":
+            print("\n\033[103mSteady-state mode uses the powers of the profiles at t = 0\033[0m")
+    else:
+        source = None
+        Q = apply_heat_flux_to_resistor_regions(V, domain, cell_tags, resistor_data, source_mode)
+    with dolfinx.io.VTKFile(domain.comm, "heat_flux_output_test.vtk", "w") as vtk_file:
         vtk_file.write_mesh(domain)  # Write the mesh first
         vtk_file.write_function(Q)   # Write the function Q containing heat flux values
 
     print("\n\033[92mPreparing simulation...\033[0m")
 
-    # -------- Define the bilinear form (should contain unknowns u and v) -------- #
-    a = (rho_param * c_p_param / delta_t) * u * v * ufl.dx + k_param * ufl.dot(ufl.grad(u), ufl.grad(v)) * ufl.dx
+    # ------------- Material and cooling coefficients as form constants ------------ #
+    # Constants keep the compiled forms independent of the parameter values
+    mass_coefficient = Constant(domain, PETSc.ScalarType(rho_param * c_p_param / delta_t))
+    conductivity = Constant(domain, PETSc.ScalarType(k_param))
+    cooling = Constant(domain, PETSc.ScalarType(h_cooling))
+    ambient = Constant(domain, PETSc.ScalarType(T_ambient))
 
+    # Tabulated properties are only supported by the single-layer fixed-step solver
+    nonlinear = k_table is not None or cp_table is not None
+    if nonlinear and (layers is not None or adaptive):
+        raise ValueError("Temperature-dependent properties are not supported with layers=stack or adaptive=1")
 
-    # --- Define the linear form (including contributions from known T_n and Q) -- #
-    L = (rho_param * c_p_param / delta_t) * T_n * v * ufl.dx + Q * v * ufl.dx
-    # Add Neumann boundary condition for cooling (heat flux in negative z-direction)
-    L += -h_cooling * (T_n - T_ambient) * v * ufl.ds
+    # dt-dependent constant of the forms and the value it takes times dt, used by the adaptive time stepper
+    dt_constant, dt_numerator = mass_coefficient, rho_param * c_p_param
+    field_names = None
+
+    if layers is not None:
+        # ------- Stacked-2D model: one temperature field per layer of the XML file ------- #
+        V, T_n, a, L, dt_constant = layerStack.build_stack_forms(domain, layers, resistor_layer, substrate_layer, Q, delta_t, h_cooling, T_ambient, steady=mode == "steady")
+        dt_numerator = 1.0
+        field_names = layerStack.field_names(layers)
+    elif nonlinear:
+        # ------- Temperature-dependent k(T) and rho*cp(T) as nodal coefficient functions ------- #
+        properties = TemperatureDependentProperties(V, rho_param, c_p_param, k_param, cp_table, k_table)
+        properties.update(T_n.x.array)
+        inverse_dt = Constant(domain, PETSc.ScalarType(1.0 / delta_t))
+        a, L = build_nonlinear_forms(u, v, T_n, Q, properties, inverse_dt, cooling, ambient, steady=mode == "steady")
+    else:
+        a, L = build_single_layer_forms(u, v, T_n, Q, mass_coefficient, conductivity, cooling, ambient, steady=mode == "steady")
 
 
     # ---------- Boundary condition (Dirichlet for ambient temperature) ---------- #
@@ -157,23 +921,33 @@ def findHeatSolution(msh_filename, layout_length:float, layout_width:float, rho_
 
 
     # ------------------------- Time-stepping parameters ------------------------- #
-    num_steps = iteration_num  # Number of time steps
+    # In steady-state mode the whole simulation is a single linear solve
+    num_steps = 1 if mode == "steady" else iteration_num  # Number of time steps
     current_time = 0.0
+    adaptive = adaptive and mode == "transient"
+    early_stop = mode == "transient" and stop_tol > 0 and not adaptive
 
 
-    # --------------------------- Assemble the matrix A -------------------------- #
-    A = fem.petsc.create_matrix(form(a))
-    A_mat = fem.petsc.assemble_matrix(A, form(a), bcs=boundary_conditions)
-    A_mat.assemble()
+    # ------- Compile the forms, assemble A and factorise it once for all steps ------ #
+    solver = TransientHeatSolver(a, L, T_n, boundary_conditions, track_change=early_stop, operator_key=0 if adaptive else None,
+                                 solver_type=solver_type, rtol=solver_rtol)
 
 
-    # ------------------------------ Create a solver ----------------------------- #
-    solver = PETSc.KSP().create(domain.comm)
-    solver.setOperators(A_mat)  # Use the PETSc matrix
-    solver.setType(PETSc.KSP.Type.CG)
-    solver.getPC().setType(PETSc.PC.Type.LU)
-    solver.getPC().setFactorSolverType(PETSc.Mat.SolverType.MUMPS)
-    solver.setFromOptions()  # This is necessary to finalize the setup of the solver
+    # -- Steps of the nonlinear model go through the Picard iteration around the solver -- #
+    stepper = NonlinearHeatStepper(solver, properties, prop_tol, picard_max) if nonlinear else solver
+
+
+    # ------------- Full-field output, written on a background thread ------------- #
+    output_writer = create_output_writer(V, domain, output_format, output_queue, field_names) if output_every > 0 and output_format != "none" else None
+
+
+    # ---------- Per-resistor and point probes, streamed as a time series ---------- #
+    probe_recorder = None
+    if probe_output != "none" and probe_every > 0:
+        if V.dofmap.index_map_bs > 1:
+            print("\n\033[103mProbes are not supported by the stacked model, probe output is disabled\033[0m")
+        else:
+            probe_recorder = probes.ProbeRecorder(V, cell_tags, resistor_data, probe_points if probe_points is not None else np.zeros((0, 2)), probe_output)
 
 
     # ---------------------------------------------------------------------------- #
@@ -186,32 +960,55 @@ def findHeatSolution(msh_filename, layout_length:float, layout_width:float, rho_
           \033[0m""")
 
 
-    with tqdm(total=num_steps, desc="Simulating Heat Flow", unit="step") as pbar:
-        for step in range(num_steps):
-            current_time += delta_t
+    try:
+        if adaptive:
+            run_adaptive(solver, dt_constant, dt_numerator, delta_t, num_steps * delta_t, error_tol, dt_max,
+                         output_writer, output_dt if output_dt > 0 else output_every * delta_t, source, probe_recorder, probe_every, stop_tol)
+        else:
+            with tqdm(total=num_steps, desc="Simulating Heat Flow", unit="step", disable=domain.comm.rank != 0) as pbar:
+                for step in range(num_steps):
+                    if mode == "transient":
+                        current_time += delta_t
+                        # Backward Euler takes the source at the end of the step
+                        if source is not None:
+                            source.update(current_time)
 
-            # ------------------ Assemble the right-hand side vector (b) ----------------- #
-            b = fem.petsc.create_vector(form(L))
-            b_vec = fem.petsc.assemble_vector(b, form(L))
-            fem.apply_lifting(b_vec, [form(a)], bcs=[boundary_conditions])
-            b_vec.ghostUpdate(addv=PETSc.InsertMode.ADD, mode=PETSc.ScatterMode.REVERSE)
-            fem.set_bc(b_vec, boundary_conditions)
+                    # ------------- Reassemble b in place and solve directly into T_n ------------ #
+                    stepper.step()
 
-            # ----------------------------- Solve the system ----------------------------- #
-            T_new = Function(V)
-            solver.solve(b_vec, T_new.vector)
-            T_new.x.scatter_forward()
+                    # ----------------------------- Save the solution ---------------------------- #
+                    if output_writer is not None and step % output_every == 0:
+                        output_writer.write(T_n.x.array, current_time, step)
+                    if probe_recorder is not None and step % probe_every == 0:
+                        probe_recorder.record(T_n, current_time, step)
 
-            # ----------------------- Update for the next time step ---------------------- #
-            T_n.x.array[:] = T_new.x.array[:]
 
-            # ----------------------------- Save the solution ---------------------------- #
-            if step % 10 == 0:
-                vtk_filename = f"heat_solution_step_{step}.vtk"
-                generateOutputFiles.write_legacy_vtk(vtk_filename, domain, T_new, step, current_time)
+                    if solver_type != "lu":
+                        pbar.set_postfix(iterations=solver.iterations[-1], residual=f"{solver.residuals[-1]:.2e}")
+                    pbar.update(1) # Update the progress bar
 
+                    # ------------- Stop once the temperature no longer changes much ------------- #
+                    if early_stop and stepper.last_change < stop_tol:
+                        print(f"\n\033[92mConverged after {step + 1} steps (t = {current_time:g} s): largest temperature change {stepper.last_change:.3e} K < {stop_tol:g} K\033[0m")
+                        if output_writer is not None and step % output_every != 0:
+                            output_writer.write(T_n.x.array, current_time, step)
+                        if probe_recorder is not None and step % probe_every != 0:
+                            probe_recorder.record(T_n, current_time, step)
+                        break
+    finally:
+        # ------------------ Flush all pending output steps to disk ------------------ #
+        if output_writer is not None:
+            output_writer.close()
+        if probe_recorder is not None:
+            probe_recorder.close()
 
-            pbar.update(1) # Update the progress bar
+    if isinstance(output_writer, generateOutputFiles.AsyncOutputWriter):
+        print(f"Time spent waiting on output: {output_writer.blocked_time * 1000:.2f} ms")
+    solver.print_timings()
+    if source is not None:
+        print(f"Heat source updates: {source.num_updates}")
+    if nonlinear:
+        stepper.print_statistics()
 
     # ------------------ Find simulation time form time elapsed ------------------ #
     end_time = time.time()
@@ -0,0 +1,133 @@
+# ==============================================================================================
+# Persistent FFCx/JIT cache of the compiled forms
+# ==============================================================================================
+#
+# Example:
+#   python jitCache.py warm defParams.txt defLayers.xml
+#   python jitCache.py info
+#
+# jit_cache=<directory> in the parameter file points the compilation of every Firebird form at a
+# persistent directory, for instance one shared by the nodes of a cluster. "warm" compiles all forms a
+# simulation can use into it, so the first solve on a new machine loads them instead of compiling.
+
+import os
+import time
+import shutil
+import click
+
+# dolfinx's own default location of the FFCx/JIT cache
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "fenics")
+
+# JIT options of every form compiled by Firebird, set from jit_cache= in the parameter file
+JIT_OPTIONS = {}
+
+
+def cache_directory(jit_cache: str):
+    """Returns the JIT cache directory for the jit_cache option ('default' for dolfinx's default location)."""
+    return DEFAULT_CACHE_DIR if jit_cache == "default" else os.path.abspath(os.path.expanduser(jit_cache))
+
+
+def configure(jit_cache: str):
+    """Points the compilation of all Firebird forms at the cache directory of the jit_cache option."""
+    JIT_OPTIONS.clear()
+    if jit_cache != "default":
+        JIT_OPTIONS['cache_dir'] = cache_directory(jit_cache)
+        os.makedirs(JIT_OPTIONS['cache_dir'], exist_ok=True)
+
+
+def warm(layers: list = None, resistor_layer: int = None, substrate_layer: int = None):
+    """
+    Compiles every form a simulation can use into the configured cache, on a small mesh of the same
+    cell type as the layout meshes. Compiled forms depend only on the structure of the forms, not on
+    the mesh or the parameter values (which are form constants), so later runs load them from the
+    cache instead of compiling.
+
+    Compiled: the transient and steady single-layer forms, with and without temperature-dependent
+    properties, for both source modes; the adaptive refinement estimator; and, when the layers of an
+    XML file are given, the stacked-model forms for that number of layers.
+
+    Returns:
+        int: Number of forms compiled or loaded.
+    """
+    import ufl
+    from mpi4py import MPI
+    from petsc4py import PETSc
+    from dolfinx import fem, mesh
+    import heatFlow
+    import layerStack
+    import adaptiveMesh
+
+    domain = mesh.create_unit_square(MPI.COMM_SELF, 2, 2)
+    V = fem.FunctionSpace(domain, ("CG", 1))
+    T_n = fem.Function(V)
+    u = ufl.TrialFunction(V)
+    v = ufl.TestFunction(V)
+    scalar = lambda value: fem.Constant(domain, PETSc.ScalarType(value))
+    properties = heatFlow.TemperatureDependentProperties(V, 1.0, 1.0, 1.0)
+
+    forms = []
+    for source_mode in heatFlow.SOURCE_MODES:
+        Q = fem.Function(V if source_mode == "nodal" else fem.FunctionSpace(domain, ("DG", 0)))
+        for steady in (False, True):
+            forms += heatFlow.build_single_layer_forms(u, v, T_n, Q, scalar(1.0), scalar(1.0), scalar(1.0), scalar(1.0), steady=steady)
+            forms += heatFlow.build_nonlinear_forms(u, v, T_n, Q, properties, scalar(1.0), scalar(1.0), scalar(1.0), steady=steady)
+            if layers is not None:
+                forms += layerStack.build_stack_forms(domain, layers, resistor_layer, substrate_layer, Q, 1.0, 1.0, 1.0, steady=steady)[2:4]
+        forms.append(adaptiveMesh.indicator_form(T_n, Q, 1.0, 1.0, 1.0))
+
+    for compiled in forms:
+        fem.form(compiled, jit_options=JIT_OPTIONS)
+    return len(forms)
+
+
+# ---------------------------------------------------------------------------- #
+#                 Command line: pre-warm, inspect or clear the cache            #
+# ---------------------------------------------------------------------------- #
+@click.group()
+def cli():
+    """Pre-warm, inspect or clear the FFCx/JIT cache of the compiled forms."""
+
+
+@cli.command('warm')
+@click.argument('params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('xml_file', required=False, type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+def warm_command(params, xml_file):
+    """Compile every form of a simulation with PARAMS into its jit_cache (and the stacked model of XML_FILE)."""
+    import parseParams
+    import parseLayers
+
+    options = parseParams.parse_options(params)
+    configure(options['jit_cache'])
+
+    layers = resistor_layer = substrate_layer = None
+    if xml_file is not None:
+        substrate_layer, resistor_layer = parseParams.parse_file(params)[:2]
+        layers = parseLayers.get_all_layers(xml_file)
+        if not type(layers) == list:
+            print(layers)
+            return
+
+    start = time.perf_counter()
+    num_forms = warm(layers, resistor_layer, substrate_layer)
+    print(f"\033[92m{num_forms} forms compiled into\033[0m \033[95m{cache_directory(options['jit_cache'])}\033[0m in {time.perf_counter() - start:.1f} s")
+
+
+@cli.command()
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, show_default=True, help="Directory of the JIT cache.")
+def info(cache_dir):
+    """Show the size of the JIT cache."""
+    files = [os.path.join(root, name) for root, _, names in os.walk(cache_dir) for name in names]
+    total = sum(os.path.getsize(path) for path in files)
+    print(f"JIT cache: \033[95m{cache_dir}\033[0m ({len(files)} files, {total / 1024 ** 2:.1f} MB)")
+
+
+@cli.command()
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, show_default=True, help="Directory of the JIT cache.")
+def clear(cache_dir):
+    """Remove the JIT cache."""
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    print(f"Removed {cache_dir}")
+
+
+if __name__ == '__main__':
+    cli()
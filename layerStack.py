@@ -0,0 +1,115 @@
+import ufl
+import numpy as np
+from petsc4py import PETSc
+from dolfinx import fem
+from dolfinx.fem import Function, Constant
+
+
+def layer_number(layer: dict):
+    """Returns the layer number of a layer dictionary from parseLayers."""
+    return int(layer['LayerNumber'].text)
+
+
+def stack_coefficients(layers: list, reference_layer: int):
+    """
+    Computes the per-area coefficients of a stacked-2D thermal model, in which every layer is a 2D
+    temperature field on the layout mesh, coupled to its neighbours by a vertical conductance.
+
+    All coefficients are divided by the thickness of the reference layer, so a stack containing only
+    that layer reduces to the single-layer 2D model (rho*cp dT/dt = k lap(T) + Q).
+
+    Args:
+        layers (list): Layer dictionaries from parseLayers.get_all_layers, top of the stack first.
+        reference_layer (int): Layer number whose thickness the coefficients are normalised by.
+
+    Returns:
+        heat_capacity (np.ndarray): rho*cp*t of every layer.
+        conductance (np.ndarray): Lateral k*t of every layer.
+        interlayer (np.ndarray): Vertical conductance between each pair of neighbouring layers,
+                                 1 / (t_i / 2k_i + t_j / 2k_j), from the centre of one layer to the centre of the next.
+    """
+    thickness = np.array([float(layer['Thickness']) for layer in layers])  # μm
+    k = np.array([float(layer['ThermalConductivity']) for layer in layers])
+    rho_cp = np.array([float(layer['Density']) * float(layer['SpecificHeatCapacity']) for layer in layers])
+
+    numbers = [layer_number(layer) for layer in layers]
+    if reference_layer not in numbers:
+        raise ValueError(f"Layer number {reference_layer} is not in the layer definition file")
+    t_ref = thickness[numbers.index(reference_layer)]
+
+    heat_capacity = rho_cp * thickness / t_ref
+    conductance = k * thickness / t_ref
+    interlayer = 1.0 / (thickness[:-1] / (2 * k[:-1]) + thickness[1:] / (2 * k[1:])) / t_ref
+    return heat_capacity, conductance, interlayer
+
+
+def build_stack_forms(domain, layers: list, resistor_layer: int, substrate_layer: int, Q, delta: float, h_cooling: float, T_ambient: float, steady: bool = False):
+    """
+    Builds the forms of the stacked-2D model on a blocked P1 space with one temperature component per
+    layer. The resistor heat source Q enters the resistor layer, and the cooling boundary acts on the
+    substrate layer, as in the single-layer model.
+
+    Args:
+        domain (Mesh): The finite element mesh.
+        layers (list): Layer dictionaries from parseLayers.get_all_layers, top of the stack first.
+        resistor_layer (int): Layer number of the resistive layer.
+        substrate_layer (int): Layer number of the substrate layer.
+        Q (Function): Heat source of the resistors.
+        delta (float): Time step size.
+        h_cooling (float): Heat transfer coefficient of the cooling boundary.
+        T_ambient (float): Ambient temperature.
+        steady (bool): Build the stationary problem instead of the backward Euler step.
+
+    Returns:
+        V (FunctionSpace): Blocked function space with one component per layer.
+        T_n (Function): Temperature of every layer at the previous time step.
+        a (ufl.Form): Bilinear form.
+        L (ufl.Form): Linear form.
+        inverse_dt (Constant): The 1/dt constant of the forms.
+    """
+    numbers = [layer_number(layer) for layer in layers]
+    for number in (resistor_layer, substrate_layer):
+        if number not in numbers:
+            raise ValueError(f"Layer number {number} is not in the layer definition file")
+    resistor_index = numbers.index(resistor_layer)
+    substrate_index = numbers.index(substrate_layer)
+
+    heat_capacity, conductance, interlayer = stack_coefficients(layers, substrate_layer)
+
+    V = fem.VectorFunctionSpace(domain, ("CG", 1), dim=len(layers))
+    T_n = Function(V)
+    u = ufl.TrialFunction(V)
+    v = ufl.TestFunction(V)
+
+    scalar = lambda value: Constant(domain, PETSc.ScalarType(value))
+    inverse_dt = scalar(1.0 / delta)
+    cooling = scalar(h_cooling)
+    ambient = scalar(T_ambient)
+
+    # ------------- Lateral conduction and heat capacity of every layer ------------- #
+    a = 0
+    L = 0
+    for i in range(len(layers)):
+        a += scalar(conductance[i]) * ufl.dot(ufl.grad(u[i]), ufl.grad(v[i])) * ufl.dx
+        if not steady:
+            a += scalar(heat_capacity[i]) * inverse_dt * u[i] * v[i] * ufl.dx
+            L += scalar(heat_capacity[i]) * inverse_dt * T_n[i] * v[i] * ufl.dx
+
+    # ---------------- Vertical conduction between neighbouring layers ---------------- #
+    for i in range(len(layers) - 1):
+        a += scalar(interlayer[i]) * (u[i] - u[i + 1]) * (v[i] - v[i + 1]) * ufl.dx
+
+    # -------------- Heat source and cooling, as in the single-layer model ------------- #
+    L += Q * v[resistor_index] * ufl.dx
+    if steady:
+        a += cooling * u[substrate_index] * v[substrate_index] * ufl.ds
+        L += cooling * ambient * v[substrate_index] * ufl.ds
+    else:
+        L += -cooling * (T_n[substrate_index] - ambient) * v[substrate_index] * ufl.ds
+
+    return V, T_n, a, L, inverse_dt
+
+
+def field_names(layers: list):
+    """Output names of the layer temperatures, e.g. "temperature_1_Molybdenum"."""
+    return [f"temperature_{layer_number(layer)}_{layer['Material'].replace(' ', '_')}" for layer in layers]
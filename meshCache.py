@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import click
+import numpy as np
+from mpi4py import MPI
+from resistorTable import ResistorTable
+
+# Bump when the meshing procedure changes so that stale meshes are not reused
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "firebird", "meshes")
+DEFAULT_MAX_SIZE_MB = 2048
+
+MESH_FILE = "mesh.xdmf"
+META_FILE = "meta.json"
+
+
+def mesh_key(substrate_length: float, substrate_width: float, resistor_data: ResistorTable, s_sense: float):
+    """
+    Returns the content hash identifying a mesh. Only the inputs of the meshing stage are hashed: the
+    substrate dimensions, s_sense and the number, position, size and mesh size (lcr) of every resistor.
+    Time stepping, ambient temperature, power and material properties do not change the mesh.
+    """
+    from generateOutputFiles import resistor_mesh_size
+
+    # One row per resistor, in ascending resistor number
+    geometry = np.column_stack((resistor_data.numbers, resistor_data.centers, resistor_data.length, resistor_data.width,
+                                resistor_mesh_size(resistor_data))).astype(np.float64)
+
+    digest = hashlib.sha256()
+    digest.update(f"firebird-mesh-v{CACHE_VERSION}".encode())
+    digest.update(np.array([substrate_length, substrate_width, s_sense], dtype=np.float64).tobytes())
+    digest.update(geometry.tobytes())
+    return digest.hexdigest()
+
+
+def cache_entries(cache_dir: str):
+    """
+    Lists the complete entries of the mesh cache, least recently used first.
+
+    Returns:
+        list: One dictionary per entry with its key, size in bytes, last use time and stored metadata.
+    """
+    entries = []
+    if not os.path.isdir(cache_dir):
+        return entries
+
+    for key in os.listdir(cache_dir):
+        entry_dir = os.path.join(cache_dir, key)
+        meta_path = os.path.join(entry_dir, META_FILE)
+        if not os.path.isfile(meta_path):
+            continue  # incomplete entry or unrelated file
+
+        size = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(entry_dir) for name in names)
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        entries.append({'key': key, 'size': size, 'last_used': os.path.getmtime(meta_path), 'meta': meta})
+
+    return sorted(entries, key=lambda entry: entry['last_used'])
+
+
+def evict(cache_dir: str, max_size_mb: float, keep: str = None):
+    """Removes least recently used entries until the cache fits in max_size_mb. The entry 'keep' is never removed."""
+    entries = cache_entries(cache_dir)
+    total = sum(entry['size'] for entry in entries)
+    for entry in entries:
+        if total <= max_size_mb * 1024 ** 2:
+            break
+        if entry['key'] == keep:
+            continue
+        shutil.rmtree(os.path.join(cache_dir, entry['key']), ignore_errors=True)
+        total -= entry['size']
+
+
+def load_mesh(cache_dir: str, key: str, comm=MPI.COMM_WORLD):
+    """
+    Loads a cached mesh, partitioned over comm, and marks it as recently used.
+
+    Returns:
+        tuple: (domain, cell_tags, facet_tags), or None when the key is not in the cache.
+    """
+    from dolfinx.io import XDMFFile
+
+    entry_dir = os.path.join(cache_dir, key)
+    hit = comm.bcast(os.path.isfile(os.path.join(entry_dir, META_FILE)) if comm.rank == 0 else None, root=0)
+    if not hit:
+        return None
+
+    with XDMFFile(comm, os.path.join(entry_dir, MESH_FILE), "r") as xdmf:
+        domain = xdmf.read_mesh(name="mesh")
+        cell_tags = xdmf.read_meshtags(domain, name="cell_tags")
+        domain.topology.create_connectivity(domain.topology.dim - 1, domain.topology.dim)
+        facet_tags = xdmf.read_meshtags(domain, name="facet_tags")
+
+    if comm.rank == 0:
+        os.utime(os.path.join(entry_dir, META_FILE))
+
+    return domain, cell_tags, facet_tags
+
+
+def store_mesh(cache_dir: str, key: str, mesh_data: tuple, metadata: dict, max_size_mb: float = DEFAULT_MAX_SIZE_MB, comm=MPI.COMM_WORLD):
+    """
+    Stores a mesh and its cell and facet tags as XDMF/HDF5 under key, then evicts least recently used
+    entries until the cache fits in max_size_mb. The entry only becomes visible once it is complete.
+    """
+    from dolfinx.io import XDMFFile
+
+    domain, cell_tags, facet_tags = mesh_data
+    entry_dir = os.path.join(cache_dir, key)
+    partial_dir = f"{entry_dir}.partial"
+
+    if comm.rank == 0:
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        os.makedirs(partial_dir)
+    comm.barrier()
+
+    domain.name = "mesh"
+    cell_tags.name = "cell_tags"
+    facet_tags.name = "facet_tags"
+    domain.topology.create_connectivity(domain.topology.dim - 1, domain.topology.dim)
+    with XDMFFile(comm, os.path.join(partial_dir, MESH_FILE), "w") as xdmf:
+        xdmf.write_mesh(domain)
+        xdmf.write_meshtags(cell_tags, domain.geometry)
+        xdmf.write_meshtags(facet_tags, domain.geometry)
+    comm.barrier()
+
+    if comm.rank == 0:
+        metadata = dict(metadata, num_cells=domain.topology.index_map(domain.topology.dim).size_global,
+                        created=time.strftime("%Y-%m-%d %H:%M:%S"))
+        with open(os.path.join(partial_dir, META_FILE), 'w') as f:
+            json.dump(metadata, f, indent=2)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.rename(partial_dir, entry_dir)
+        evict(cache_dir, max_size_mb, keep=key)
+    comm.barrier()
+
+
+def cached_mesh(cache_dir: str, max_size_mb: float, substrate_length: float, substrate_width: float, resistor_data: ResistorTable, s_sense: float, generate, comm=MPI.COMM_WORLD):
+    """
+    Returns the mesh of the layout from the cache, or generates and caches it on a miss.
+
+    Args:
+        cache_dir (str): Directory of the mesh cache.
+        max_size_mb (float): Size limit of the cache in megabytes.
+        substrate_length (float): The length of the substrate layer.
+        substrate_width (float): The width of the substrate layer.
+        resistor_data (ResistorTable): The resistors, as returned by extractGeometry.read_gdsii.
+        s_sense (float): The sensitivity value of the mesh generation for the substrate layer.
+        generate (callable): Generates the (domain, cell_tags, facet_tags) tuple on a cache miss.
+
+    Returns:
+        tuple: (domain, cell_tags, facet_tags)
+    """
+    key = mesh_key(substrate_length, substrate_width, resistor_data, s_sense)
+
+    mesh_data = load_mesh(cache_dir, key, comm)
+    if mesh_data is not None:
+        print(f"\033[93mMesh cache hit:\033[0m \033[95m{key[:16]}\033[0m")
+        return mesh_data
+
+    print(f"\033[93mMesh cache miss:\033[0m \033[95m{key[:16]}\033[0m")
+    mesh_data = generate()
+    metadata = {'substrate_length': float(substrate_length), 'substrate_width': float(substrate_width),
+                's_sense': float(s_sense), 'num_resistors': len(resistor_data)}
+    store_mesh(cache_dir, key, mesh_data, metadata, max_size_mb, comm)
+    return mesh_data
+
+
+def cache_directory(mesh_cache: str):
+    """Returns the cache directory selected by the mesh_cache option, or None when caching is disabled."""
+    if mesh_cache == "none":
+        return None
+    return DEFAULT_CACHE_DIR if mesh_cache == "default" else mesh_cache
+
+
+def mesh_layout(options: dict, substrate_length: float, substrate_width: float, resistor_data: ResistorTable, s_sense: float, comm=MPI.COMM_WORLD):
+    """
+    Meshes the layout in memory with the GMSH API, through the mesh cache unless mesh_cache=none.
+
+    Args:
+        options (dict): Optional settings from parseParams.parse_options.
+        substrate_length (float): The length of the substrate layer.
+        substrate_width (float): The width of the substrate layer.
+        resistor_data (ResistorTable): The resistors, as returned by extractGeometry.read_gdsii.
+        s_sense (float): The sensitivity value of the mesh generation for the substrate layer.
+
+    Returns:
+        tuple: (domain, cell_tags, facet_tags)
+    """
+    from generateOutputFiles import generate_mesh
+
+    generate = lambda: generate_mesh(substrate_length, substrate_width, resistor_data, s_sense, options['mesh_threads'], comm=comm)
+    cache_dir = cache_directory(options['mesh_cache'])
+    if cache_dir is None:
+        return generate()
+    # Reuse the mesh of an identical layout geometry and mesh sizing if it has been meshed before
+    return cached_mesh(cache_dir, options['mesh_cache_mb'], substrate_length, substrate_width, resistor_data, s_sense, generate, comm)
+
+
+# ---------------------------------------------------------------------------- #
+#                    Command line: inspect or clear the cache                   #
+# ---------------------------------------------------------------------------- #
+@click.group()
+def cli():
+    """Inspect or clear the Firebird mesh cache."""
+
+
+@cli.command()
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, show_default=True, help="Directory of the mesh cache.")
+def info(cache_dir):
+    """List the cached meshes, least recently used first."""
+    entries = cache_entries(cache_dir)
+    total = sum(entry['size'] for entry in entries)
+    print(f"Mesh cache: \033[95m{cache_dir}\033[0m ({len(entries)} entries, {total / 1024 ** 2:.1f} MB)\n")
+    for entry in entries:
+        meta = entry['meta']
+        last_used = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry['last_used']))
+        print(f"{entry['key'][:16]}  {entry['size'] / 1024 ** 2:8.1f} MB  last used {last_used}  "
+              f"{meta.get('num_resistors', '?')} resistors, {meta.get('num_cells', '?')} cells, "
+              f"substrate {meta.get('substrate_length', '?')} x {meta.get('substrate_width', '?')} μm, s_sense {meta.get('s_sense', '?')}")
+
+
+@cli.command()
+@click.option('--cache-dir', default=DEFAULT_CACHE_DIR, show_default=True, help="Directory of the mesh cache.")
+@click.argument('keys', nargs=-1)
+def clear(cache_dir, keys):
+    """Remove the given entries (by key prefix), or the whole cache when no key is given."""
+    for entry in cache_entries(cache_dir):
+        if not keys or any(entry['key'].startswith(prefix) for prefix in keys):
+            shutil.rmtree(os.path.join(cache_dir, entry['key']), ignore_errors=True)
+            print(f"Removed {entry['key'][:16]}")
+
+
+if __name__ == '__main__':
+    cli()
@@ -9,21 +9,60 @@ def get_layer_properties(xml_file, layer_num : int):
             num = layer.find('LayerNumber')
 
             if num is not None and num.text == str(layer_num):
-                material = layer.find('Material').text
-                thickness = layer.find('Thickness').text
-                thermal_conductivity = layer.find('ThermalConductivity').text
-                specific_heat = layer.find('SpecificHeatCapacity').text
-                density = layer.find('Density').text
-
-                # Returns a dictionary containing all the relevant material properties
-                return {
-                    'LayerNumber': num,
-                    'Material': material,
-                    'Thickness': thickness,
-                    'ThermalConductivity': thermal_conductivity,
-                    'SpecificHeatCapacity': specific_heat,
-                    'Density': density
-                }
+                return read_layer(layer)
         return f"Layer number {layer_num} not found in the XML file."
-    except ET.ParseError as e:
+    except (ET.ParseError, ValueError) as e:
+        return f"Error parsing XML: {e}"
+
+
+def read_layer(layer):
+    num = layer.find('LayerNumber')
+    material = layer.find('Material').text
+    thickness = layer.find('Thickness').text
+    thermal_conductivity = layer.find('ThermalConductivity').text
+    specific_heat = layer.find('SpecificHeatCapacity').text
+    density = layer.find('Density').text
+
+    # Optional temperature-dependent curves, which take precedence over the constant values
+    conductivity_table = layer.find('ThermalConductivityTable')
+    specific_heat_table = layer.find('SpecificHeatCapacityTable')
+
+    # Returns a dictionary containing all the relevant material properties
+    return {
+        'LayerNumber': num,
+        'Material': material,
+        'Thickness': thickness,
+        'ThermalConductivity': thermal_conductivity,
+        'SpecificHeatCapacity': specific_heat,
+        'Density': density,
+        'ThermalConductivityTable': parse_table(conductivity_table.text) if conductivity_table is not None else None,
+        'SpecificHeatCapacityTable': parse_table(specific_heat_table.text) if specific_heat_table is not None else None
+    }
+
+
+def parse_table(text):
+    """
+    Parses a tabulated property curve written as "T1:value1, T2:value2, ..." (temperatures in Kelvin, in
+    increasing order) and returns the lists of temperatures and values.
+    """
+    temperatures = []
+    values = []
+    for entry in text.replace('\n', ',').split(','):
+        if entry.strip():
+            temperature, value = entry.split(':')
+            temperatures.append(float(temperature))
+            values.append(float(value))
+
+    if len(temperatures) == 0 or any(t_1 >= t_2 for t_1, t_2 in zip(temperatures, temperatures[1:])):
+        raise ValueError(f"Property table must list at least one point with increasing temperatures: {text.strip()}")
+    return temperatures, values
+
+
+def get_all_layers(xml_file):
+    """Returns the properties of every layer in the XML file, in the order they are listed (top of the stack first)."""
+    try:
+        tree = ET.parse(xml_file)
+        root = tree.getroot()
+        return [read_layer(layer) for layer in root.findall('layer')]
+    except (ET.ParseError, ValueError) as e:
         return f"Error parsing XML: {e}"
\ No newline at end of file
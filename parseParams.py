@@ -1,4 +1,5 @@
 import re
+import numpy as np
 
 def parse_file(file_name):
     '''
@@ -8,13 +9,14 @@ def parse_file(file_name):
     with open(file_name, 'r') as file:
         text = file.read()
 
-    # Use regular expressions to extract the values of parameters
-    delta_match = re.search(r'delta=([0-9\.]+)', text)
-    substrate_match = re.search(r'substrate=([0-9\.]+)',text)
-    resist_match = re.search(r'resist=([0-9\.]+)',text)
-    iterations_match = re.search(r'iterations=([0-9\.]+)',text)
-    ambient_temp_match = re.search(r'ambient=([0-9\.]+)',text)
-    substrate_sensitivity_match = re.search(r's_sense=([0-9\.]+)',text)
+    # Use regular expressions to extract the values of parameters, each from the start of its own line so that
+    # optional settings ending in the same name (amr_max_iterations=) are not mistaken for them
+    delta_match = re.search(r'^\s*delta=([0-9\.]+)', text, re.MULTILINE)
+    substrate_match = re.search(r'^\s*substrate=([0-9\.]+)', text, re.MULTILINE)
+    resist_match = re.search(r'^\s*resist=([0-9\.]+)', text, re.MULTILINE)
+    iterations_match = re.search(r'^\s*iterations=([0-9\.]+)', text, re.MULTILINE)
+    ambient_temp_match = re.search(r'^\s*ambient=([0-9\.]+)', text, re.MULTILINE)
+    substrate_sensitivity_match = re.search(r'^\s*s_sense=([0-9\.]+)', text, re.MULTILINE)
 
     # ---------------- Check if all parameters have been obtained ---------------- #
     if delta_match and substrate_match and resist_match and iterations_match and ambient_temp_match and substrate_sensitivity_match:
@@ -43,3 +45,89 @@ def parse_file(file_name):
     
     else:
         raise ValueError("Could not parse parameters from file")
+
+
+# ---------------------------------------------------------------------------- #
+#     Optional parameters: name -> (default value, type, allowed values)       #
+# ---------------------------------------------------------------------------- #
+OPTIONAL_PARAMETERS = {
+    'source': ('nodal', str, ('nodal', 'dg0')), # heat source representation
+    'output': ('xdmf', str, ('xdmf', 'vtk', 'none')), # full-field output format, 'none' to only write probes
+    'output_every': (10, int, None), # time steps between full-field outputs, 0 to disable
+    'output_queue': (4, int, None), # pending output steps for the background writer, 0 to write synchronously
+    'mesher': ('gmsh', str, ('gmsh', 'geo', 'adaptive')), # in-process GMSH meshing, writing a .geo file to open in GMSH, or GMSH followed by adaptive refinement
+    'mesh_threads': (0, int, None), # GMSH meshing threads, 0 lets GMSH decide
+    'mesh_cache': ('default', str, None), # mesh cache directory, 'default' for the user cache, 'none' to disable
+    'mesh_cache_mb': (2048.0, float, None), # size limit of the mesh cache in megabytes
+    'mode': ('transient', str, ('transient', 'steady')), # time stepping, or a single steady-state solve
+    'stop_tol': (0.0, float, None), # stop once the step-to-step temperature change (K) is below this, 0 to disable
+    'adaptive': (0, int, (0, 1)), # 1 for error-controlled time steps up to iterations * delta
+    'error_tol': (0.01, float, None), # allowed local error per adaptive time step (K)
+    'dt_max': (0.0, float, None), # largest adaptive time step, 0 for no limit
+    'output_dt': (0.0, float, None), # simulated time between adaptive outputs, 0 for output_every * delta
+    'solver': ('lu', str, ('lu', 'gamg', 'hypre', 'fieldsplit')), # direct LU, conjugate gradients with algebraic multigrid, or per-layer block preconditioning
+    'layers': ('single', str, ('single', 'stack')), # substrate only, or every layer of the XML file as a stacked-2D model
+    'solver_rtol': (1e-8, float, None), # relative residual tolerance of the iterative solvers
+    'gds_hierarchy': (0, int, (0, 1)), # 1 to extract per unique cell through the reference tree instead of flattening
+    'resistor_table': ('none', str, None), # .npz file keeping the extracted resistors for reuse while the GDS file is unchanged, 'none' to always extract
+    'prop_tol': (0.05, float, None),    # relative change of k(T)/cp(T) that triggers a refactorisation
+    'picard_max': (20, int, None),      # largest number of Picard iterations per time step with k(T)/cp(T) tables
+    'h_cooling': (1000.0, float, None), # heat transfer coefficient of the cooling boundary
+    'profile_file': ('none', str, None), # CSV file of resistor power profiles (time, power_<n> columns), 'none' for constant powers
+    'profile_interp': ('step', str, ('step', 'linear')), # hold each profile power until the next point, or interpolate linearly
+    'profile_period': (0.0, float, None), # repeat the power profiles with this period (s), 0 to hold the last powers
+    'probe_output': ('none', str, ('none', 'csv', 'parquet')), # per-resistor max/mean/integral and point probe time series
+    'probe_every': (1, int, None),      # time steps between probe rows
+    'probe_points': ('none', str, None), # point probes as x:y;x:y (μm), 'none' for resistor probes only
+    'amr_tol': (0.01, float, None),     # change of the resistor peak temperatures (K) at which mesher=adaptive stops refining
+    'amr_theta': (0.5, float, None),    # fraction of the error estimate carried by the refined cells (Dorfler marking)
+    'amr_max_iterations': (8, int, None), # largest number of refinement iterations
+    'amr_max_dofs': (2000000, int, None), # stop refining once the mesh has this many dofs
+    'jit_cache': ('default', str, None), # directory of the compiled forms, 'default' for the dolfinx cache (~/.cache/fenics)
+}
+
+
+def parse_options(file_name):
+    '''
+    Takes in a path to the parameter file and extracts the optional simulation settings. Settings that are
+    not present in the file fall back to their defaults in OPTIONAL_PARAMETERS.
+    '''
+    with open(file_name, 'r') as file:
+        text = file.read()
+
+    options = {}
+    for name, (default, value_type, allowed) in OPTIONAL_PARAMETERS.items():
+        match = re.search(rf'^\s*{name}=(\S+)', text, re.MULTILINE)
+        if not match:
+            options[name] = default
+            continue
+
+        try:
+            value = value_type(match.group(1))
+        except ValueError:
+            print(f"\nError: Could not read a {value_type.__name__} value for '{name}'. Check parameter file.\n")
+            raise
+        if allowed is not None and value not in allowed:
+            print(f"\nError: '{name}' must be one of {', '.join(map(str, allowed))}. Check parameter file.\n")
+            raise ValueError()
+        options[name] = value
+
+    return options
+
+
+def parse_points(text: str):
+    '''Parses point probe coordinates written as "x1:y1;x2:y2;..." (μm), 'none' for no points.'''
+    if text == "none":
+        return np.zeros((0, 2))
+
+    points = []
+    for point in text.split(';'):
+        if not point.strip():
+            continue
+        try:
+            x, y = (float(value) for value in point.split(':'))
+        except ValueError:
+            print(f"\nError: Point probe '{point}' must be written as x:y. Check parameter file.\n")
+            raise
+        points.append([x, y])
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
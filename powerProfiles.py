@@ -0,0 +1,139 @@
+import re
+import csv
+import numpy as np
+from resistorTable import ResistorTable
+
+# Per-resistor profiles in the parameter file, e.g. "profile_3=0:0,1e-3:5,2e-3:0" (time in s : power)
+PROFILE_PATTERN = re.compile(r'^\s*profile_(\d+)=(\S+)', re.MULTILINE)
+# Column prefix of the resistor powers in a profile CSV file
+POWER_PREFIX = "power_"
+INTERPOLATIONS = ("step", "linear")
+
+
+def parse_profile(text: str):
+    '''
+    Parses a power profile written as "t1:p1,t2:p2,..." with increasing times and returns the arrays of
+    times and powers.
+    '''
+    times = []
+    powers = []
+    for entry in text.split(','):
+        if entry.strip():
+            time, power = entry.split(':')
+            times.append(float(time))
+            powers.append(float(power))
+
+    if len(times) == 0 or any(t_1 >= t_2 for t_1, t_2 in zip(times, times[1:])):
+        raise ValueError(f"Power profile must list at least one point with increasing times: {text}")
+    return np.array(times), np.array(powers)
+
+
+def read_params_profiles(file_name: str):
+    '''Returns the profiles of the parameter file as a dictionary from resistor number to (times, powers).'''
+    with open(file_name, 'r') as file:
+        text = file.read()
+    return {int(number): parse_profile(profile) for number, profile in PROFILE_PATTERN.findall(text)}
+
+
+def read_profile_file(file_name: str):
+    '''
+    Reads a CSV file with a "time" column and one power_<n> column per profiled resistor n, and returns
+    the profiles as a dictionary from resistor number to (times, powers).
+    '''
+    with open(file_name, 'r', newline='') as f:
+        reader = csv.reader(f)
+        header = [column.strip() for column in next(reader)]
+        rows = np.array([[float(value) for value in row] for row in reader if row], dtype=np.float64).reshape(-1, len(header))
+
+    if "time" not in header:
+        raise ValueError(f"Power profile file {file_name} has no 'time' column")
+    times = rows[:, header.index("time")]
+    if len(times) == 0 or np.any(np.diff(times) <= 0):
+        raise ValueError(f"Power profile file {file_name} must list at least one row with increasing times")
+
+    profiles = {}
+    for i, column in enumerate(header):
+        if column == "time":
+            continue
+        if not column.startswith(POWER_PREFIX):
+            raise ValueError(f"Unknown column '{column}' in power profile file {file_name}")
+        profiles[int(column[len(POWER_PREFIX):])] = (times, rows[:, i])
+    return profiles
+
+
+class PowerProfiles:
+    '''
+    Power of every resistor as a function of time. Resistors without a profile keep their constant
+    power. All profiles are resampled once onto the union of their breakpoints, so evaluating the
+    powers at a time is a single search and at most one blend of two table rows, whatever the number
+    of profiles.
+
+    Args:
+        numbers (np.ndarray): Resistor numbers, in the order of the returned power vectors.
+        base_power (np.ndarray): Constant power of every resistor.
+        profiles (dict): Resistor number to (times, powers) of the profiled resistors.
+        interpolation (str): "step" holds each power until the next breakpoint, "linear" interpolates between them.
+        period (float): Repeat the profiles with this period, 0 to hold the last powers.
+    '''
+
+    def __init__(self, numbers: np.ndarray, base_power: np.ndarray, profiles: dict, interpolation: str = "step", period: float = 0.0):
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError(f"Unknown profile interpolation '{interpolation}', expected one of {INTERPOLATIONS}")
+        unknown = sorted(set(profiles) - set(int(number) for number in numbers))
+        if unknown:
+            raise ValueError(f"Power profiles given for resistors that are not in the layout: {unknown}")
+
+        self.numbers = np.asarray(numbers)
+        self.base_power = np.asarray(base_power, dtype=np.float64)
+        self.interpolation = interpolation
+        self.period = period
+
+        profiled = sorted(profiles)
+        self.columns = np.searchsorted(self.numbers, profiled)
+        self.grid = np.unique(np.concatenate([profiles[number][0] for number in profiled])) if profiled else np.zeros(1)
+        self.table = np.empty((len(self.grid), len(profiled)))
+        for i, number in enumerate(profiled):
+            self.table[:, i] = self._interpolate(*profiles[number], self.grid)
+
+    def _interpolate(self, times: np.ndarray, powers: np.ndarray, t):
+        if self.interpolation == "linear":
+            return np.interp(t, times, powers)
+        return powers[np.clip(np.searchsorted(times, t, side='right') - 1, 0, len(times) - 1)]
+
+    def power(self, t: float):
+        '''Returns the power of every resistor at time t.'''
+        power = self.base_power.copy()
+        if len(self.columns) == 0:
+            return power
+        if self.period > 0:
+            t = t % self.period
+
+        i = int(np.searchsorted(self.grid, t, side='right')) - 1
+        if self.interpolation == "step" or len(self.grid) == 1:
+            power[self.columns] = self.table[max(i, 0)]
+        else:
+            i = min(max(i, 0), len(self.grid) - 2)
+            weight = min(max((t - self.grid[i]) / (self.grid[i + 1] - self.grid[i]), 0.0), 1.0)
+            power[self.columns] = (1 - weight) * self.table[i] + weight * self.table[i + 1]
+        return power
+
+    def sample(self, times: np.ndarray):
+        '''Returns the powers at every time in times, (len(times), num_resistors).'''
+        return np.array([self.power(t) for t in times])
+
+
+def load_profiles(params_file: str, options: dict, resistor_data: ResistorTable):
+    '''
+    Builds the power profiles from the profile_file option and the profile_<n> entries of the
+    parameter file (which take precedence). Returns None when no resistor has a profile.
+    '''
+    return profiles_from_params(params_file, options, np.array(resistor_data.numbers), np.array(resistor_data.power))
+
+
+def profiles_from_params(params_file: str, options: dict, numbers: np.ndarray, base_power: np.ndarray):
+    '''As load_profiles, for resistors given by their numbers and constant powers.'''
+    profiles = {} if options['profile_file'] == "none" else read_profile_file(options['profile_file'])
+    profiles.update(read_params_profiles(params_file))
+    if not profiles:
+        return None
+    return PowerProfiles(numbers, base_power, profiles, options['profile_interp'], options['profile_period'])
@@ -0,0 +1,268 @@
+import csv
+import numpy as np
+from mpi4py import MPI
+from parseParams import parse_points  # kept importable from probes, where it used to live
+from resistorTable import ResistorTable
+
+# Time series formats of the probe output, selectable with probe_output= in the parameter file
+PROBE_FORMATS = ("none", "csv", "parquet")
+# Rows buffered before a row group is written to a Parquet file
+PARQUET_ROW_GROUP = 1000
+
+
+def resistor_numbers(resistor_data: ResistorTable):
+    """Returns the resistor numbers in ascending order, the order in which per-resistor results are reported."""
+    return np.array(resistor_data.numbers, dtype=np.int64)
+
+
+def resistor_dofs(V, cell_tags, numbers: np.ndarray):
+    """Returns the owned dofs of V on the cells of every resistor in numbers (resistor cells are tagged with resistor_number + 1)."""
+    num_owned = V.dofmap.index_map.size_local
+    dofs = []
+    for number in numbers:
+        resistor = np.unique(V.dofmap.list[cell_tags.find(number + 1)])
+        dofs.append(resistor[resistor < num_owned])
+    return dofs
+
+
+class ResistorProbes:
+    """
+    Peak, mean and integral temperature of every resistor, from dof sets and quadrature weights that
+    are computed once from cell_tags.
+
+    The integral of a P1 temperature over a triangle is its area times the mean of its vertex values,
+    so the integral over a resistor is sum_d w_d T_d, with w_d a third of the area of the resistor's
+    cells around dof d. The weights are lumped per (resistor, dof) pair, and every evaluation is one
+    gather of T and a few vectorised reductions. Only owned cells contribute, so the results are the
+    same for any number of ranks.
+
+    Args:
+        V (FunctionSpace): Scalar P1 function space of the temperature.
+        cell_tags (MeshTags): MeshTags object containing the tagged cells.
+        numbers (np.ndarray): Resistor numbers, in the order of the results.
+    """
+
+    def __init__(self, V, cell_tags, numbers: np.ndarray):
+        domain = V.mesh
+        self.comm = domain.comm
+        self.numbers = np.asarray(numbers)
+
+        # --------------- Owned resistor cells and the column of their resistor --------------- #
+        num_owned_cells = domain.topology.index_map(domain.topology.dim).size_local
+        selected = (cell_tags.indices < num_owned_cells) & np.isin(cell_tags.values, self.numbers + 1)
+        cells = cell_tags.indices[selected]
+        cell_columns = np.searchsorted(self.numbers, cell_tags.values[selected] - 1)
+
+        # ------------------------------ Triangle areas ------------------------------ #
+        x = domain.geometry.x[domain.geometry.dofmap[cells]]
+        area = 0.5 * np.abs((x[:, 1, 0] - x[:, 0, 0]) * (x[:, 2, 1] - x[:, 0, 1]) - (x[:, 2, 0] - x[:, 0, 0]) * (x[:, 1, 1] - x[:, 0, 1]))
+
+        # -------------- Lumped weight of every (resistor, dof) pair, grouped by resistor -------------- #
+        cell_dofs = V.dofmap.list[cells]
+        dofs_per_cell = cell_dofs.shape[1]
+        pairs, inverse = np.unique(np.stack([np.repeat(cell_columns, dofs_per_cell), cell_dofs.ravel()], axis=1), axis=0, return_inverse=True)
+        self.columns = pairs[:, 0]
+        self.dofs = pairs[:, 1]
+        self.weights = np.bincount(inverse.ravel(), weights=np.repeat(area / dofs_per_cell, dofs_per_cell), minlength=len(pairs))
+
+        counts = np.bincount(self.columns, minlength=len(self.numbers))
+        self.non_empty = counts > 0
+        self.starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[self.non_empty]
+
+        local_area = np.bincount(self.columns, weights=self.weights, minlength=len(self.numbers))
+        self.area = np.empty_like(local_area)
+        self.comm.Allreduce(local_area, self.area, op=MPI.SUM)
+
+    def evaluate(self, T):
+        """
+        Returns the peak, area-weighted mean and integral (K·μm²) of T over every resistor, on every rank.
+        T must have up-to-date ghost values.
+        """
+        values = T.x.array[self.dofs]
+
+        local_peak = np.full(len(self.numbers), -np.inf)
+        if len(values) > 0:
+            local_peak[self.non_empty] = np.maximum.reduceat(values, self.starts)
+        local_integral = np.bincount(self.columns, weights=values * self.weights, minlength=len(self.numbers))
+
+        peak = np.empty_like(local_peak)
+        integral = np.empty_like(local_integral)
+        self.comm.Allreduce(local_peak, peak, op=MPI.MAX)
+        self.comm.Allreduce(local_integral, integral, op=MPI.SUM)
+
+        # Resistors without cells in the mesh have no temperature
+        peak[self.area == 0] = np.nan
+        mean = np.divide(integral, self.area, out=np.full_like(integral, np.nan), where=self.area > 0)
+        return peak, mean, integral
+
+
+class PointProbes:
+    """
+    Temperature at arbitrary points of the layout. The cell containing every point is found once; each
+    point is evaluated by the lowest rank that holds its cell, and points outside the mesh give NaN.
+
+    Args:
+        V (FunctionSpace): Function space of the temperature.
+        points (np.ndarray): Point coordinates (x, y) in μm, (num_points, 2).
+    """
+
+    def __init__(self, V, points: np.ndarray):
+        from dolfinx import geometry
+
+        domain = V.mesh
+        self.comm = domain.comm
+        self.num_points = len(points)
+        points_3d = np.zeros((self.num_points, 3))
+        points_3d[:, :2] = points
+
+        tree = geometry.bb_tree(domain, domain.topology.dim)
+        colliding = geometry.compute_colliding_cells(domain, geometry.compute_collisions_points(tree, points_3d), points_3d)
+        found = np.array([len(colliding.links(i)) > 0 for i in range(self.num_points)], dtype=bool)
+
+        # The lowest rank that found a point evaluates it
+        rank_of_point = np.where(found, self.comm.rank, self.comm.size)
+        owner = np.empty_like(rank_of_point)
+        self.comm.Allreduce(rank_of_point, owner, op=MPI.MIN)
+
+        self.local = np.flatnonzero(owner == self.comm.rank)
+        self.points = points_3d[self.local]
+        self.cells = np.array([colliding.links(i)[0] for i in self.local], dtype=np.int32)
+        self.missing = owner == self.comm.size
+
+    def evaluate(self, T):
+        """Returns the temperature at every point, on every rank."""
+        local_values = np.zeros(self.num_points)
+        if len(self.local) > 0:
+            local_values[self.local] = T.eval(self.points, self.cells)[:, 0]
+        values = np.empty_like(local_values)
+        self.comm.Allreduce(local_values, values, op=MPI.SUM)
+        values[self.missing] = np.nan
+        return values
+
+
+class ProbeWriter:
+    """
+    Streams probe rows to a CSV or Parquet time series on rank 0. Parquet needs pyarrow and falls back
+    to CSV without it.
+
+    Args:
+        basename (str): Output file name without extension.
+        columns (list): Names of the value columns, after "time" and "step".
+        output_format (str): "csv" or "parquet".
+        comm (MPI.Comm): Communicator; only rank 0 writes.
+    """
+
+    def __init__(self, basename: str, columns: list, output_format: str = "csv", comm=MPI.COMM_WORLD):
+        self.columns = ["time", "step"] + list(columns)
+        self.is_writer = comm.rank == 0
+        self.rows = []
+        self.parquet = None
+        self.file = None
+
+        if output_format == "parquet":
+            try:
+                import pyarrow
+                import pyarrow.parquet
+            except ImportError:
+                print("\033[103mprobe_output=parquet needs pyarrow, writing CSV instead\033[0m")
+                output_format = "csv"
+
+        self.file_name = f"{basename}.{output_format}"
+        if not self.is_writer:
+            return
+        if output_format == "parquet":
+            self.pyarrow = pyarrow
+            self.schema = pyarrow.schema([(name, pyarrow.int64() if name == "step" else pyarrow.float64()) for name in self.columns])
+            self.parquet = pyarrow.parquet.ParquetWriter(self.file_name, self.schema)
+        else:
+            self.file = open(self.file_name, 'w', newline='')
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(self.columns)
+
+    def write(self, t: float, step: int, values: np.ndarray):
+        if not self.is_writer:
+            return
+        if self.parquet is not None:
+            self.rows.append((t, step, values))
+            if len(self.rows) >= PARQUET_ROW_GROUP:
+                self._flush_parquet()
+        else:
+            self.csv.writerow([repr(t), step, *values.tolist()])
+
+    def _flush_parquet(self):
+        if not self.rows:
+            return
+        data = np.array([[t, step, *values] for t, step, values in self.rows])
+        arrays = [self.pyarrow.array(data[:, i].astype(np.int64) if name == "step" else data[:, i]) for i, name in enumerate(self.columns)]
+        self.parquet.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema))
+        self.rows = []
+
+    def close(self):
+        if self.parquet is not None:
+            self._flush_parquet()
+            self.parquet.close()
+            self.parquet = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ProbeRecorder:
+    """
+    Records the resistor statistics and point probe temperatures of a simulation every probe_every
+    steps, as one row per recorded step with the columns r<n>_max, r<n>_mean, r<n>_integral for every
+    resistor n and probe_<i> for every point.
+
+    Args:
+        V (FunctionSpace): Scalar P1 function space of the temperature.
+        cell_tags (MeshTags): MeshTags object containing the tagged cells.
+        resistor_data (ResistorTable): The resistors, as returned by extractGeometry.read_gdsii.
+        points (np.ndarray): Point probe coordinates, (num_points, 2).
+        output_format (str): "csv" or "parquet".
+        basename (str): Output file name without extension.
+    """
+
+    def __init__(self, V, cell_tags, resistor_data: ResistorTable, points: np.ndarray, output_format: str = "csv", basename: str = "probes"):
+        numbers = resistor_numbers(resistor_data)
+        self.resistors = ResistorProbes(V, cell_tags, numbers)
+        self.points = PointProbes(V, points) if len(points) > 0 else None
+
+        columns = [f"r{number}_{quantity}" for number in numbers for quantity in ("max", "mean", "integral")]
+        columns += [f"probe_{i}" for i in range(len(points))]
+        self.writer = ProbeWriter(basename, columns, output_format, V.mesh.comm)
+
+    def record(self, T, t: float, step: int):
+        peak, mean, integral = self.resistors.evaluate(T)
+        values = np.stack([peak, mean, integral], axis=1).ravel()
+        if self.points is not None:
+            values = np.concatenate([values, self.points.evaluate(T)])
+        self.writer.write(t, step, values)
+
+    def close(self):
+        self.writer.close()
+
+
+def resistor_statistics(T, cell_tags, resistor_data: ResistorTable, resistor_probes: ResistorProbes = None):
+    """
+    Computes the peak and area-weighted mean temperature of every resistor.
+
+    Args:
+        T (Function): Scalar P1 temperature.
+        cell_tags (MeshTags): MeshTags object containing the tagged cells.
+        resistor_data (ResistorTable): The resistors, as returned by extractGeometry.read_gdsii.
+        resistor_probes (ResistorProbes): Precomputed probes, for repeated evaluation on the same mesh.
+
+    Returns:
+        peak (np.ndarray): Largest dof temperature of every resistor, ordered by resistor number.
+        mean (np.ndarray): Mean temperature of every resistor, ordered by resistor number.
+    """
+    if resistor_probes is None:
+        resistor_probes = ResistorProbes(T.function_space, cell_tags, resistor_numbers(resistor_data))
+    peak, mean, _ = resistor_probes.evaluate(T)
+    return peak, mean
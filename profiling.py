@@ -0,0 +1,234 @@
+# ==============================================================================================
+# Phase profiler: wall/CPU time, peak memory and sizes of every phase as a Chrome trace
+# ==============================================================================================
+#
+# Enabled with "python Firebird.py GDS XML PARAMS --profile". The trace file opens in chrome://tracing
+# or https://ui.perfetto.dev, with one process per MPI rank. Every phase records its wall and CPU time,
+# the peak resident memory of its process at its end, and any sizes annotated inside it (dofs, cells).
+# With --cprofile the top-level phases are additionally run under cProfile, and the statistics of
+# the slowest one are written next to the trace.
+#
+# Phases that run once per time step (right-hand side assembly, solve) are timed with
+# repeated_phase() instead: they are accumulated per name and thread (count, total and largest time)
+# and written as one event each, so the trace does not grow with the number of steps.
+#
+# While profiling is off, phase() returns a shared no-op context manager and profiled functions call
+# straight through, so the instrumentation costs one global lookup per phase.
+
+import os
+import sys
+import json
+import time
+import resource
+import functools
+import threading
+import contextlib
+
+# Active profiler, None while profiling is off
+_profiler = None
+_NULL_PHASE = contextlib.nullcontext()
+# ru_maxrss is reported in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in megabytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT / 2 ** 20
+
+
+class PhaseProfiler:
+    """
+    Records the phases of a run as Chrome trace complete events.
+
+    Args:
+        trace_file (str): Output JSON file in the Chrome trace event format.
+        use_cprofile (bool): Run every top-level phase of the main thread under cProfile.
+        comm (MPI.Comm): Communicator whose ranks are gathered into one trace.
+    """
+
+    def __init__(self, trace_file: str, use_cprofile: bool, comm):
+        self.trace_file = trace_file
+        self.use_cprofile = use_cprofile
+        self.comm = comm
+        self.start = time.perf_counter()
+        self.events = []
+        self.sizes = {}
+        self.local = threading.local()
+        self.thread_ids = {}
+        self.cprofiles = []
+        self.repeated = {}
+
+    def _stack(self):
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def _thread_id(self):
+        # Small, stable thread numbers read better in the trace viewers than thread identifiers
+        return self.thread_ids.setdefault(threading.get_ident(), len(self.thread_ids))
+
+    @contextlib.contextmanager
+    def phase(self, name: str, **args):
+        stack = self._stack()
+        record = dict(args)
+        profile = None
+        if self.use_cprofile and not stack and threading.current_thread() is threading.main_thread():
+            import cProfile
+            profile = cProfile.Profile()
+
+        stack.append(record)
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            wall = time.perf_counter() - wall_start
+            record['cpu_s'] = time.process_time() - cpu_start
+            record['peak_rss_mb'] = peak_rss_mb()
+            stack.pop()
+            self.events.append({'name': name, 'ph': 'X', 'cat': 'firebird', 'ts': (wall_start - self.start) * 1e6, 'dur': wall * 1e6,
+                                'pid': self.comm.rank, 'tid': self._thread_id(), 'args': record})
+            if profile is not None:
+                self.cprofiles.append((wall, name, profile))
+
+    @contextlib.contextmanager
+    def repeated_phase(self, name: str):
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            wall = time.perf_counter() - wall_start
+            totals = self.repeated.get((name, self._thread_id()))
+            if totals is None:
+                totals = self.repeated[(name, self._thread_id())] = {'ts': (wall_start - self.start) * 1e6, 'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'max_s': 0.0}
+            totals['count'] += 1
+            totals['wall_s'] += wall
+            totals['cpu_s'] += time.process_time() - cpu_start
+            totals['max_s'] = max(totals['max_s'], wall)
+
+    def _repeated_events(self):
+        """
+        Returns one complete event per repeated phase and thread. It starts with the first call and lasts
+        the total time of all calls, which keeps it inside the phase around the calls.
+        """
+        return [{'name': name, 'ph': 'X', 'cat': 'firebird', 'ts': totals['ts'], 'dur': totals['wall_s'] * 1e6, 'pid': self.comm.rank, 'tid': tid,
+                 'args': {'count': totals['count'], 'cpu_s': totals['cpu_s'], 'max_s': totals['max_s'], 'peak_rss_mb': peak_rss_mb()}}
+                for (name, tid), totals in self.repeated.items()]
+
+    def annotate(self, **values):
+        """Attaches values, such as dof and cell counts, to the innermost open phase and to the run summary."""
+        stack = self._stack()
+        if stack:
+            stack[-1].update(values)
+        self.sizes.update(values)
+
+    def summary(self, events: list):
+        """Aggregates the events of every rank per phase name: count, total wall and CPU time, largest peak RSS."""
+        phases = {}
+        for event in events:
+            phase = phases.setdefault(event['name'], {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'peak_rss_mb': 0.0, 'first_ts': event['ts']})
+            if event['pid'] == 0:
+                phase['count'] += event['args'].get('count', 1)
+                phase['wall_s'] += event['dur'] / 1e6
+                phase['cpu_s'] += event['args']['cpu_s']
+            phase['peak_rss_mb'] = max(phase['peak_rss_mb'], event['args']['peak_rss_mb'])
+            phase['first_ts'] = min(phase['first_ts'], event['ts'])
+        return dict(sorted(phases.items(), key=lambda item: item[1]['first_ts']))
+
+    def finish(self):
+        """Gathers the events of all ranks, writes the trace on rank 0 and prints the per-phase summary."""
+        all_events = self.comm.gather(self.events + self._repeated_events(), root=0)
+        all_sizes = self.comm.gather(self.sizes, root=0)
+        self._dump_cprofile()
+        if self.comm.rank != 0:
+            return
+
+        events = [event for rank_events in all_events for event in rank_events]
+        summary = self.summary(events)
+        names = [{'name': 'process_name', 'ph': 'M', 'pid': rank, 'args': {'name': f"rank {rank}"}} for rank in range(self.comm.size)]
+        with open(self.trace_file, 'w') as f:
+            json.dump({'traceEvents': names + events, 'displayTimeUnit': 'ms',
+                       'otherData': {'command': ' '.join(sys.argv), 'ranks': self.comm.size, 'sizes': all_sizes[0],
+                                     'peak_rss_mb_per_rank': [max((e['args']['peak_rss_mb'] for e in rank_events), default=0.0) for rank_events in all_events],
+                                     'phases': {name: {key: value for key, value in phase.items() if key != 'first_ts'} for name, phase in summary.items()}}}, f)
+
+        print(f"""\033[92m
+        +---------------+
+        | Phase profile |
+        +---------------+
+        \033[0m""")
+        print(f"{'phase':<20} {'count':>7} {'wall (s)':>10} {'cpu (s)':>10} {'peak RSS (MB)':>14}")
+        for name, phase in summary.items():
+            print(f"{name:<20} {phase['count']:>7} {phase['wall_s']:>10.3f} {phase['cpu_s']:>10.3f} {phase['peak_rss_mb']:>14.1f}")
+        if self.sizes:
+            print(', '.join(f"{key}: {value}" for key, value in self.sizes.items()))
+        print(f"Trace written to \033[95m{self.trace_file}\033[0m")
+
+    def _dump_cprofile(self):
+        """Writes the cProfile statistics of the slowest top-level phase of this rank."""
+        if not self.cprofiles:
+            return
+        import pstats
+
+        wall, name, profile = max(self.cprofiles, key=lambda entry: entry[0])
+        stats_file = f"{os.path.splitext(self.trace_file)[0]}_{name}_p{self.comm.rank}.prof"
+        profile.dump_stats(stats_file)
+        if self.comm.rank == 0:
+            print(f"\nSlowest phase '{name}' ({wall:.2f} s, cProfile overhead included), top functions by cumulative time:")
+            pstats.Stats(profile, stream=sys.stdout).sort_stats("cumulative").print_stats(15)
+            print(f"cProfile statistics written to \033[95m{stats_file}\033[0m (one file per rank)")
+
+
+def enable(trace_file: str = "firebird_trace.json", use_cprofile: bool = False, comm=None):
+    """Starts profiling the phases of this process; comm defaults to MPI.COMM_WORLD."""
+    global _profiler
+    if comm is None:
+        from mpi4py import MPI
+        comm = MPI.COMM_WORLD
+    _profiler = PhaseProfiler(trace_file, use_cprofile, comm)
+
+
+def finish():
+    """Writes the trace and stops profiling. Collective over the communicator of the profiler."""
+    global _profiler
+    if _profiler is not None:
+        profiler, _profiler = _profiler, None
+        profiler.finish()
+
+
+def phase(name: str, **args):
+    """Context manager timing a phase; args are stored with the phase in the trace."""
+    if _profiler is None:
+        return _NULL_PHASE
+    return _profiler.phase(name, **args)
+
+
+def repeated_phase(name: str):
+    """Context manager timing a phase that runs many times, stored as its count, total and largest time."""
+    if _profiler is None:
+        return _NULL_PHASE
+    return _profiler.repeated_phase(name)
+
+
+def annotate(**values):
+    """Attaches sizes such as dofs and cells to the current phase."""
+    if _profiler is not None:
+        _profiler.annotate(**values)
+
+
+def profiled(name: str):
+    """Decorator timing every call of a function as a phase."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return function(*args, **kwargs)
+            with _profiler.phase(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,496 @@
+# ==============================================================================================
+# Reduced-order thermal model: Krylov moment matching of the finite element model
+# ==============================================================================================
+#
+# Example:
+#   python reducedModel.py build skripsieTest.gds defLayers.xml defParams.txt --order 60 --output rom.npz
+#   python reducedModel.py simulate rom.npz --steps 100000
+#
+# The semi-discrete heat equation of findHeatSolution is
+#
+#   M dT/dt = -(K + H) T + G p + h T_ambient
+#
+# with mass matrix M (rho*cp), conduction matrix K (k), cooling boundary matrix H (h_cooling), heat
+# source matrix G that maps the resistor powers p to the load vector, and cooling load vector h. The
+# reduced model projects M, K, H, G and h onto an orthonormal basis V of the block Krylov space
+#
+#   span{(K + H)^-1 [G h], ((K + H)^-1 M) (K + H)^-1 [G h], ...}
+#
+# which matches the leading moments of the transfer function from (p, T_ambient) to the temperature
+# around s = 0, so the steady state and slow dynamics are reproduced exactly. When the layout has more
+# inputs than --order, [h G] (every input scaled to unit norm) is first compressed to its dominant
+# order/2 directions by a randomised SVD, leaving the other half of the basis for the higher moments.
+# The model then still takes every resistor power as an input, but is exact only for powers in the
+# span of the kept directions. The outputs are the
+# resistor mean temperatures, as in probes.resistor_statistics. Time stepping uses the same scheme as
+# the full model (backward Euler with explicit cooling), so the two agree step by step.
+#
+# Only "build" needs dolfinx; the saved model is evaluated by ReducedThermalModel with NumPy alone.
+
+import os
+import sys
+import json
+import time
+import click
+import numpy as np
+from resistorTable import ResistorTable
+
+
+class ReducedThermalModel:
+    '''
+    Reduced state-space thermal model with resistor powers and the ambient temperature as inputs and
+    resistor mean temperatures as outputs. Needs only NumPy.
+
+    Args:
+        file_name (str): .npz file written by build_reduced_model.
+    '''
+
+    def __init__(self, file_name: str):
+        with np.load(file_name) as data:
+            self.M = data['M']
+            self.K = data['K']
+            self.H = data['H']
+            self.G = data['G']
+            self.h = data['h']
+            self.C = data['C']
+            self.numbers = data['resistor_numbers']
+            self.power = data['power']
+            self.meta = json.loads(str(data['meta']))
+        self.order = self.M.shape[0]
+        self._step_matrices = {}
+
+    def step_matrices(self, dt: float):
+        '''
+        Returns the matrices of x_{n+1} = A x_n + B p_n + c T_ambient for the time step dt, with the
+        backward Euler and explicit cooling scheme of the full model.
+        '''
+        if dt not in self._step_matrices:
+            lhs = self.M / dt + self.K
+            self._step_matrices[dt] = (np.linalg.solve(lhs, self.M / dt - self.H), np.linalg.solve(lhs, self.G), np.linalg.solve(lhs, self.h))
+        return self._step_matrices[dt]
+
+    def simulate(self, power=None, T_ambient: float = None, dt: float = None, num_steps: int = None):
+        '''
+        Runs the reduced model from the initial state of the full model (zero temperature).
+
+        Args:
+            power: Resistor powers in the order of numbers, constant (num_resistors,) or per step (num_steps, num_resistors).
+                   Defaults to the powers of the layout the model was built from.
+            T_ambient (float): Ambient temperature, defaults to the one of the full model.
+            dt (float): Time step, defaults to delta of the full model.
+            num_steps (int): Number of steps, defaults to the iterations of the full model.
+
+        Returns:
+            np.ndarray: Mean temperature of every resistor after every step, (num_steps, num_resistors).
+        '''
+        power = self.power if power is None else np.asarray(power, dtype=np.float64)
+        T_ambient = self.meta['ambient'] if T_ambient is None else T_ambient
+        dt = self.meta['delta'] if dt is None else dt
+        num_steps = (self.meta['iterations'] if power.ndim == 1 else len(power)) if num_steps is None else num_steps
+
+        A, B, c = self.step_matrices(dt)
+        if power.ndim == 1:
+            # Constant inputs: one forcing vector for all steps
+            forcing = np.broadcast_to(B @ power + c * T_ambient, (num_steps, self.order))
+        else:
+            forcing = power[:num_steps] @ B.T + c * T_ambient
+
+        states = np.empty((num_steps, self.order))
+        x = np.zeros(self.order)
+        for step in range(num_steps):
+            x = A @ x + forcing[step]
+            states[step] = x
+        return states @ self.C.T
+
+    def steady_state(self, power=None, T_ambient: float = None):
+        '''Mean temperature of every resistor in steady state.'''
+        power = self.power if power is None else np.asarray(power, dtype=np.float64)
+        T_ambient = self.meta['ambient'] if T_ambient is None else T_ambient
+        return self.C @ np.linalg.solve(self.K + self.H, self.G @ power + self.h * T_ambient)
+
+
+def layout_power(resistor_data: ResistorTable, numbers: np.ndarray):
+    '''Returns the power of the layout resistors numbers, in that order.'''
+    return resistor_data.power[resistor_data.index(numbers)]
+
+
+def compress_inputs(h, G, num_directions: int, comm, oversampling: int = 10, seed: int = 0):
+    '''
+    Returns num_directions orthonormal load vectors spanning the dominant directions of the input block
+    [h G], with every input scaled to unit norm, by a randomised SVD (range finder followed by the SVD
+    of the projected block), and the fraction of the block's energy they capture.
+    '''
+    num_inputs = G.getSize()[1] + 1
+    num_samples = min(num_directions + oversampling, num_inputs)
+
+    # Unit-norm scaling of the inputs: the resistor columns by their norms, h by its own
+    G_squared = G.transposeMatMult(G)
+    column_norms = np.sqrt(G_squared.getDiagonal().array)
+    column_scale = np.divide(1.0, column_norms, out=np.zeros_like(column_norms), where=column_norms > 0)
+    h_norm = h.norm()
+    h_scale = 1.0 / h_norm if h_norm > 0 else 0.0
+    G_squared.destroy()
+
+    # ----------- Range of the block: its product with random input vectors ----------- #
+    # Every rank draws the same samples, and uses the rows of the resistor columns it owns
+    samples = np.random.default_rng(seed).standard_normal((num_inputs, num_samples))
+    column = G.createVecRight()
+    first_column, end_column = column.getOwnershipRange()
+    range_basis = []
+    for j in range(num_samples):
+        column.array[:] = column_scale * samples[1 + first_column:1 + end_column, j]
+        y = G.createVecLeft()
+        G.mult(column, y)
+        y.axpy(h_scale * samples[0, j], h)
+        for _ in range(2):
+            for q in range_basis:
+                y.axpy(-q.dot(y), q)
+        norm = y.norm()
+        if norm == 0.0:
+            y.destroy()
+            continue
+        y.scale(1.0 / norm)
+        range_basis.append(y)
+
+    # ------- SVD of the projected block Z = Q^T [h G], through the Gram matrix Z Z^T ------- #
+    Z = np.empty((len(range_basis), end_column - first_column))
+    Z_h = np.empty(len(range_basis))
+    for i, q in enumerate(range_basis):
+        G.multTranspose(q, column)
+        Z[i] = column.array * column_scale
+        Z_h[i] = h_scale * q.dot(h)
+    gram = comm.allreduce(Z @ Z.T) + np.outer(Z_h, Z_h)
+    energy, vectors = np.linalg.eigh(gram)
+    kept = np.argsort(energy)[::-1][:num_directions]
+
+    directions = []
+    for i in kept:
+        w = range_basis[0].duplicate()
+        w.set(0.0)
+        w.maxpy(vectors[:, i], range_basis)
+        directions.append(w)
+    for vector in range_basis + [column]:
+        vector.destroy()
+    # Every input has unit norm, so the energy of the block is the number of non-zero inputs
+    total = comm.allreduce(np.count_nonzero(column_norms)) + (h_norm > 0)
+    return directions, float(np.sum(energy[kept]) / total) if total > 0 else 1.0
+
+
+def build_reduced_model(mesh_data: tuple, resistor_data: ResistorTable, rho: float, cp: float, k: float, h_cooling: float, T_ambient: float, delta: float, iterations: int, options: dict, order: int, output: str, report: bool = True, deflation_tol: float = 1e-10):
+    """
+    Builds the reduced model of the single-layer transient problem by block Arnoldi and saves it to output.
+
+    Args:
+        mesh_data (tuple): (domain, cell_tags, facet_tags)
+        resistor_data (ResistorTable): The resistors, as returned by extractGeometry.read_gdsii.
+        rho, cp, k (float): Density, specific heat capacity and thermal conductivity of the substrate.
+        h_cooling (float): Heat transfer coefficient of the cooling boundary.
+        T_ambient (float): Ambient temperature.
+        delta (float): Time step size.
+        iterations (int): Number of time steps, the default length of reduced simulations and of the error report.
+        options (dict): Optional settings from parseParams.parse_options.
+        order (int): Largest dimension of the reduced model. With more inputs (resistors and the ambient temperature)
+                     than order, the inputs are compressed to order/2 directions first (see compress_inputs).
+        output (str): .npz file the model is written to.
+        report (bool): Run the full model with the layout powers and report the error of the reduced model.
+        deflation_tol (float): Relative norm below which a Krylov vector is considered linearly dependent and dropped.
+
+    Returns:
+        dict: The error report, or None.
+    """
+    import ufl
+    from petsc4py import PETSc
+    from dolfinx import fem
+    from dolfinx.fem import Function
+    from dolfinx.fem.petsc import assemble_matrix, assemble_vector
+    import heatFlow
+    import probes
+
+    domain, cell_tags, facet_tags = mesh_data
+    comm = domain.comm
+    build_start = time.perf_counter()
+
+    V = fem.FunctionSpace(domain, ("CG", 1))
+    u = ufl.TrialFunction(V)
+    v = ufl.TestFunction(V)
+
+    # --------------------------- Full-order system matrices --------------------------- #
+    def assemble(a):
+        A = assemble_matrix(fem.form(a))
+        A.assemble()
+        return A
+
+    M = assemble(rho * cp * u * v * ufl.dx)
+    K = assemble(k * ufl.dot(ufl.grad(u), ufl.grad(v)) * ufl.dx)
+    H = assemble(h_cooling * u * v * ufl.ds)
+    h = assemble_vector(fem.form(h_cooling * v * ufl.ds))
+    h.ghostUpdate(addv=PETSc.InsertMode.ADD, mode=PETSc.ScatterMode.REVERSE)
+
+    # Load vectors of the resistor powers: G = (Q-space mass matrix) B
+    B, Q, numbers = heatFlow.resistor_source_matrix(V, domain, cell_tags, resistor_data, options['source'])
+    load = assemble(ufl.TrialFunction(Q.function_space) * v * ufl.dx)
+    G = load.matMult(B)
+
+    K_total = K.copy()
+    K_total.axpy(1.0, H)
+    solver = heatFlow.create_solver(K_total, comm, options['solver'], options['solver_rtol'])
+    solver.setUp()
+
+    # ------------------------- Block Arnoldi at s = 0 ------------------------- #
+    basis = []
+
+    def add_to_basis(w):
+        '''Orthonormalises w against the basis (twice, for stability) and keeps it unless it is linearly dependent.'''
+        initial_norm = w.norm()
+        for _ in range(2):
+            for q in basis:
+                w.axpy(-q.dot(w), q)
+        norm = w.norm()
+        if norm <= deflation_tol * initial_norm or norm == 0.0:
+            w.destroy()
+            return False
+        w.scale(1.0 / norm)
+        basis.append(w)
+        return True
+
+    def solve_K(rhs):
+        w = K_total.createVecRight()
+        w.set(0.0)
+        solver.solve(rhs, w)
+        return w
+
+    # First block: responses to every input, the ambient temperature first and then one per resistor.
+    # Inputs that do not fit in the order are compressed to their dominant directions first, so that
+    # every input still contributes and half of the order is left for the higher moments.
+    num_inputs = len(numbers) + 1
+    compressed = num_inputs > order
+    if compressed:
+        inputs, captured = compress_inputs(h, G, max(1, order // 2), comm)
+        print(f"\033[93mInputs compressed:\033[0m {num_inputs} inputs to {len(inputs)} directions ({captured:.1%} of their energy)")
+    else:
+        inputs = [h]
+        for column in range(len(numbers)):
+            g = G.createVecLeft()
+            G.getColumnVector(column, g)
+            inputs.append(g)
+
+    block = []
+    for g in inputs:
+        if len(basis) >= order:
+            break
+        w = solve_K(g)
+        if add_to_basis(w):
+            block.append(w)
+    moments = 1
+    Mq = M.createVecLeft()
+    while block and len(basis) < order:
+        next_block = []
+        for q in block:
+            if len(basis) >= order:
+                break
+            M.mult(q, Mq)
+            w = solve_K(Mq)
+            if add_to_basis(w):
+                next_block.append(w)
+        block = next_block
+        moments += 1
+    print(f"\033[93mReduced order:\033[0m {len(basis)} ({moments} block moments of {len(inputs)} inputs)")
+
+    # --------------------- Galerkin projection onto the basis --------------------- #
+    def project(A):
+        Aq = A.createVecLeft()
+        reduced = np.empty((len(basis), len(basis)))
+        for j, q in enumerate(basis):
+            A.mult(q, Aq)
+            reduced[:, j] = [r.dot(Aq) for r in basis]
+        Aq.destroy()
+        return reduced
+
+    M_r, K_r, H_r = project(M), project(K), project(H)
+    # G^T q is distributed over the ranks by resistor column, in ascending order of the ranks
+    G_r = np.empty((len(basis), len(numbers)))
+    Gq = G.createVecRight()
+    for j, q in enumerate(basis):
+        G.multTranspose(q, Gq)
+        G_r[j] = np.concatenate(comm.allgather(Gq.array))
+    Gq.destroy()
+    h_r = np.array([q.dot(h) for q in basis])
+
+    # Outputs: resistor means of every basis vector
+    q_function = Function(V)
+    resistor_probes = probes.ResistorProbes(V, cell_tags, numbers)
+    C_r = np.empty((len(numbers), len(basis)))
+    for j, q in enumerate(basis):
+        q.copy(q_function.vector)
+        q_function.x.scatter_forward()
+        C_r[:, j] = probes.resistor_statistics(q_function, cell_tags, resistor_data, resistor_probes)[1]
+
+    meta = {'mode': 'transient', 'source': options['source'], 'rho': rho, 'cp': cp, 'k': k, 'h_cooling': h_cooling,
+            'ambient': T_ambient, 'delta': delta, 'iterations': iterations, 'order': len(basis), 'moments': moments,
+            'input_directions': len(inputs) if compressed else None,
+            'num_dofs': V.dofmap.index_map.size_global, 'build_time_s': time.perf_counter() - build_start,
+            'created': time.strftime("%Y-%m-%d %H:%M:%S")}
+    if comm.rank == 0:
+        np.savez(output, M=M_r, K=K_r, H=H_r, G=G_r, h=h_r, C=C_r, resistor_numbers=numbers,
+                 power=layout_power(resistor_data, numbers), meta=json.dumps(meta))
+    comm.barrier()
+    print(f"\033[92mReduced model written to\033[0m \033[95m{output}\033[0m ({meta['build_time_s']:.1f} s)")
+
+    for vector in basis + inputs + ([h] if compressed else []):
+        vector.destroy()
+    for matrix in (K_total, load, G):
+        matrix.destroy()
+    solver.destroy()
+
+    if not report:
+        return None
+
+    # ---------------- Error report against the full model, layout powers ---------------- #
+    T_n = Function(V)
+    mass_coefficient = fem.Constant(domain, PETSc.ScalarType(rho * cp / delta))
+    a, L = heatFlow.build_single_layer_forms(u, v, T_n, Q, mass_coefficient, fem.Constant(domain, PETSc.ScalarType(k)),
+                                             fem.Constant(domain, PETSc.ScalarType(h_cooling)), fem.Constant(domain, PETSc.ScalarType(T_ambient)))
+    power = B.createVecRight()
+    first_owned, end_owned = power.getOwnershipRange()
+    power.array[:] = layout_power(resistor_data, numbers[first_owned:end_owned])
+    B.mult(power, Q.vector)
+    Q.x.scatter_forward()
+
+    full_solver = heatFlow.TransientHeatSolver(a, L, T_n, [], solver_type=options['solver'], rtol=options['solver_rtol'])
+    full = np.empty((iterations, len(numbers)))
+    full_start = time.perf_counter()
+    for step in range(iterations):
+        full_solver.step()
+        full[step] = probes.resistor_statistics(T_n, cell_tags, resistor_data, resistor_probes)[1]
+    full_time = time.perf_counter() - full_start
+
+    result = None
+    if comm.rank == 0:
+        model = ReducedThermalModel(output)
+        reduced_start = time.perf_counter()
+        reduced = model.simulate()
+        reduced_time = time.perf_counter() - reduced_start
+        result = error_report(full, reduced, numbers, full_time, reduced_time)
+        print_error_report(result)
+        with open(f"{os.path.splitext(output)[0]}_error.json", 'w') as f:
+            json.dump(result, f, indent=2)
+    B.destroy()
+    power.destroy()
+    return comm.bcast(result, root=0)
+
+
+def error_report(full: np.ndarray, reduced: np.ndarray, numbers: np.ndarray, full_time: float, reduced_time: float):
+    '''Compares the resistor mean temperatures of the full and reduced model over all steps.'''
+    error = np.abs(reduced - full)
+    rise = np.max(np.abs(full - full[0]), axis=0)  # range of each resistor's temperature over the run
+    return {
+        'steps': len(full),
+        'max_abs_error_K': float(np.max(error)),
+        'final_max_abs_error_K': float(np.max(error[-1])),
+        'per_resistor': [{'resistor': int(number), 'max_abs_error_K': float(np.max(error[:, i])),
+                          'relative_to_range': float(np.max(error[:, i]) / rise[i]) if rise[i] > 0 else None}
+                         for i, number in enumerate(numbers)],
+        'full_steps_per_s': len(full) / full_time,
+        'reduced_steps_per_s': len(reduced) / reduced_time,
+    }
+
+
+def print_error_report(report: dict):
+    print(f"\n{'resistor':>8} {'max error (K)':>14} {'of range':>9}")
+    for resistor in report['per_resistor']:
+        relative = f"{resistor['relative_to_range']:.2e}" if resistor['relative_to_range'] is not None else "-"
+        print(f"{resistor['resistor']:>8} {resistor['max_abs_error_K']:>14.3e} {relative:>9}")
+    print(f"\nLargest error over {report['steps']} steps: {report['max_abs_error_K']:.3e} K (final step {report['final_max_abs_error_K']:.3e} K)")
+    print(f"Full model: {report['full_steps_per_s']:.1f} steps/s, reduced model: {report['reduced_steps_per_s']:.0f} steps/s")
+
+
+# ---------------------------------------------------------------------------- #
+#                 Command line: build or run a reduced-order model              #
+# ---------------------------------------------------------------------------- #
+@click.group()
+def cli():
+    """Build reduced-order thermal models and simulate with them."""
+
+
+@cli.command()
+@click.argument('gds_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('xml_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.option('--order', type=int, default=60, show_default=True, help="Largest dimension of the reduced model. Layouts with more resistors are compressed to order/2 input directions first.")
+@click.option('--output', default="rom.npz", show_default=True, help="File for the reduced model.")
+@click.option('--report/--no-report', default=True, show_default=True, help="Compare against the full model with the layout powers.")
+def build(gds_file, xml_file, params, order, output, report):
+    """Build the reduced model of the layout in GDS_FILE."""
+    from mpi4py import MPI
+    import parseParams
+    import parseLayers
+    import extractGeometry
+    import meshCache
+
+    comm = MPI.COMM_WORLD
+    if comm.rank != 0:
+        sys.stdout = open(os.devnull, 'w')
+
+    try:
+        substrate_layer, resist_layer, iterations, delta, ambient_temp, s_sense = parseParams.parse_file(params)
+        options = parseParams.parse_options(params)
+    except ValueError:
+        print("\033[91mAn error occured during setup: Values could not be read from paramter file.\033[0m\n")
+        sys.exit(1)
+
+    substrate_layer_properties = parseLayers.get_layer_properties(xml_file, substrate_layer)
+    if not type(substrate_layer_properties) == dict:
+        print(substrate_layer_properties)
+        sys.exit(1)
+    if options['layers'] != "single" or substrate_layer_properties['ThermalConductivityTable'] is not None or substrate_layer_properties['SpecificHeatCapacityTable'] is not None:
+        print("\033[103mThe reduced model is linear: it uses the single-layer model with constant properties\033[0m")
+
+    try:
+        layout_length, layout_width, resistor_data = extractGeometry.read_layout_shared(gds_file, substrate_layer, resist_layer, options, comm)
+    except ValueError as e:
+        print(f"\033[91m{e}\033[0m\n")
+        sys.exit(1)
+    if int(layout_length) == 0 or int(layout_width) == 0:
+        print(f"\n\033[103mDimensions are not workable, please enter a layer with non-zero dimensions.\033[0m\n")
+        sys.exit(1)
+
+    mesh_data = meshCache.mesh_layout(options, layout_length, layout_width, resistor_data, s_sense, comm)
+    build_reduced_model(mesh_data, resistor_data, float(substrate_layer_properties['Density']), float(substrate_layer_properties['SpecificHeatCapacity']),
+                        float(substrate_layer_properties['ThermalConductivity']), options['h_cooling'], ambient_temp, delta, iterations, options, order, output, report)
+
+
+@cli.command()
+@click.argument('model_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.option('--steps', type=int, default=None, help="Number of time steps, defaults to the iterations of the full model.")
+@click.option('--dt', type=float, default=None, help="Time step, defaults to delta of the full model.")
+@click.option('--ambient', type=float, default=None, help="Ambient temperature, defaults to the one of the full model.")
+@click.option('--params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True), default=None,
+              help="Parameter file with power profiles (profile_<n>= entries or profile_file=).")
+def simulate(model_file, steps, dt, ambient, params):
+    """Run the reduced model in MODEL_FILE with the layout powers, or the power profiles of PARAMS, and print the final resistor temperatures."""
+    model = ReducedThermalModel(model_file)
+    dt = model.meta['delta'] if dt is None else dt
+    steps = model.meta['iterations'] if steps is None else steps
+
+    power = None
+    if params is not None:
+        import parseParams
+        import powerProfiles
+        profiles = powerProfiles.profiles_from_params(params, parseParams.parse_options(params), model.numbers, model.power)
+        if profiles is not None:
+            # Backward Euler takes the source at the end of every step
+            power = profiles.sample(dt * np.arange(1, steps + 1))
+
+    start = time.perf_counter()
+    temperatures = model.simulate(power, T_ambient=ambient, dt=dt, num_steps=steps)
+    elapsed = time.perf_counter() - start
+
+    final_power = model.power if power is None else power[-1]
+    print(f"\n{'resistor':>8} {'power':>10} {'mean (K)':>10}")
+    for number, resistor_power, temperature in zip(model.numbers, final_power, temperatures[-1]):
+        print(f"{number:>8} {resistor_power:>10.4g} {temperature:>10.4f}")
+    print(f"\n\033[92m{len(temperatures)} steps of order {model.order} in {elapsed * 1000:.2f} ms ({len(temperatures) / elapsed:.0f} steps/s)\033[0m")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,141 @@
+import os
+import json
+import hashlib
+import numpy as np
+
+# One row per resistor: its number, power dissipation (μW), polygon center and bounds ordered
+# x_min, x_max, y_min, y_max (μm)
+RESISTOR_DTYPE = np.dtype([('number', np.int64), ('power', np.float64), ('center', np.float64, (2,)), ('bounds', np.float64, (4,))])
+
+# Bump when the extraction changes so that stale .npz tables are not reused
+TABLE_VERSION = 1
+
+
+class ResistorTable:
+    """
+    The resistors of a layout as one structured array, sorted by resistor number. Every quantity is
+    a column, so consumers operate on whole arrays instead of iterating over per-resistor records,
+    and the table pickles (for MPI broadcasts and worker processes) and saves as a single buffer.
+
+    Args:
+        rows (np.ndarray): Structured array of RESISTOR_DTYPE, sorted by resistor number.
+    """
+
+    def __init__(self, rows: np.ndarray):
+        self.rows = rows
+
+    @classmethod
+    def from_columns(cls, numbers, power, centers, bounds):
+        """
+        Builds a table from per-polygon columns in extraction order. Polygons with the same center
+        count once, the last one extracted taking precedence, and the rows are sorted by number.
+        """
+        centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+        # Last occurrence of every center: the first one of the reversed centers
+        _, reversed_first = np.unique(centers[::-1], axis=0, return_index=True)
+        keep = np.sort(len(centers) - 1 - reversed_first)
+
+        rows = np.empty(len(keep), dtype=RESISTOR_DTYPE)
+        rows['number'] = np.asarray(numbers, dtype=np.int64)[keep]
+        rows['power'] = np.asarray(power, dtype=np.float64)[keep]
+        rows['center'] = centers[keep]
+        rows['bounds'] = np.asarray(bounds, dtype=np.float64).reshape(-1, 4)[keep]
+        return cls(rows[np.argsort(rows['number'], kind='stable')])
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=RESISTOR_DTYPE))
+
+    def __len__(self):
+        return len(self.rows)
+
+    # ---------------------------------------------------------------------------- #
+    #                         Stored and derived columns                           #
+    # ---------------------------------------------------------------------------- #
+    @property
+    def numbers(self):
+        return self.rows['number']
+
+    @property
+    def power(self):
+        return self.rows['power']
+
+    @property
+    def centers(self):
+        return self.rows['center']
+
+    @property
+    def bounds(self):
+        return self.rows['bounds']
+
+    @property
+    def length(self):
+        return self.rows['bounds'][:, 1] - self.rows['bounds'][:, 0]
+
+    @property
+    def width(self):
+        return self.rows['bounds'][:, 3] - self.rows['bounds'][:, 2]
+
+    @property
+    def flux(self):
+        """Power per area of every resistor, in μW/μm2 = W/m2."""
+        return self.power / (self.length * self.width)
+
+    # ---------------------------------------------------------------------------- #
+    #                                  Lookups                                     #
+    # ---------------------------------------------------------------------------- #
+    def index(self, numbers):
+        """Returns the rows of the given resistor numbers. Raises KeyError for numbers not in the table."""
+        numbers = np.atleast_1d(np.asarray(numbers, dtype=np.int64))
+        rows = np.searchsorted(self.numbers, numbers)
+        found = rows < len(self)
+        found[found] = self.numbers[rows[found]] == numbers[found]
+        if not np.all(found):
+            raise KeyError(f"Resistor(s) {', '.join(map(str, numbers[~found]))} not in the layout")
+        return rows
+
+    def with_power(self, power):
+        """Returns a copy of the table with the power of every resistor, in row order, replaced by power."""
+        rows = self.rows.copy()
+        rows['power'] = power
+        return ResistorTable(rows)
+
+    # ---------------------------------------------------------------------------- #
+    #                              .npz serialisation                              #
+    # ---------------------------------------------------------------------------- #
+    def save(self, file_name: str, meta: dict = None):
+        """Writes the table and a JSON-serialisable metadata dictionary to a .npz file."""
+        temporary = f"{file_name}.tmp{os.getpid()}.npz"
+        np.savez(temporary, resistors=self.rows, meta=json.dumps({'version': TABLE_VERSION, **(meta or {})}))
+        os.replace(temporary, file_name)
+
+    @classmethod
+    def load(cls, file_name: str):
+        """
+        Reads a table written by save.
+
+        Returns:
+            table (ResistorTable): The resistors.
+            meta (dict): The metadata stored with them.
+
+        Raises:
+            ValueError: If the file is not a resistor table of this version.
+        """
+        with np.load(file_name, allow_pickle=False) as data:
+            if 'resistors' not in data or 'meta' not in data:
+                raise ValueError(f"{file_name} is not a resistor table")
+            rows = data['resistors']
+            meta = json.loads(str(data['meta']))
+        if meta.get('version') != TABLE_VERSION or rows.dtype != RESISTOR_DTYPE:
+            raise ValueError(f"{file_name} was written by an incompatible version")
+        return cls(rows), meta
+
+
+def source_key(file_path: str, main_layer: int, resistive_layer: int, hierarchical: bool):
+    """Returns the hash identifying an extraction: the GDSII file contents, the layers and the extraction mode."""
+    digest = hashlib.sha256()
+    digest.update(f"firebird-resistors-v{TABLE_VERSION}:{main_layer}:{resistive_layer}:{int(bool(hierarchical))}".encode())
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
@@ -0,0 +1,315 @@
+# ==============================================================================================
+# Per-resistor response basis: instant re-evaluation of new power assignments
+# ==============================================================================================
+#
+# Example:
+#   python responseBasis.py compute skripsieTest.gds defLayers.xml defParams.txt --output responses
+#   python responseBasis.py evaluate responses skripsieTest.gds defParams.txt
+#
+# With constant material properties the heat equation is linear in the resistor powers p, so every
+# temperature is the zero-power (ambient) solution plus a superposition of unit-power responses:
+#
+#   T(p) = T_0 + sum_i p_i R_i
+#
+# "compute" solves once for T_0 and once per resistor for R_i (one steady solve, or the transient step
+# response over all iterations) with a single factorisation, and stores:
+#
+#   meta.json              parameters, resistor numbers and the geometry key of the layout
+#   coupling.npy           mean temperature rise of resistor j per unit power in resistor i, [i, j]
+#                          (transient: one such matrix per time step, [step, i, j])
+#   baseline_mean.npy      mean temperature of every resistor at zero power (per step when transient)
+#   fields_p<rank>.npy     full-field unit responses of the dofs owned by each rank (final time)
+#   baseline_p<rank>.npy   full-field zero-power solution of the dofs owned by each rank (final time)
+#   resistor_dofs.npz      global dofs of every resistor, for peak temperatures
+#
+# The .npy files are memory-mapped on evaluation, so "evaluate" only reads the parts it uses.
+
+import os
+import sys
+import json
+import time
+import click
+import numpy as np
+from mpi4py import MPI
+import parseParams
+import parseLayers
+import extractGeometry
+import meshCache
+from resistorTable import ResistorTable
+
+META_FILE = "meta.json"
+COUPLING_FILE = "coupling.npy"
+BASELINE_MEAN_FILE = "baseline_mean.npy"
+RESISTOR_DOFS_FILE = "resistor_dofs.npz"
+
+
+def power_vector(resistor_data: ResistorTable, numbers: np.ndarray):
+    '''Returns the power dissipation of every resistor in the order of numbers. The layout must contain exactly these resistors.'''
+    if len(numbers) != len(resistor_data) or not np.array_equal(np.sort(numbers), resistor_data.numbers):
+        raise ValueError("The resistors of the layout do not match the ones of the response basis")
+    return resistor_data.power[resistor_data.index(numbers)]
+
+
+def check_linear(options: dict, layer_properties: dict = None):
+    '''
+    Raises a ValueError unless the options (and the substrate properties of the layer XML, if given)
+    select the linear model the superposition of unit responses is exact for: a single layer with
+    constant properties and fixed time steps.
+    '''
+    reasons = []
+    if options['layers'] != "single":
+        reasons.append(f"layers={options['layers']}")
+    if options['adaptive']:
+        reasons.append("adaptive=1")
+    if layer_properties is not None and (layer_properties['ThermalConductivityTable'] is not None or layer_properties['SpecificHeatCapacityTable'] is not None):
+        reasons.append("temperature-dependent k(T)/cp(T) in the layer XML")
+    if reasons:
+        raise ValueError(f"The response basis needs the single-layer model with constant properties and fixed time steps, not {', '.join(reasons)}")
+
+
+class ResponseBasis:
+    '''
+    Evaluates the temperatures of any power assignment from a stored response basis. Only NumPy is
+    needed, and every evaluation is a matrix-vector product.
+    '''
+
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+        self.numbers = np.array(self.meta['resistor_numbers'], dtype=np.int64)
+        self.mode = self.meta['mode']
+
+        self.coupling = np.load(os.path.join(directory, COUPLING_FILE), mmap_mode='r')
+        self.baseline_mean = np.load(os.path.join(directory, BASELINE_MEAN_FILE), mmap_mode='r')
+        self.fields = [np.load(os.path.join(directory, f"fields_p{rank}.npy"), mmap_mode='r') for rank in range(self.meta['num_pieces'])]
+        self.baselines = [np.load(os.path.join(directory, f"baseline_p{rank}.npy"), mmap_mode='r') for rank in range(self.meta['num_pieces'])]
+
+        resistor_dofs = np.load(os.path.join(directory, RESISTOR_DOFS_FILE))
+        self.resistor_dofs = resistor_dofs['dofs']
+        self.resistor_offsets = resistor_dofs['offsets']
+
+    def mean_temperature(self, power: np.ndarray):
+        '''Mean temperature of every resistor, or of every resistor at every time step in transient mode.'''
+        return self.baseline_mean + power @ self.coupling
+
+    def temperature_field(self, power: np.ndarray):
+        '''Temperature of every dof (final time in transient mode), in global dof order.'''
+        return np.concatenate([baseline + power @ fields for baseline, fields in zip(self.baselines, self.fields)])
+
+    def peak_temperature(self, power: np.ndarray):
+        '''Largest dof temperature of every resistor (final time in transient mode).'''
+        values = self.temperature_field(power)[self.resistor_dofs]
+        counts = np.diff(self.resistor_offsets)
+        peak = np.full(len(self.numbers), np.nan)
+        peak[counts > 0] = np.maximum.reduceat(values, self.resistor_offsets[:-1][counts > 0])
+        return peak
+
+
+def compute_basis(mesh_data: tuple, resistor_data: ResistorTable, rho: float, cp: float, k: float, h_cooling: float, T_ambient: float, delta: float, iterations: int, options: dict, output_dir: str, meta: dict):
+    """
+    Solves for the zero-power solution and the unit-power response of every resistor and writes them to output_dir.
+
+    Args:
+        mesh_data (tuple): (domain, cell_tags, facet_tags)
+        resistor_data (ResistorTable): The resistors, as returned by extractGeometry.read_gdsii.
+        rho, cp, k (float): Density, specific heat capacity and thermal conductivity of the substrate.
+        h_cooling (float): Heat transfer coefficient of the cooling boundary.
+        T_ambient (float): Ambient temperature.
+        delta (float): Time step size.
+        iterations (int): Number of time steps of the transient response.
+        options (dict): Optional settings from parseParams.parse_options.
+        output_dir (str): Directory the basis is written to.
+        meta (dict): Additional metadata to store with the basis.
+
+    Raises:
+        ValueError: If the options do not select a linear model (see check_linear).
+    """
+    check_linear(options)
+
+    import ufl
+    from petsc4py import PETSc
+    from dolfinx import fem
+    from dolfinx.fem import Function, Constant
+    from tqdm import tqdm
+    import heatFlow
+    import probes
+
+    domain, cell_tags, facet_tags = mesh_data
+    comm = domain.comm
+    steady = options['mode'] == "steady"
+    num_steps = 1 if steady else iterations
+
+    V = fem.FunctionSpace(domain, ("CG", 1))
+    T_n = Function(V)
+    u = ufl.TrialFunction(V)
+    v = ufl.TestFunction(V)
+
+    # ------------- Q = B p: the source of any power vector without rebuilding Q ------------- #
+    B, Q, numbers = heatFlow.resistor_source_matrix(V, domain, cell_tags, resistor_data, options['source'])
+    power = B.createVecRight()
+
+    mass_coefficient = Constant(domain, PETSc.ScalarType(rho * cp / delta))
+    conductivity = Constant(domain, PETSc.ScalarType(k))
+    cooling = Constant(domain, PETSc.ScalarType(h_cooling))
+    ambient = Constant(domain, PETSc.ScalarType(T_ambient))
+    a, L = heatFlow.build_single_layer_forms(u, v, T_n, Q, mass_coefficient, conductivity, cooling, ambient, steady=steady)
+    boundary_conditions = heatFlow.add_boundary_conditions(V, domain, facet_tags, T_ambient)
+    solver = heatFlow.TransientHeatSolver(a, L, T_n, boundary_conditions, solver_type=options['solver'], rtol=options['solver_rtol'])
+
+    resistor_probes = probes.ResistorProbes(V, cell_tags, numbers)
+    dofs = probes.resistor_dofs(V, cell_tags, numbers)
+    num_owned = V.dofmap.index_map.size_local
+
+    def solve(column):
+        '''Runs all steps with the power of one resistor set to 1 (None for zero power) and returns the per-step resistor means.'''
+        power.set(0.0)
+        first_owned, end_owned = power.getOwnershipRange()
+        if column is not None and first_owned <= column < end_owned:
+            power.setValue(column, 1.0)
+        B.mult(power, Q.vector)
+        Q.x.scatter_forward()
+
+        # Same initial state as findHeatSolution
+        T_n.x.array[:] = 0.0
+        means = np.empty((num_steps, len(numbers)))
+        for step in range(num_steps):
+            solver.step()
+            means[step] = probes.resistor_statistics(T_n, cell_tags, resistor_data, resistor_probes)[1]
+        return means
+
+    # ---------------------------------- Output files ---------------------------------- #
+    if comm.rank == 0:
+        os.makedirs(output_dir, exist_ok=True)
+    comm.barrier()
+
+    coupling_shape = (len(numbers), len(numbers)) if steady else (num_steps, len(numbers), len(numbers))
+    coupling = np.lib.format.open_memmap(os.path.join(output_dir, COUPLING_FILE), mode='w+', shape=coupling_shape) if comm.rank == 0 else None
+    fields = np.lib.format.open_memmap(os.path.join(output_dir, f"fields_p{comm.rank}.npy"), mode='w+', shape=(len(numbers), num_owned))
+
+    # ------------------- Zero-power solution at the ambient temperature ------------------ #
+    baseline_mean = solve(None)
+    np.save(os.path.join(output_dir, f"baseline_p{comm.rank}.npy"), T_n.x.array[:num_owned])
+
+    # -------- Unit-power responses: no ambient drive, so only the linear part remains -------- #
+    ambient.value = 0.0
+    for column in tqdm(range(len(numbers)), desc="Unit responses", unit="resistor", disable=comm.rank != 0):
+        means = solve(column)
+        fields[column] = T_n.x.array[:num_owned]
+        if comm.rank == 0:
+            if steady:
+                coupling[column] = means[0]
+            else:
+                coupling[:, column, :] = means
+    fields.flush()
+
+    # ------------------ Global resistor dofs, gathered from every rank ------------------ #
+    first_dof = V.dofmap.index_map.local_range[0]
+    all_dofs = comm.gather([resistor + first_dof for resistor in dofs], root=0)
+    if comm.rank == 0:
+        coupling.flush()
+        np.save(os.path.join(output_dir, BASELINE_MEAN_FILE), baseline_mean[0] if steady else baseline_mean)
+
+        resistor_dofs = [np.sort(np.concatenate([rank_dofs[i] for rank_dofs in all_dofs])) for i in range(len(numbers))]
+        offsets = np.concatenate([[0], np.cumsum([len(resistor) for resistor in resistor_dofs])])
+        np.savez(os.path.join(output_dir, RESISTOR_DOFS_FILE), dofs=np.concatenate(resistor_dofs).astype(np.int64), offsets=offsets)
+
+        meta = dict(meta, mode=options['mode'], source=options['source'], resistor_numbers=numbers.tolist(), num_pieces=comm.size,
+                    rho=rho, cp=cp, k=k, h_cooling=h_cooling, ambient=T_ambient, delta=delta, num_steps=num_steps,
+                    created=time.strftime("%Y-%m-%d %H:%M:%S"))
+        with open(os.path.join(output_dir, META_FILE), 'w') as f:
+            json.dump(meta, f, indent=2)
+    comm.barrier()
+
+    solver.print_timings()
+    B.destroy()
+    power.destroy()
+
+
+# ---------------------------------------------------------------------------- #
+#                 Command line: compute or evaluate a response basis            #
+# ---------------------------------------------------------------------------- #
+@click.group()
+def cli():
+    """Precompute per-resistor responses and evaluate new power assignments with them."""
+
+
+@cli.command()
+@click.argument('gds_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('xml_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.option('--output', 'output_dir', default="responses", show_default=True, help="Directory for the response basis.")
+def compute(gds_file, xml_file, params, output_dir):
+    """Solve for the unit-power response of every resistor of GDS_FILE (steady or transient, following mode= in PARAMS)."""
+    comm = MPI.COMM_WORLD
+    if comm.rank != 0:
+        sys.stdout = open(os.devnull, 'w')
+
+    try:
+        substrate_layer, resist_layer, iterations, delta, ambient_temp, s_sense = parseParams.parse_file(params)
+        options = parseParams.parse_options(params)
+    except ValueError:
+        print("\033[91mAn error occured during setup: Values could not be read from paramter file.\033[0m\n")
+        sys.exit(1)
+
+    substrate_layer_properties = parseLayers.get_layer_properties(xml_file, substrate_layer)
+    if not type(substrate_layer_properties) == dict:
+        print(substrate_layer_properties)
+        sys.exit(1)
+    try:
+        check_linear(options, substrate_layer_properties)
+    except ValueError as e:
+        print(f"\033[91m{e}\033[0m\n")
+        sys.exit(1)
+
+    try:
+        layout_length, layout_width, resistor_data = extractGeometry.read_layout_shared(gds_file, substrate_layer, resist_layer, options, comm)
+    except ValueError as e:
+        print(f"\033[91m{e}\033[0m\n")
+        sys.exit(1)
+    if int(layout_length) == 0 or int(layout_width) == 0:
+        print(f"\n\033[103mDimensions are not workable, please enter a layer with non-zero dimensions.\033[0m\n")
+        sys.exit(1)
+
+    mesh_data = meshCache.mesh_layout(options, layout_length, layout_width, resistor_data, s_sense, comm)
+
+    start = time.perf_counter()
+    meta = {'layout_key': meshCache.mesh_key(layout_length, layout_width, resistor_data, s_sense), 'gds': gds_file}
+    compute_basis(mesh_data, resistor_data, float(substrate_layer_properties['Density']), float(substrate_layer_properties['SpecificHeatCapacity']),
+                  float(substrate_layer_properties['ThermalConductivity']), options['h_cooling'], ambient_temp, delta, iterations, options, output_dir, meta)
+    print(f"\n\033[92mResponse basis of {len(resistor_data)} resistors written to\033[0m \033[95m{output_dir}\033[0m ({time.perf_counter() - start:.1f} s)")
+
+
+@cli.command()
+@click.argument('basis_dir', type=click.Path(exists=True, dir_okay=True, file_okay=False, resolve_path=True))
+@click.argument('gds_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+def evaluate(basis_dir, gds_file, params):
+    """Evaluate the resistor temperatures for the power labels of GDS_FILE from the basis in BASIS_DIR."""
+    try:
+        substrate_layer, resist_layer, _, _, _, s_sense = parseParams.parse_file(params)
+        options = parseParams.parse_options(params)
+    except ValueError:
+        print("\033[91mAn error occured during setup: Values could not be read from paramter file.\033[0m\n")
+        sys.exit(1)
+
+    basis = ResponseBasis(basis_dir)
+    layout_length, layout_width, resistor_data = extractGeometry.read_layout(gds_file, substrate_layer, resist_layer, options)
+    if meshCache.mesh_key(layout_length, layout_width, resistor_data, s_sense) != basis.meta['layout_key']:
+        print("\033[91mError: The layout geometry differs from the one the response basis was computed for.\033[0m")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    power = power_vector(resistor_data, basis.numbers)
+    mean = basis.mean_temperature(power)
+    peak = basis.peak_temperature(power)
+    elapsed = time.perf_counter() - start
+
+    final_mean = mean if basis.mode == "steady" else mean[-1]
+    print(f"\n{'resistor':>8} {'power':>10} {'mean (K)':>10} {'peak (K)':>10}")
+    for number, resistor_power, resistor_mean, resistor_peak in zip(basis.numbers, power, final_mean, peak):
+        print(f"{number:>8} {resistor_power:>10.4g} {resistor_mean:>10.4f} {resistor_peak:>10.4f}")
+    print(f"\n\033[92mEvaluated in {elapsed * 1000:.2f} ms\033[0m")
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,277 @@
+# ==============================================================================================
+# Firebird parameter sweeps: many simulation cases on one layout
+# ==============================================================================================
+#
+# Example:
+#   python sweep.py skripsieTest.gds defLayers.xml defParams.txt cases.csv --workers 8
+#
+# The cases file is a CSV table with one row per case. Every column is optional and falls back to the
+# parameter file and the substrate layer of the XML file:
+#
+#   name, ambient, h_cooling, delta, rho, cp, k, power_<n>
+#
+# where power_<n> overrides the power dissipation of resistor number n. The GDS file is parsed and the
+# layout meshed once for all cases. Cases with the same rho*cp/delta and k (and, for steady solves, the
+# same h_cooling) have the same system matrix and share one factorisation.
+
+import os
+import sys
+import csv
+import tempfile
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import click
+import numpy as np
+from mpi4py import MPI
+from tqdm import tqdm
+import parseParams
+import parseLayers
+import extractGeometry
+import generateOutputFiles
+import meshCache
+from resistorTable import ResistorTable
+
+# Case parameters that can be set per row of the cases file
+CASE_PARAMETERS = ("ambient", "h_cooling", "delta", "rho", "cp", "k")
+POWER_PREFIX = "power_"
+
+# Per-process state of the sweep workers, set by init_worker
+_worker = {}
+
+
+def read_cases(file_name: str, defaults: dict, numbers: np.ndarray):
+    '''
+    Reads the cases table. Returns one dictionary per row with its name, the CASE_PARAMETERS and a
+    dictionary of resistor powers that override the ones from the GDS file.
+    '''
+    cases = []
+    with open(file_name, 'r', newline='') as f:
+        for row_number, row in enumerate(csv.DictReader(f)):
+            row = {column.strip(): value.strip() for column, value in row.items() if column is not None and value is not None and value.strip()}
+            case = {'index': row_number, 'name': row.pop('name', f"case_{row_number}"), 'power': {}}
+            for parameter in CASE_PARAMETERS:
+                case[parameter] = float(row.pop(parameter, defaults[parameter]))
+
+            for column, value in row.items():
+                if not column.startswith(POWER_PREFIX):
+                    raise ValueError(f"Unknown column '{column}' in the cases file")
+                number = int(column[len(POWER_PREFIX):])
+                if number not in numbers:
+                    raise ValueError(f"Column '{column}' refers to a resistor that is not in the layout")
+                case['power'][number] = float(value)
+
+            if case['delta'] <= 0:
+                raise ValueError(f"Case '{case['name']}' must have a positive delta")
+            cases.append(case)
+
+    if len(cases) == 0:
+        raise ValueError("The cases file contains no cases")
+    return cases
+
+
+def operator_key(case: dict, steady: bool):
+    '''The parameters that determine the system matrix: rho*cp/dt and k, plus h_cooling where cooling is implicit (steady solves).'''
+    key = (case['rho'] * case['cp'] / case['delta'], case['k'])
+    return key + (case['h_cooling'],) if steady else key
+
+
+def make_tasks(cases: list, steady: bool, workers: int):
+    '''
+    Groups the cases that share a system matrix. Each task is a list of cases that one worker solves
+    with a single factorisation. When there are fewer groups than workers, groups are split so that
+    every worker has a task, at the cost of one extra factorisation per split.
+    '''
+    groups = OrderedDict()
+    for case in cases:
+        groups.setdefault(operator_key(case, steady), []).append(case)
+
+    splits = max(1, workers // len(groups))
+    tasks = []
+    for group in groups.values():
+        for chunk in np.array_split(np.arange(len(group)), min(splits, len(group))):
+            tasks.append([group[i] for i in chunk])
+    return tasks, len(groups)
+
+
+def case_power(resistor_data: ResistorTable, power: dict):
+    '''Power of every resistor of resistor_data, in row order, with the powers of the resistors in power replaced.'''
+    case = np.array(resistor_data.power)
+    if power:
+        case[resistor_data.index(list(power))] = list(power.values())
+    return case
+
+
+def case_resistors(resistor_data: ResistorTable, power: dict):
+    '''Copy of resistor_data with the power dissipation of the resistors in power replaced.'''
+    return resistor_data.with_power(case_power(resistor_data, power))
+
+
+def init_worker(cache_dir: str, key: str, resistor_data: ResistorTable, settings: dict, mesh_data: tuple = None):
+    '''Loads the mesh of the layout from the mesh cache, once per worker process.'''
+    if mesh_data is None:
+        mesh_data = meshCache.load_mesh(cache_dir, key, MPI.COMM_SELF)
+    _worker.update(mesh=mesh_data, resistor_data=resistor_data, settings=settings)
+
+
+def run_task(cases: list):
+    '''
+    Solves a list of cases that share one system matrix on the mesh of this worker. Returns the index,
+    per-resistor peak and mean temperature and number of steps taken of every case.
+    '''
+    import ufl
+    from petsc4py import PETSc
+    from dolfinx import fem
+    from dolfinx.fem import Function, Constant
+    import heatFlow
+    import probes
+
+    domain, cell_tags, facet_tags = _worker['mesh']
+    resistor_data = _worker['resistor_data']
+    settings = _worker['settings']
+    steady = settings['mode'] == "steady"
+    num_steps = 1 if steady else settings['iterations']
+
+    V = fem.FunctionSpace(domain, ("CG", 1))
+    T_n = Function(V)
+    u = ufl.TrialFunction(V)
+    v = ufl.TestFunction(V)
+
+    # ---- Forms of the first case; later cases only change constants and Q in place ---- #
+    first = cases[0]
+    Q = heatFlow.apply_heat_flux_to_resistor_regions(V, domain, cell_tags, case_resistors(resistor_data, first['power']), settings['source'])
+    mass_coefficient = Constant(domain, PETSc.ScalarType(first['rho'] * first['cp'] / first['delta']))
+    conductivity = Constant(domain, PETSc.ScalarType(first['k']))
+    cooling = Constant(domain, PETSc.ScalarType(first['h_cooling']))
+    ambient = Constant(domain, PETSc.ScalarType(first['ambient']))
+    a, L = heatFlow.build_single_layer_forms(u, v, T_n, Q, mass_coefficient, conductivity, cooling, ambient, steady=steady)
+
+    boundary_conditions = heatFlow.add_boundary_conditions(V, domain, facet_tags, first['ambient'])
+    early_stop = not steady and settings['stop_tol'] > 0
+    solver = heatFlow.TransientHeatSolver(a, L, T_n, boundary_conditions, track_change=early_stop,
+                                          solver_type=settings['solver'], rtol=settings['solver_rtol'])
+
+    resistor_probes = probes.ResistorProbes(V, cell_tags, probes.resistor_numbers(resistor_data))
+    results = []
+    for case in cases:
+        if case is not first:
+            Q.x.array[:] = heatFlow.apply_heat_flux_to_resistor_regions(V, domain, cell_tags, case_resistors(resistor_data, case['power']), settings['source']).x.array
+            cooling.value = case['h_cooling']
+            ambient.value = case['ambient']
+
+        # Same initial state as findHeatSolution
+        T_n.x.array[:] = 0.0
+        for step in range(num_steps):
+            solver.step()
+            if early_stop and solver.last_change < settings['stop_tol']:
+                break
+
+        peak, mean = probes.resistor_statistics(T_n, cell_tags, resistor_data, resistor_probes)
+        results.append((case['index'], peak, mean, step + 1))
+
+    return results
+
+
+@click.command()
+@click.argument('gds_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('xml_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('cases_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.option('--workers', type=int, default=os.cpu_count(), show_default=True, help="Number of worker processes.")
+@click.option('--output', default="sweep_results.npz", show_default=True, help="NumPy .npz file for the results.")
+def sweep(gds_file, xml_file, params, cases_file, workers, output):
+    """Run every case of CASES_FILE on the layout of GDS_FILE and write the peak and mean temperature of every resistor."""
+
+    # ---------------------- Parameters shared by all cases ---------------------- #
+    try:
+        substrate_layer, resist_layer, iterations, delta, ambient_temp, s_sense = parseParams.parse_file(params)
+        options = parseParams.parse_options(params)
+    except ValueError:
+        print("\033[91mAn error occured during setup: Values could not be read from paramter file.\033[0m\n")
+        sys.exit(1)
+
+    if options['layers'] != "single" or options['adaptive']:
+        print("\033[103mSweeps use the single-layer model with fixed time steps: 'layers' and 'adaptive' are ignored\033[0m")
+
+    substrate_layer_properties = parseLayers.get_layer_properties(xml_file, substrate_layer)
+    if not type(substrate_layer_properties) == dict:
+        print(substrate_layer_properties)
+        sys.exit(1)
+    if substrate_layer_properties['ThermalConductivityTable'] is not None or substrate_layer_properties['SpecificHeatCapacityTable'] is not None:
+        print("\033[103mSweeps use constant material properties: the temperature-dependent tables are ignored\033[0m")
+
+    layout_length, layout_width, resistor_data = extractGeometry.read_layout(gds_file, substrate_layer, resist_layer, options)
+    if int(layout_length) == 0 or int(layout_width) == 0:
+        print(f"\n\033[103mDimensions are not workable, please enter a layer with non-zero dimensions.\033[0m\n")
+        sys.exit(1)
+
+    # ------------------------------- Read the cases ------------------------------ #
+    import probes
+    numbers = probes.resistor_numbers(resistor_data)
+    defaults = {'ambient': ambient_temp, 'h_cooling': options['h_cooling'], 'delta': delta,
+                'rho': substrate_layer_properties['Density'], 'cp': substrate_layer_properties['SpecificHeatCapacity'],
+                'k': substrate_layer_properties['ThermalConductivity']}
+    try:
+        cases = read_cases(cases_file, defaults, numbers)
+    except ValueError as e:
+        print(f"\033[91mError in cases file: {e}\033[0m")
+        sys.exit(1)
+
+    workers = max(1, min(workers, len(cases)))
+    tasks, num_groups = make_tasks(cases, options['mode'] == "steady", workers)
+    print(f"\n\033[92m{len(cases)} cases, {num_groups} distinct system matrices, {len(tasks)} tasks on {workers} worker(s)\033[0m\n")
+
+    settings = {'iterations': iterations, 'mode': options['mode'], 'stop_tol': options['stop_tol'], 'source': options['source'],
+                'solver': options['solver'], 'solver_rtol': options['solver_rtol']}
+
+    # ----------- Mesh once; the workers load the mesh from the mesh cache ----------- #
+    cache_dir = meshCache.cache_directory(options['mesh_cache'])
+    temporary_cache = tempfile.TemporaryDirectory() if cache_dir is None else None
+    if temporary_cache is not None:
+        cache_dir = temporary_cache.name
+
+    generate = lambda: generateOutputFiles.generate_mesh(layout_length, layout_width, resistor_data, s_sense, options['mesh_threads'], comm=MPI.COMM_SELF)
+    mesh_data = meshCache.cached_mesh(cache_dir, options['mesh_cache_mb'], layout_length, layout_width, resistor_data, s_sense, generate, comm=MPI.COMM_SELF)
+    key = meshCache.mesh_key(layout_length, layout_width, resistor_data, s_sense)
+
+    # ------------------------------- Run the cases ------------------------------- #
+    peak = np.full((len(cases), len(numbers)), np.nan)
+    mean = np.full((len(cases), len(numbers)), np.nan)
+    steps = np.zeros(len(cases), dtype=np.int64)
+
+    def collect(results):
+        for index, case_peak, case_mean, case_steps in results:
+            peak[index], mean[index], steps[index] = case_peak, case_mean, case_steps
+
+    try:
+        if workers == 1:
+            init_worker(cache_dir, key, resistor_data, settings, mesh_data)
+            for task in tqdm(tasks, desc="Sweep", unit="task"):
+                collect(run_task(task))
+        else:
+            # Spawned rather than forked: PETSc and MPI state must not be copied into the workers
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                                     initargs=(cache_dir, key, resistor_data, settings)) as pool:
+                futures = [pool.submit(run_task, task) for task in tasks]
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Sweep", unit="task"):
+                    collect(future.result())
+    finally:
+        if temporary_cache is not None:
+            temporary_cache.cleanup()
+
+    # ------------------------- One compact results file ------------------------- #
+    np.savez_compressed(output,
+                        case_names=np.array([case['name'] for case in cases]),
+                        parameter_names=np.array(CASE_PARAMETERS),
+                        parameters=np.array([[case[parameter] for parameter in CASE_PARAMETERS] for case in cases]),
+                        resistor_numbers=numbers,
+                        power=np.array([case_power(resistor_data, case['power']) for case in cases]),
+                        peak_temperature=peak,
+                        mean_temperature=mean,
+                        steps=steps)
+    print(f"\n\033[92mResults of {len(cases)} cases written to\033[0m \033[95m{output}\033[0m")
+
+
+if __name__ == '__main__':
+    sweep()
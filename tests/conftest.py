@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+
+# The Firebird modules live in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SUBSTRATE_LAYER = 5
+RESIST_LAYER = 1
+
+
+def new_cell(lib, name):
+    '''Adds a cell to lib only: gdspy also adds new cells to its global library, where names clash across tests.'''
+    import gdspy
+
+    cell = gdspy.Cell(name, exclude_from_current=True)
+    lib.add(cell)
+    return cell
+
+
+@pytest.fixture
+def write_layout(tmp_path):
+    '''
+    Returns a function writing a flat layout to a GDSII file: a substrate rectangle and resistor
+    rectangles given as ((x_min, y_min), (x_max, y_max), label), where label may be None.
+    '''
+    import gdspy
+
+    def write(resistors, substrate=((0, 0), (100, 50)), name="layout.gds"):
+        lib = gdspy.GdsLibrary()
+        cell = new_cell(lib, "TOP")
+        cell.add(gdspy.Rectangle(*substrate, layer=SUBSTRATE_LAYER))
+        for lower, upper, label in resistors:
+            cell.add(gdspy.Rectangle(lower, upper, layer=RESIST_LAYER))
+            if label is not None:
+                center = ((lower[0] + upper[0]) / 2, (lower[1] + upper[1]) / 2)
+                cell.add(gdspy.Label(label, center, layer=RESIST_LAYER))
+        file_name = str(tmp_path / name)
+        lib.write_gds(file_name)
+        return file_name
+
+    return write
@@ -0,0 +1,102 @@
+import numpy as np
+import extractGeometry
+from conftest import SUBSTRATE_LAYER, RESIST_LAYER, new_cell
+
+
+def match(labels, bounds):
+    '''Runs match_labels on boxes given as (x_min, x_max, y_min, y_max) with labels given as (x, y, text).'''
+    bounds = np.array(bounds, dtype=float)
+    centers = np.column_stack(((bounds[:, 0] + bounds[:, 1]) / 2, (bounds[:, 2] + bounds[:, 3]) / 2))
+    index = extractGeometry.LabelIndex([label[:2] for label in labels], [label[2] for label in labels])
+    return extractGeometry.match_labels(centers, bounds, index)
+
+
+def test_match_labels_valid_label():
+    (numbers, powers, centers, bounds), problems = match([(1, 1, "3#2.5")], [(0, 2, 0, 2)])
+    assert numbers.tolist() == [3]
+    assert powers.tolist() == [2.5]
+    assert centers.tolist() == [[1, 1]]
+    assert bounds.tolist() == [[0, 2, 0, 2]]
+    assert problems == []
+
+
+def test_match_labels_invalid_power_is_reported():
+    # The number parses but the power does not: the polygon must not become a resistor
+    (numbers, powers, _, _), problems = match([(1, 1, "3#abc")], [(0, 2, 0, 2)])
+    assert len(numbers) == 0 and len(powers) == 0
+    assert len(problems) == 1
+    assert "invalid label" in problems[0][1] and "3#abc" in problems[0][1]
+
+
+def test_match_labels_missing_label_is_reported():
+    (numbers, _, _, _), problems = match([(10, 10, "1#1.0")], [(0, 2, 0, 2)])
+    assert len(numbers) == 0
+    assert problems[0][1] == "no label"
+
+
+def test_match_labels_first_valid_label_wins():
+    (numbers, powers, _, _), problems = match([(0.5, 1, "x#y"), (1, 1, "4#1.5"), (1.5, 1, "5#9.0")], [(0, 2, 0, 2)])
+    assert numbers.tolist() == [4]
+    assert powers.tolist() == [1.5]
+    assert problems == []
+
+
+def test_read_gdsii_skips_bad_labels(write_layout, capsys):
+    gds = write_layout([((10, 10), (14, 12), "2#5.0"),
+                        ((30, 10), (34, 12), "3#abc"),
+                        ((50, 10), (54, 12), None),
+                        ((70, 10), (72, 13), "1#3.0")])
+    length, width, resistors = extractGeometry.read_gdsii(gds, SUBSTRATE_LAYER, RESIST_LAYER)
+
+    assert (length, width) == (100, 50)
+    assert resistors.numbers.tolist() == [1, 2]
+    assert resistors.power.tolist() == [3.0, 5.0]
+    assert np.allclose(resistors.length, [2, 4]) and np.allclose(resistors.width, [3, 2])
+    output = capsys.readouterr().out
+    assert "2 polygon(s) on the resistive layer were skipped" in output
+
+
+def write_hierarchical_layout(tmp_path):
+    '''
+    Writes a layout whose resistors are instances of one RES cell, placed by references with rotations,
+    a reflection, a magnification and an array, and labelled in the top cell at the placed centers.
+    '''
+    import gdspy
+
+    lib = gdspy.GdsLibrary()
+    resistor = new_cell(lib, "RES")
+    resistor.add(gdspy.Rectangle((0, 0), (4, 2), layer=RESIST_LAYER))
+    top = new_cell(lib, "TOP")
+    top.add(gdspy.Rectangle((0, 0), (100, 50), layer=SUBSTRATE_LAYER))
+
+    # Placements as (reference, centers of its instances)
+    placements = [(gdspy.CellReference(resistor, (10, 10)), [(12, 11)]),
+                  (gdspy.CellReference(resistor, (40, 10), rotation=90), [(39, 12)]),
+                  (gdspy.CellReference(resistor, (20, 40), magnification=2, x_reflection=True), [(24, 38)]),
+                  (gdspy.CellReference(resistor, (80, 10), rotation=45), [(80 + np.sqrt(0.5), 10 + 3 * np.sqrt(0.5))]),
+                  (gdspy.CellArray(resistor, 2, 1, (10, 0), (60, 30)), [(62, 31), (72, 31)])]
+    number = 1
+    for reference, centers in placements:
+        top.add(reference)
+        for center in centers:
+            top.add(gdspy.Label(f"{number}#{number * 1.5}", center, layer=RESIST_LAYER))
+            number += 1
+
+    file_name = str(tmp_path / "hierarchy.gds")
+    lib.write_gds(file_name)
+    return file_name
+
+
+def test_hierarchical_extraction_matches_flat(tmp_path):
+    gds = write_hierarchical_layout(tmp_path)
+    flat_length, flat_width, flat = extractGeometry.read_gdsii(gds, SUBSTRATE_LAYER, RESIST_LAYER)
+    length, width, hierarchical = extractGeometry.read_gdsii(gds, SUBSTRATE_LAYER, RESIST_LAYER, hierarchical=True)
+
+    assert (length, width) == (flat_length, flat_width) == (100, 50)
+    assert hierarchical.numbers.tolist() == flat.numbers.tolist() == [1, 2, 3, 4, 5, 6]
+    assert np.allclose(hierarchical.power, flat.power)
+    assert np.allclose(hierarchical.centers, flat.centers)
+    assert np.allclose(hierarchical.bounds, flat.bounds)
+    # Rotated by 90 degrees and magnified, reflected instances
+    assert np.allclose(hierarchical.bounds[1], [38, 40, 10, 14])
+    assert np.allclose(hierarchical.bounds[2], [20, 28, 36, 40])
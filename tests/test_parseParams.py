@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import parseParams
+
+
+def test_parse_points_none():
+    assert parseParams.parse_points("none").shape == (0, 2)
+
+
+def test_parse_points():
+    points = parseParams.parse_points("1:2; 3.5:-4;")
+    assert points.tolist() == [[1, 2], [3.5, -4]]
+
+
+@pytest.mark.parametrize("text", ["1:2:3;4:5:6", "1:2;3", "1;2", "1:y"])
+def test_parse_points_rejects_malformed_points(text, capsys):
+    # Three values per point used to be reshaped silently into different points
+    with pytest.raises(ValueError):
+        parseParams.parse_points(text)
+    assert "must be written as x:y" in capsys.readouterr().out
+
+
+def write_params(tmp_path, text):
+    params = tmp_path / "params.txt"
+    params.write_text("delta=0.1\nsubstrate=5\nresist=1\niterations=10\nambient=12\ns_sense=20.0\n" + text)
+    return str(params)
+
+
+def test_parse_options_defaults(tmp_path):
+    options = parseParams.parse_options(write_params(tmp_path, ""))
+    assert options == {name: default for name, (default, _, _) in parseParams.OPTIONAL_PARAMETERS.items()}
+
+
+def test_parse_options_values(tmp_path):
+    options = parseParams.parse_options(write_params(tmp_path, "source=dg0\n  output_every=5\nh_cooling=250\n"))
+    assert options['source'] == "dg0"
+    assert options['output_every'] == 5
+    assert options['h_cooling'] == 250.0 and isinstance(options['h_cooling'], float)
+
+
+def test_parse_options_only_matches_whole_lines(tmp_path):
+    # A name inside another setting or a comment is not that setting
+    options = parseParams.parse_options(write_params(tmp_path, "# source=dg0\n"))
+    assert options['source'] == parseParams.OPTIONAL_PARAMETERS['source'][0]
+
+
+@pytest.mark.parametrize("text, message", [("output_every=often\n", "Could not read a int value for 'output_every'"),
+                                           ("source=cellwise\n", "'source' must be one of")])
+def test_parse_options_rejects_bad_values(tmp_path, capsys, text, message):
+    with pytest.raises(ValueError):
+        parseParams.parse_options(write_params(tmp_path, text))
+    assert message in capsys.readouterr().out
+
+
+def test_parse_file(tmp_path):
+    assert parseParams.parse_file(write_params(tmp_path, "")) == (5, 1, 10, 0.1, 12.0, 20.0)
+
+
+def test_parse_file_ignores_options_ending_in_a_required_name(tmp_path):
+    # amr_max_iterations= used to be read as iterations= when it came first
+    params = tmp_path / "params.txt"
+    params.write_text("amr_max_iterations=3\ndelta=0.1\nsubstrate=5\nresist=1\niterations=10\nambient=12\ns_sense=20.0\n")
+    assert parseParams.parse_file(str(params))[2] == 10
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import powerProfiles
+
+OPTIONS = {'profile_file': "none", 'profile_interp': "step", 'profile_period': 0.0}
+
+
+def test_parse_profile():
+    times, powers = powerProfiles.parse_profile("0:0, 1e-3:5,2e-3:0")
+    assert times.tolist() == [0, 1e-3, 2e-3]
+    assert powers.tolist() == [0, 5, 0]
+
+
+@pytest.mark.parametrize("text", ["", "1:0,1:5", "2:0,1:5"])
+def test_parse_profile_requires_increasing_times(text):
+    with pytest.raises(ValueError):
+        powerProfiles.parse_profile(text)
+
+
+def test_read_params_profiles(tmp_path):
+    params = tmp_path / "params.txt"
+    params.write_text("delta=0.1\nprofile_3=0:1,1:2\n  profile_12=0:4\n")
+    profiles = powerProfiles.read_params_profiles(str(params))
+    assert sorted(profiles) == [3, 12]
+    assert profiles[3][1].tolist() == [1, 2]
+
+
+def test_read_profile_file(tmp_path):
+    profile_file = tmp_path / "profiles.csv"
+    profile_file.write_text("time, power_1,power_4\n0,1,2\n1,3,4\n")
+    profiles = powerProfiles.read_profile_file(str(profile_file))
+    assert sorted(profiles) == [1, 4]
+    assert profiles[4][0].tolist() == [0, 1] and profiles[4][1].tolist() == [2, 4]
+
+
+@pytest.mark.parametrize("text", ["t,power_1\n0,1\n", "time,current_1\n0,1\n", "time,power_1\n1,1\n0,2\n"])
+def test_read_profile_file_rejects_bad_files(tmp_path, text):
+    profile_file = tmp_path / "profiles.csv"
+    profile_file.write_text(text)
+    with pytest.raises(ValueError):
+        powerProfiles.read_profile_file(str(profile_file))
+
+
+def test_step_and_linear_power():
+    profiles = {2: (np.array([0.0, 1.0]), np.array([0.0, 10.0]))}
+    step = powerProfiles.PowerProfiles(np.array([1, 2, 3]), np.array([1.0, 2.0, 3.0]), profiles)
+    linear = powerProfiles.PowerProfiles(np.array([1, 2, 3]), np.array([1.0, 2.0, 3.0]), profiles, "linear")
+
+    # Resistors without a profile keep their constant power, the last power is held after the profile
+    assert step.power(0.5).tolist() == [1, 0, 3]
+    assert step.power(5.0).tolist() == [1, 10, 3]
+    assert linear.power(0.25).tolist() == [1, 2.5, 3]
+    assert linear.power(5.0).tolist() == [1, 10, 3]
+
+
+def test_periodic_power_on_the_union_of_breakpoints():
+    profiles = {1: (np.array([0.0, 1.0]), np.array([1.0, 2.0])), 2: (np.array([0.0, 0.5]), np.array([5.0, 6.0]))}
+    periodic = powerProfiles.PowerProfiles(np.array([1, 2]), np.zeros(2), profiles, period=2.0)
+    assert periodic.sample([0.0, 0.75, 1.5, 2.75]).tolist() == [[1, 5], [1, 6], [2, 6], [1, 6]]
+
+
+def test_profiles_of_unknown_resistors_are_rejected():
+    with pytest.raises(ValueError, match="not in the layout"):
+        powerProfiles.PowerProfiles(np.array([1, 2]), np.zeros(2), {7: (np.array([0.0]), np.array([1.0]))})
+
+
+def test_parameter_file_profiles_take_precedence(tmp_path):
+    profile_file = tmp_path / "profiles.csv"
+    profile_file.write_text("time,power_1,power_2\n0,1,2\n")
+    params = tmp_path / "params.txt"
+    params.write_text("profile_2=0:9\n")
+    options = dict(OPTIONS, profile_file=str(profile_file))
+
+    profiles = powerProfiles.profiles_from_params(str(params), options, np.array([1, 2]), np.zeros(2))
+    assert profiles.power(0.0).tolist() == [1, 9]
+    assert powerProfiles.profiles_from_params(str(params), OPTIONS, np.array([1, 2]), np.zeros(2)).power(0.0).tolist() == [0, 9]
+
+
+def test_no_profiles(tmp_path):
+    params = tmp_path / "params.txt"
+    params.write_text("delta=0.1\n")
+    assert powerProfiles.profiles_from_params(str(params), OPTIONS, np.array([1]), np.zeros(1)) is None
@@ -0,0 +1,45 @@
+import json
+import numpy as np
+import pytest
+import reducedModel
+from resistorTable import ResistorTable
+
+
+def test_layout_power_follows_the_given_numbers():
+    resistor_data = ResistorTable.from_columns([3, 1, 2], [30.0, 10.0, 20.0], [[5, 5], [1, 1], [3, 3]], np.zeros((3, 4)))
+    numbers = np.array([1, 2, 3])
+    assert reducedModel.layout_power(resistor_data, numbers).tolist() == [10, 20, 30]
+    # The error report looks up the powers of the columns owned by one rank
+    assert reducedModel.layout_power(resistor_data, numbers[1:]).tolist() == [20, 30]
+    with pytest.raises(KeyError):
+        reducedModel.layout_power(resistor_data, [4])
+
+
+def test_error_report():
+    full = np.array([[0.0, 0.0], [1.0, 2.0], [2.0, 4.0]])
+    reduced = full + np.array([[0.0, 0.0], [0.1, 0.0], [0.0, 0.2]])
+    report = reducedModel.error_report(full, reduced, np.array([5, 7]), 1.0, 0.01)
+
+    assert report['steps'] == 3
+    assert report['max_abs_error_K'] == pytest.approx(0.2)
+    assert report['final_max_abs_error_K'] == pytest.approx(0.2)
+    assert [resistor['resistor'] for resistor in report['per_resistor']] == [5, 7]
+    assert report['per_resistor'][0]['relative_to_range'] == pytest.approx(0.05)
+    assert report['reduced_steps_per_s'] == pytest.approx(300)
+
+
+def test_reduced_model_of_one_state(tmp_path):
+    # M dT/dt = -(K + H) T + G p + h T_ambient with one state, observed directly
+    model_file = str(tmp_path / "rom.npz")
+    meta = {'ambient': 10.0, 'delta': 0.5, 'iterations': 4}
+    np.savez(model_file, M=[[2.0]], K=[[1.0]], H=[[1.0]], G=[[3.0]], h=[1.0], C=[[1.0]], resistor_numbers=[1], power=[2.0], meta=json.dumps(meta))
+    model = reducedModel.ReducedThermalModel(model_file)
+
+    assert model.steady_state().tolist() == pytest.approx([8.0])
+    # Backward Euler with explicit cooling: (M/dt + K) x_{n+1} = (M/dt - H) x_n + G p + h T_ambient
+    x, expected = 0.0, []
+    for _ in range(4):
+        x = (3.0 * x + 16.0) / 5.0
+        expected.append(x)
+    assert model.simulate()[:, 0].tolist() == pytest.approx(expected)
+    assert model.simulate(power=[[0.0]] * 2, T_ambient=0.0).tolist() == [[0.0], [0.0]]
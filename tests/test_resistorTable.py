@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pytest
+import extractGeometry
+from resistorTable import ResistorTable
+from conftest import SUBSTRATE_LAYER, RESIST_LAYER
+
+
+def make_table():
+    # Extraction order is not number order
+    return ResistorTable.from_columns([3, 1, 2], [30.0, 10.0, 20.0], [[5, 5], [1, 1], [3, 3]],
+                                      [[4, 6, 4, 6], [0, 2, 0, 2], [2, 4, 1, 5]])
+
+
+def test_rows_are_sorted_by_number():
+    table = make_table()
+    assert table.numbers.tolist() == [1, 2, 3]
+    assert table.power.tolist() == [10, 20, 30]
+    assert table.centers.tolist() == [[1, 1], [3, 3], [5, 5]]
+    assert table.length.tolist() == [2, 2, 2] and table.width.tolist() == [2, 4, 2]
+    assert table.flux.tolist() == [2.5, 2.5, 7.5]
+
+
+def test_duplicate_centers_keep_the_last_polygon():
+    table = ResistorTable.from_columns([1, 2, 1], [1.0, 2.0, 5.0], [[1, 1], [3, 3], [1, 1]],
+                                       [[0, 2, 0, 2], [2, 4, 2, 4], [0, 2, 0, 2]])
+    assert table.numbers.tolist() == [1, 2]
+    assert table.power.tolist() == [5, 2]
+
+
+def test_index():
+    table = make_table()
+    assert table.index([3, 1]).tolist() == [2, 0]
+    assert table.index(2).tolist() == [1]
+
+
+@pytest.mark.parametrize("numbers", [[4], [0, 1], [2, 7]])
+def test_index_of_missing_numbers(numbers):
+    with pytest.raises(KeyError, match="not in the layout"):
+        make_table().index(numbers)
+
+
+def test_with_power_copies():
+    table = make_table()
+    scaled = table.with_power(1.0)
+    assert scaled.power.tolist() == [1, 1, 1]
+    assert table.power.tolist() == [10, 20, 30]
+
+
+def test_save_and_load(tmp_path):
+    table_file = str(tmp_path / "resistors.npz")
+    make_table().save(table_file, {'source_key': "abc"})
+    table, meta = ResistorTable.load(table_file)
+
+    assert np.array_equal(table.rows, make_table().rows)
+    assert meta['source_key'] == "abc"
+    assert os.listdir(tmp_path) == ["resistors.npz"]
+
+
+def test_load_rejects_other_files(tmp_path):
+    other_file = str(tmp_path / "other.npz")
+    np.savez(other_file, values=np.zeros(3))
+    with pytest.raises(ValueError, match="not a resistor table"):
+        ResistorTable.load(other_file)
+
+
+def test_read_gdsii_reuses_the_table_until_the_layout_changes(write_layout, tmp_path, capsys):
+    table_file = str(tmp_path / "resistors.npz")
+    gds = write_layout([((10, 10), (14, 12), "1#2.0")])
+    extractGeometry.read_gdsii(gds, SUBSTRATE_LAYER, RESIST_LAYER, table_file=table_file)
+    assert "written" in capsys.readouterr().out
+
+    length, width, table = extractGeometry.read_gdsii(gds, SUBSTRATE_LAYER, RESIST_LAYER, table_file=table_file)
+    assert "reused" in capsys.readouterr().out
+    assert (length, width) == (100, 50) and table.numbers.tolist() == [1]
+
+    # A changed layout, or another extraction mode, is extracted again
+    write_layout([((10, 10), (14, 12), "1#2.0"), ((20, 10), (24, 12), "2#1.0")])
+    _, _, table = extractGeometry.read_gdsii(gds, SUBSTRATE_LAYER, RESIST_LAYER, table_file=table_file)
+    assert "reused" not in capsys.readouterr().out
+    assert table.numbers.tolist() == [1, 2]
+    extractGeometry.read_gdsii(gds, SUBSTRATE_LAYER, RESIST_LAYER, hierarchical=True, table_file=table_file)
+    assert "reused" not in capsys.readouterr().out
@@ -0,0 +1,386 @@
+# ==============================================================================================
+# Firebird worker: a long-lived process pool that runs simulation jobs back to back
+# ==============================================================================================
+#
+# Example:
+#   python worker.py serve --root firebird_jobs --workers 2 --socket /tmp/firebird.sock
+#   python worker.py submit skripsieTest.gds defLayers.xml defParams.txt --root firebird_jobs
+#   python worker.py submit skripsieTest.gds defLayers.xml defParams.txt --socket /tmp/firebird.sock
+#   python worker.py status --root firebird_jobs
+#
+# Every worker process imports dolfinx, PETSc, GMSH and the Firebird modules once and then runs jobs
+# one after the other, so a job only pays for its own parsing, meshing and solving. Forms compiled by
+# an earlier job are loaded from the FFCx cache instead of being compiled again.
+#
+# Jobs are submitted by dropping a JSON file {"gds": ..., "xml": ..., "params": ...} into <root>/queue
+# (the submit command writes it atomically), or through the Unix socket as one JSON line per request.
+# Every job gets its own directory <root>/<job id> as working directory. The simulation output,
+# log.txt with everything the job printed, and status.json (queued, running, done or failed, with
+# timings and the error of a failed job) all go there. A failing job is recorded as failed and the
+# worker carries on. When a worker process dies, the jobs that were running in the pool are retried
+# one at a time in a fresh pool, so the job that kills its process again is marked failed on its own.
+
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import socket
+import threading
+import traceback
+import socketserver
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import click
+
+QUEUE_DIR = "queue"
+STATUS_FILE = "status.json"
+JOB_FILE = "job.json"
+LOG_FILE = "log.txt"
+# Attempts of a job whose worker process died before it is marked failed
+MAX_ATTEMPTS = 2
+
+
+# ---------------------------------------------------------------------------- #
+#                                  Job records                                 #
+# ---------------------------------------------------------------------------- #
+def read_status(job_dir: str):
+    '''Returns the status of a job, or an empty dictionary if it has none yet.'''
+    try:
+        with open(os.path.join(job_dir, STATUS_FILE), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_status(job_dir: str, **fields):
+    '''Updates the status of a job. The file is replaced atomically, so readers never see a partial file.'''
+    status = read_status(job_dir)
+    status.update(fields)
+    temporary = os.path.join(job_dir, f".{STATUS_FILE}.{os.getpid()}")
+    with open(temporary, 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(temporary, os.path.join(job_dir, STATUS_FILE))
+
+
+def create_job(root: str, job: dict):
+    '''Creates the directory and queued status of a job and returns its id.'''
+    job_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    job_dir = os.path.join(root, job_id)
+    os.makedirs(job_dir)
+    with open(os.path.join(job_dir, JOB_FILE), 'w') as f:
+        json.dump(job, f, indent=2)
+    write_status(job_dir, job=job_id, state="queued", submitted=time.time(), attempts=0)
+    return job_id
+
+
+def validate_job(job: dict):
+    '''Checks a job request and returns it with absolute input paths.'''
+    missing = [key for key in ("gds", "xml", "params") if key not in job]
+    if missing:
+        raise ValueError(f"Job is missing {', '.join(missing)}")
+    return {key: os.path.abspath(job[key]) for key in ("gds", "xml", "params")}
+
+
+# ---------------------------------------------------------------------------- #
+#                           Inside the worker processes                        #
+# ---------------------------------------------------------------------------- #
+def init_process():
+    '''Imports the simulation modules, which Firebird itself only loads on demand, once per worker process.'''
+    import Firebird
+    import heatFlow
+    import generateOutputFiles
+    import meshCache
+
+
+def run_job(job_dir: str, job: dict):
+    '''
+    Runs one job in its directory with stdout and stderr, including the output of PETSc and GMSH,
+    redirected to its log file. Every error of the job is recorded in its status instead of raised.
+    '''
+    import Firebird
+
+    write_status(job_dir, state="running", started=time.time(), pid=os.getpid())
+    start = time.perf_counter()
+    working_dir = os.getcwd()
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1), os.dup(2))
+
+    with open(os.path.join(job_dir, LOG_FILE), 'w') as log:
+        os.dup2(log.fileno(), 1)
+        os.dup2(log.fileno(), 2)
+        try:
+            os.chdir(job_dir)
+            Firebird.run_simulation(job['gds'], job['xml'], job['params'])
+            state, error = "done", None
+        except (Exception, SystemExit) as e:
+            # SystemExit too: library code that exits must end the job, not the worker
+            traceback.print_exc()
+            state, error = "failed", f"{type(e).__name__}: {e}"
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved_fds[0], 1)
+            os.dup2(saved_fds[1], 2)
+            for fd in saved_fds:
+                os.close(fd)
+            os.chdir(working_dir)
+
+    outputs = sorted(name for name in os.listdir(job_dir) if name not in (STATUS_FILE, JOB_FILE, LOG_FILE) and not name.startswith('.'))
+    write_status(job_dir, state=state, finished=time.time(), elapsed_s=time.perf_counter() - start, error=error, outputs=outputs)
+    return state
+
+
+# ---------------------------------------------------------------------------- #
+#                                 Unix socket                                  #
+# ---------------------------------------------------------------------------- #
+class JobRequestHandler(socketserver.StreamRequestHandler):
+    '''Answers one JSON request per line: {"action": "submit", "gds", "xml", "params"} or {"action": "status", "job"}.'''
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if request.get("action", "submit") == "submit":
+                    job_id = self.server.worker.submit(validate_job(request))
+                    reply = {'job': job_id, 'dir': os.path.join(self.server.worker.root, job_id)}
+                elif request["action"] == "status":
+                    reply = read_status(os.path.join(self.server.worker.root, os.path.basename(request["job"])))
+                else:
+                    reply = {'error': f"Unknown action '{request['action']}'"}
+            except (ValueError, KeyError, OSError) as e:
+                reply = {'error': str(e)}
+            self.wfile.write((json.dumps(reply) + "\n").encode())
+
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, worker):
+        self.worker = worker
+        super().__init__(path, JobRequestHandler)
+
+
+# ---------------------------------------------------------------------------- #
+#                                  The worker                                  #
+# ---------------------------------------------------------------------------- #
+class JobWorker:
+    '''
+    Runs the jobs of a job root on a bounded pool of warm worker processes.
+
+    Args:
+        root (str): Job root directory, with the queue directory and one directory per job.
+        workers (int): Number of worker processes, i.e. jobs run at once.
+        poll_interval (float): Seconds between scans of the queue directory.
+    '''
+
+    def __init__(self, root: str, workers: int = 1, poll_interval: float = 1.0):
+        self.root = os.path.abspath(root)
+        self.queue_dir = os.path.join(self.root, QUEUE_DIR)
+        os.makedirs(self.queue_dir, exist_ok=True)
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.pending = queue.Queue()
+        self.retry = deque()
+        self.running = {}
+        self.isolated = None
+        self.pool = None
+
+    def submit(self, job: dict):
+        '''Creates a job and queues it for the pool. Safe to call from the socket threads.'''
+        job_id = create_job(self.root, job)
+        self.pending.put(job_id)
+        print(f"Queued job \033[95m{job_id}\033[0m")
+        return job_id
+
+    def recover(self):
+        '''Queues the jobs that were queued or running when a previous worker stopped; the running ones are retried in isolation.'''
+        for job_id in sorted(os.listdir(self.root)):
+            state = read_status(os.path.join(self.root, job_id)).get("state")
+            if state == "queued":
+                self.pending.put(job_id)
+            elif state == "running":
+                self.retry.append(job_id)
+            if state in ("queued", "running"):
+                print(f"Recovered job \033[95m{job_id}\033[0m")
+
+    def scan_queue(self):
+        '''Turns the job files in the queue directory into jobs.'''
+        for name in sorted(os.listdir(self.queue_dir)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.queue_dir, name)
+            try:
+                with open(path, 'r') as f:
+                    job = validate_job(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"\033[91mSkipping invalid job file {name}: {e}\033[0m")
+                os.replace(path, f"{path}.invalid")
+                continue
+            self.submit(job)
+            os.remove(path)
+
+    def _start_pool(self):
+        # Spawned rather than forked: PETSc and MPI state must not be copied into the workers
+        context = multiprocessing.get_context("spawn")
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=init_process)
+
+    def _submit(self, job_id: str):
+        job_dir = os.path.join(self.root, job_id)
+        with open(os.path.join(job_dir, JOB_FILE), 'r') as f:
+            job = json.load(f)
+        write_status(job_dir, attempts=read_status(job_dir).get("attempts", 0) + 1)
+        future = self.pool.submit(run_job, job_dir, job)
+        self.running[future] = job_id
+        return future
+
+    def _dispatch(self):
+        '''Hands pending jobs to the pool until every worker process is busy.'''
+        # Jobs that were running when a worker process died are rerun alone, so a job that kills its
+        # process again is identified and takes no other job down with it
+        if self.isolated is not None:
+            return
+        if self.retry:
+            if not self.running:
+                self.isolated = self._submit(self.retry.popleft())
+            return
+
+        while len(self.running) < self.workers:
+            try:
+                job_id = self.pending.get_nowait()
+            except queue.Empty:
+                return
+            self._submit(job_id)
+
+    def _collect(self, timeout: float):
+        '''Waits up to timeout for running jobs and records the finished ones.'''
+        if not self.running:
+            time.sleep(timeout)
+            return
+        done, _ = wait(list(self.running), timeout=timeout, return_when=FIRST_COMPLETED)
+        broken = False
+        for future in done:
+            job_id = self.running.pop(future)
+            job_dir = os.path.join(self.root, job_id)
+            if future is self.isolated:
+                self.isolated = None
+            try:
+                state = future.result()
+                colour = "92" if state == "done" else "91"
+                print(f"Job \033[95m{job_id}\033[0m \033[{colour}m{state}\033[0m ({read_status(job_dir).get('elapsed_s', 0.0):.1f} s)")
+            except BrokenProcessPool:
+                # A worker process died; every job running in the pool is lost with it
+                broken = True
+                if read_status(job_dir).get("attempts", 0) < MAX_ATTEMPTS:
+                    write_status(job_dir, state="queued")
+                    self.retry.append(job_id)
+                else:
+                    write_status(job_dir, state="failed", finished=time.time(), error="Worker process died while running the job")
+                    print(f"Job \033[95m{job_id}\033[0m \033[91mfailed: worker process died\033[0m")
+
+        if broken:
+            print("\033[103mA worker process died, restarting the pool\033[0m")
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self._start_pool()
+
+    def serve(self, socket_path: str = None):
+        '''Runs jobs until interrupted.'''
+        self._start_pool()
+        self.recover()
+
+        server = None
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = JobServer(socket_path, self)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            print(f"Listening on \033[95m{socket_path}\033[0m")
+        print(f"Watching \033[95m{self.queue_dir}\033[0m with {self.workers} worker process(es)")
+
+        try:
+            while True:
+                self.scan_queue()
+                self._dispatch()
+                self._collect(self.poll_interval)
+        except KeyboardInterrupt:
+            print("\nStopping; unfinished jobs are picked up again by the next worker")
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+                os.remove(socket_path)
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+# ---------------------------------------------------------------------------- #
+#                                 Command line                                 #
+# ---------------------------------------------------------------------------- #
+@click.group()
+def cli():
+    """Run Firebird simulations on a long-lived pool of warm worker processes."""
+
+
+@cli.command()
+@click.option('--root', default="firebird_jobs", show_default=True, help="Job root directory.")
+@click.option('--workers', default=1, show_default=True, help="Jobs run at once.")
+@click.option('--socket', 'socket_path', default=None, help="Unix socket to accept jobs on, in addition to the queue directory.")
+@click.option('--poll', 'poll_interval', default=1.0, show_default=True, help="Seconds between scans of the queue directory.")
+def serve(root, workers, socket_path, poll_interval):
+    """Run the jobs of ROOT until interrupted."""
+    JobWorker(root, workers, poll_interval).serve(socket_path)
+
+
+@cli.command()
+@click.argument('gds_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('xml_file', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.argument('params', type=click.Path(exists=True, dir_okay=False, file_okay=True, resolve_path=True))
+@click.option('--root', default="firebird_jobs", show_default=True, help="Job root directory.")
+@click.option('--socket', 'socket_path', default=None, help="Submit through the worker's Unix socket instead of the queue directory.")
+def submit(gds_file, xml_file, params, root, socket_path):
+    """Submit a simulation of GDS_FILE with XML_FILE and PARAMS."""
+    job = {'gds': gds_file, 'xml': xml_file, 'params': params}
+    if socket_path is not None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            connection.sendall((json.dumps({'action': 'submit', **job}) + "\n").encode())
+            connection.shutdown(socket.SHUT_WR)
+            reply = json.loads(connection.makefile().readline())
+        if 'error' in reply:
+            print(f"\033[91m{reply['error']}\033[0m")
+            sys.exit(1)
+        print(f"Submitted job \033[95m{reply['job']}\033[0m ({reply['dir']})")
+        return
+
+    # Written under a temporary name and renamed, so the worker never reads a partial file
+    queue_dir = os.path.join(root, QUEUE_DIR)
+    os.makedirs(queue_dir, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.json"
+    with open(os.path.join(queue_dir, f".{name}.tmp"), 'w') as f:
+        json.dump(job, f)
+    os.replace(os.path.join(queue_dir, f".{name}.tmp"), os.path.join(queue_dir, name))
+    print(f"Queued \033[95m{name}\033[0m in {queue_dir}")
+
+
+@cli.command()
+@click.argument('job', required=False)
+@click.option('--root', default="firebird_jobs", show_default=True, help="Job root directory.")
+def status(job, root):
+    """Show the status of JOB, or of every job in ROOT."""
+    if job is not None:
+        print(json.dumps(read_status(os.path.join(root, job)), indent=2))
+        return
+
+    print(f"{'job':<26} {'state':<8} {'elapsed (s)':>11}  error")
+    for job_id in sorted(os.listdir(root)):
+        job_status = read_status(os.path.join(root, job_id))
+        if job_status:
+            elapsed = job_status.get('elapsed_s')
+            print(f"{job_id:<26} {job_status['state']:<8} {'' if elapsed is None else f'{elapsed:.1f}':>11}  {job_status.get('error') or ''}")
+
+
+if __name__ == '__main__':
+    cli()